@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+import metrics
+
+log = logging.getLogger('pricer.admission')
+
+# Admission control of the pricing endpoints
+# At most PRICER_MAX_ACTIVE pricing requests run at once, the next ones wait in a FIFO queue of PRICER_MAX_QUEUE requests.
+# A client (X-Client-Id header, else its address) has at most PRICER_MAX_CLIENT_REQUESTS requests running or waiting.
+# Requests beyond these limits, or waiting longer than PRICER_QUEUE_TIMEOUT, get a 429 right away instead of piling up
+# in the server. The time spent waiting is reported apart from the pricing stages: in Server-Timing ('queue') and in
+# /metrics (pricer_queue_wait_seconds).
+
+# Pricing requests running at once, 0 disables admission control
+MAX_ACTIVE = int(os.environ.get('PRICER_MAX_ACTIVE', 8))
+# Pricing requests waiting for a slot
+MAX_QUEUE = int(os.environ.get('PRICER_MAX_QUEUE', 64))
+# Pricing requests of one client running or waiting, 0 for no limit
+MAX_CLIENT_REQUESTS = int(os.environ.get('PRICER_MAX_CLIENT_REQUESTS', 16))
+# Seconds a request may wait for a slot
+QUEUE_TIMEOUT = float(os.environ.get('PRICER_QUEUE_TIMEOUT', 30))
+
+# Paths of the pricing endpoints (and their sub paths), /live connections are long lived and not limited
+PRICING_PATHS = ['/webpricer', '/bulkwebpricer', '/portfolio', '/scenarios', '/impliedvolatility']
+REJECT_REASONS = ['client', 'queue', 'timeout']
+
+_active = 0
+# Futures of the waiting requests, first in first out
+_waiting = deque()
+# {client: requests running or waiting}
+_clients = {}
+_rejected = {reason: 0 for reason in REJECT_REASONS}
+# Queue wait histogram: [cumulative bucket counts..., sum, count]
+_queue_wait = [0] * (len(metrics.BUCKETS) + 2)
+
+
+def _observe_wait(seconds):
+    for i, bound in enumerate(metrics.BUCKETS):
+        if seconds <= bound:
+            _queue_wait[i] += 1
+    _queue_wait[-2] += seconds
+    _queue_wait[-1] += 1
+    metrics.add_to_trace('queue', seconds)
+
+
+# Wait for a slot, returns None once admitted or the reason of the rejection
+async def acquire(client):
+    global _active
+    if MAX_CLIENT_REQUESTS > 0 and _clients.get(client, 0) >= MAX_CLIENT_REQUESTS:
+        return 'client'
+    started = time.perf_counter()
+    if _active < MAX_ACTIVE and not _waiting:
+        _active += 1
+    elif len(_waiting) >= MAX_QUEUE:
+        return 'queue'
+    else:
+        slot = asyncio.get_running_loop().create_future()
+        _waiting.append(slot)
+        _clients[client] = _clients.get(client, 0) + 1
+        try:
+            await asyncio.wait_for(asyncio.shield(slot), QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Handed a slot just as the request was cancelled: pass it on
+            if slot.done():
+                _release_slot()
+            else:
+                _waiting.remove(slot)
+            raise
+        finally:
+            _release_client(client)
+        # A slot handed over as the wait timed out is taken
+        if not slot.done():
+            _waiting.remove(slot)
+            return 'timeout'
+    _clients[client] = _clients.get(client, 0) + 1
+    _observe_wait(time.perf_counter() - started)
+    return None
+
+
+def _release_client(client):
+    _clients[client] -= 1
+    if not _clients[client]:
+        del _clients[client]
+
+
+# Hand the slot over to the first waiting request, or free it
+def _release_slot():
+    global _active
+    if _waiting:
+        _waiting.popleft().set_result(None)
+    else:
+        _active -= 1
+
+
+def release(client):
+    _release_client(client)
+    _release_slot()
+
+
+# Admission gauges & counters and the queue wait histogram in the Prometheus text exposition format
+def render():
+    lines = [
+        '# HELP pricer_active_requests Pricing requests running.',
+        '# TYPE pricer_active_requests gauge',
+        f'pricer_active_requests {_active}',
+        '# HELP pricer_queued_requests Pricing requests waiting for a slot.',
+        '# TYPE pricer_queued_requests gauge',
+        f'pricer_queued_requests {len(_waiting)}',
+        '# HELP pricer_rejected_requests_total Pricing requests rejected with a 429.',
+        '# TYPE pricer_rejected_requests_total counter'
+    ]
+    for reason in REJECT_REASONS:
+        lines.append(f'pricer_rejected_requests_total{{reason="{reason}"}} {_rejected[reason]}')
+    lines += [
+        '# HELP pricer_queue_wait_seconds Time pricing requests waited for a slot.',
+        '# TYPE pricer_queue_wait_seconds histogram'
+    ]
+    for bound, bucket_count in zip(metrics.BUCKETS, _queue_wait):
+        lines.append(f'pricer_queue_wait_seconds_bucket{{le="{bound!r}"}} {bucket_count}')
+    lines.append(f'pricer_queue_wait_seconds_bucket{{le="+Inf"}} {_queue_wait[-1]}')
+    lines.append(f'pricer_queue_wait_seconds_sum {_queue_wait[-2]}')
+    lines.append(f'pricer_queue_wait_seconds_count {_queue_wait[-1]}')
+    return "\n".join(lines) + "\n"
+
+
+def _client(scope):
+    for name, value in scope.get('headers', []):
+        if name == b'x-client-id' and value:
+            return value.decode('latin-1')
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+def _is_pricing(path):
+    return any(path == prefix or path.startswith(prefix + '/') for prefix in PRICING_PATHS)
+
+
+# ASGI middleware admitting the pricing requests, see above
+class AdmissionMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or MAX_ACTIVE <= 0 or not _is_pricing(scope['path']):
+            await self.app(scope, receive, send)
+            return
+        client = _client(scope)
+        reason = await acquire(client)
+        if reason is not None:
+            _rejected[reason] += 1
+            log.warning("Request rejected", extra={'fields': {'path': scope['path'], 'client': client, 'reason': reason,
+                                                               'active': _active, 'queued': len(_waiting)}})
+            await _reject(send, reason)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            release(client)
+
+
+async def _reject(send, reason):
+    if reason == 'client':
+        detail = f"Too many requests of this client: at most {MAX_CLIENT_REQUESTS} at once. Retry later."
+    elif reason == 'queue':
+        detail = f"Server busy: {len(_waiting)} requests queued. Retry later."
+    else:
+        detail = f"Server busy: no slot within {QUEUE_TIMEOUT:g} seconds, {len(_waiting)} requests queued. Retry later."
+    body = detail.encode()
+    headers = [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(body)).encode()),
+               (b'retry-after', b'1'), (b'x-queue-depth', str(len(_waiting)).encode())]
+    await send({'type': 'http.response.start', 'status': 429, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,77 @@
+import json
+
+from pricer import OPTION_FIELDS, OPTIONAL_OPTION_FIELDS, NUMERIC_FIELDS, RESULT_FIELDS, MONTE_CARLO_FIELDS
+
+
+# Columnar (struct of arrays) bulk format
+# Request : {"engine": "vectorized", "columns": {"CURRENCY_PAIR": ["EURUSD", ...], "SPOT": [1.08, ...], ...}}
+#           NUMERIC_FIELDS columns hold numbers (null or "" when empty), the others strings;
+#           UPPER_BARRIER, LOWER_BARRIER, WINDOW_START_DATE, WINDOW_END_DATE, AMERICAN_ENGINE, PATHS, SEED &
+#           VARIANCE_REDUCTION columns may be left out
+# Response: {"PREMIUM": [...], "DELTA": [...], ..., "OPTION_NPV": [...], "STD_ERROR": [...], "PATHS": [...], "RuntimeError": [...]}
+#           one element per row, null where the row has an error (or no error, or is not priced by path simulation)
+OPTIONAL_FIELDS = ['UPPER_BARRIER', 'LOWER_BARRIER', 'WINDOW_START_DATE', 'WINDOW_END_DATE'] + OPTIONAL_OPTION_FIELDS
+
+
+# Numbers are kept as they are: the engines & the result cache keys read numbers and strings alike
+def _cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return str(value)
+
+
+# Parse a columnar request body into (engine, rows), rows being dicts as the row-wise endpoints price, with the
+# NUMERIC_FIELDS as numbers ("" when empty) instead of strings
+# Returns the engine, the rows and the list of errors
+def parse_columns(body):
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return None, None, ["Invalid JSON body."]
+    if not isinstance(payload, dict) or not isinstance(payload.get('columns'), dict):
+        return None, None, ["Invalid columnar payload. Ex: {\"engine\": \"vectorized\", \"columns\": {\"CURRENCY_PAIR\": [\"EURUSD\"], ...}}"]
+    engine = payload.get('engine', 'vectorized')
+    columns = payload['columns']
+
+    errors = []
+    missing = [field for field in OPTION_FIELDS if field not in columns and field not in OPTIONAL_FIELDS]
+    if missing:
+        errors.append(f"Missing columns: {', '.join(missing)}.")
+    fields = OPTION_FIELDS + OPTIONAL_OPTION_FIELDS
+    present = [field for field in fields if field in columns]
+    if any(not isinstance(columns[field], list) for field in present):
+        errors.append("Every column must be an array.")
+    elif len(set(len(columns[field]) for field in present)) > 1:
+        errors.append("Every column must have the same length.")
+    if errors:
+        return engine, None, errors
+
+    size = len(columns[present[0]]) if present else 0
+    cells = {}
+    for field in fields:
+        if field not in columns:
+            cells[field] = [""] * size
+        elif field in NUMERIC_FIELDS:
+            cells[field] = [_cell(value) for value in columns[field]]
+        else:
+            cells[field] = ["" if value is None else str(value) for value in columns[field]]
+    rows = [dict(zip(fields, values)) for values in zip(*(cells[field] for field in fields))]
+    return engine, rows, []
+
+
+# Columnar response of the (index, result) pairs of a batch, in row order
+def results_to_columns(option_values):
+    columns = {field: [] for field in RESULT_FIELDS + MONTE_CARLO_FIELDS}
+    columns['RuntimeError'] = []
+    for _, value in option_values:
+        if isinstance(value, list):
+            for field in RESULT_FIELDS + MONTE_CARLO_FIELDS:
+                columns[field].append(None)
+            columns['RuntimeError'].append(value[0])
+        else:
+            for field in RESULT_FIELDS + MONTE_CARLO_FIELDS:
+                columns[field].append(value.get(field))
+            columns['RuntimeError'].append(None)
+    return columns
@@ -0,0 +1,116 @@
+import re
+from datetime import date, datetime
+
+import QuantLib as ql
+
+# Date service of the MATURITY handling: the evaluation date, the expiry & delivery dates of each MATURITY per currency
+# pair calendar and the parsed date strings are kept in tables of the day, dropped at the day roll. Rows sharing
+# a MATURITY & pair resolve their dates with one dictionary lookup.
+# Tenors ('1D', '2W', '12M', '10Y') count from the evaluation date, their expiry is adjusted to a business day of the
+# pair's calendar (following, modified following for months & years). Dates ('29Sep2023') are taken as given.
+# Delivery is SPOT_DAYS business days after expiry and settlement SPOT_DAYS business days after evaluation.
+
+TENOR_UNITS = {'D': ql.Days, 'W': ql.Weeks, 'M': ql.Months, 'Y': ql.Years}
+TENOR = re.compile(r'^(\d+)([DWMY])$', re.IGNORECASE)
+# Business days from expiry to delivery, and from evaluation to settlement
+SPOT_DAYS = 2
+
+# Holiday calendar per currency, a pair's calendar joins both of its currencies'
+CURRENCY_CALENDARS = {
+    'USD': ql.UnitedStates(ql.UnitedStates.Settlement),
+    'EUR': ql.TARGET(),
+    'GBP': ql.UnitedKingdom(),
+    'AUD': ql.Australia(),
+    'NZD': ql.NewZealand(),
+    'CAD': ql.Canada(),
+    'CHF': ql.Switzerland(),
+    'JPY': ql.Japan()
+}
+
+# Pairs' calendars, the same every day
+_calendars = {}
+# Tables of the day: 'today', 'evaluation_date', 'maturities' {(MATURITY, pair): ((expiry, delivery), error)},
+# 'dates' {date string: ql.Date or None}, 'settlement' {pair: ql.Date}
+_day = {'today': None}
+
+
+def _tables():
+    today = date.today()
+    if _day['today'] != today:
+        _day.clear()
+        _day.update(today=today, evaluation_date=ql.Date(today.day, today.month, today.year), maturities={}, dates={},
+                    settlement={})
+    return _day
+
+
+def today():
+    return _tables()['today']
+
+
+def evaluation_date():
+    return _tables()['evaluation_date']
+
+
+# Calendar of a currency pair, the joint holidays of its currencies known in CURRENCY_CALENDARS
+def pair_calendar(currency_pair):
+    currency_pair = str(currency_pair).upper()
+    if currency_pair not in _calendars:
+        calendars = [CURRENCY_CALENDARS[currency] for currency in [currency_pair[0:3], currency_pair[3:6]] if currency in CURRENCY_CALENDARS]
+        if not calendars:
+            calendar = ql.WeekendsOnly()
+        elif len(calendars) == 1 or calendars[0].name() == calendars[1].name():
+            calendar = calendars[0]
+        else:
+            calendar = ql.JointCalendar(calendars[0], calendars[1])
+        _calendars[currency_pair] = calendar
+    return _calendars[currency_pair]
+
+
+# QuantLib date of a '29Sep2023' string, None if it is not one
+def parse_date(value):
+    dates = _tables()['dates']
+    if value not in dates:
+        try:
+            parsed = datetime.strptime(value, "%d%b%Y").date()
+            dates[value] = ql.Date(parsed.day, parsed.month, parsed.year)
+        except ValueError:
+            dates[value] = None
+    return dates[value]
+
+
+def settlement_date(currency_pair):
+    tables = _tables()
+    currency_pair = str(currency_pair).upper()
+    if currency_pair not in tables['settlement']:
+        tables['settlement'][currency_pair] = pair_calendar(currency_pair).advance(tables['evaluation_date'], SPOT_DAYS, ql.Days)
+    return tables['settlement'][currency_pair]
+
+
+# Expiry & delivery dates of a MATURITY ('29Sep2023' or a tenor) for a currency pair
+# Returns ((expiry date, delivery date), None) or (None, error message)
+def maturity_dates(maturity, currency_pair):
+    tables = _tables()
+    key = (maturity, str(currency_pair).upper())
+    if key not in tables['maturities']:
+        tables['maturities'][key] = _maturity_dates(maturity, key[1], tables['evaluation_date'])
+    return tables['maturities'][key]
+
+
+def _maturity_dates(maturity, currency_pair, evaluation):
+    calendar = pair_calendar(currency_pair)
+    tenor = TENOR.match(str(maturity).strip())
+    if tenor is not None:
+        length, unit = int(tenor.group(1)), TENOR_UNITS[tenor.group(2).upper()]
+        if length <= 0:
+            return None, "MATURITY must be after today's date."
+        convention = ql.ModifiedFollowing if unit in [ql.Months, ql.Years] else ql.Following
+        expiry = calendar.adjust(evaluation + ql.Period(length, unit), convention)
+    else:
+        expiry = parse_date(str(maturity).strip())
+        if expiry is None:
+            return None, "Invalid MATURITY format. Ex: 29Sep2023, 1m, 3M, 12M, 1y, 1w, 1d."
+        if expiry < evaluation:
+            return None, "MATURITY is before today's date."
+        if expiry == evaluation:
+            return None, "MATURITY must be after today's date."
+    return (expiry, calendar.advance(expiry, SPOT_DAYS, ql.Days)), None
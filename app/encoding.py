@@ -0,0 +1,229 @@
+import json
+import os
+import zlib
+
+from fastapi.responses import Response
+
+from pricer import RESULT_FIELDS, MONTE_CARLO_FIELDS
+
+# orjson, msgpack and brotli are optional: JSON falls back to the json module, the MessagePack encoding and brotli
+# compression are only offered when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response encodings of the priced rows of /webpricer, /bulkwebpricer and /bulkwebpricer/stream, by Accept header
+# JSON     application/json (default): the results as before, [index, result] pairs
+# COMPACT  application/vnd.webpricer.compact+json: {"FIELDS": [...], "ROWS": [[index, value, ...], ...]}, the values
+#          of each row in FIELDS order (null if the row has no such field), [index, {"RuntimeError": ...}] for errors
+# MSGPACK  application/msgpack: the compact form in MessagePack
+# Responses of every endpoint are compressed (brotli or gzip, by Accept-Encoding) by CompressionMiddleware.
+
+JSON = 'application/json'
+COMPACT = 'application/vnd.webpricer.compact+json'
+MSGPACK = 'application/msgpack'
+# Media types of the streamed results, by encoding: NDJSON lines, or MessagePack objects one after the other
+STREAM_MEDIA_TYPES = {JSON: 'application/x-ndjson', COMPACT: 'application/vnd.webpricer.compact+x-ndjson', MSGPACK: MSGPACK}
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('PRICER_COMPRESSION_MIN_SIZE', 1024))
+# zlib level of gzip and brotli quality: fast ones, responses are compressed on the fly
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def encodings():
+    return [JSON, COMPACT] + ([MSGPACK] if msgpack is not None else [])
+
+
+def _parse_header(value):
+    preferences = []
+    for item in value.split(','):
+        parts = item.strip().split(';')
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, number = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        if parts[0]:
+            preferences.append((parts[0].strip().lower(), quality))
+    return preferences
+
+
+# Encoding of the results asked for by an Accept header, JSON by default
+def negotiate(accept):
+    best, best_quality = JSON, 0.0
+    for media_type, quality in _parse_header(accept or ''):
+        if media_type == 'application/x-msgpack':
+            media_type = MSGPACK
+        if media_type in encodings() and quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+# numpy scalars & co as Python floats
+def _default(value):
+    return float(value)
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, separators=(',', ':'), default=_default).encode()
+
+
+def _fields(values):
+    if any(isinstance(value, dict) and 'STD_ERROR' in value for value in values):
+        return RESULT_FIELDS + MONTE_CARLO_FIELDS
+    return RESULT_FIELDS
+
+
+def _compact_row(index, value, fields):
+    if isinstance(value, list):
+        return [index, {"RuntimeError": value[0]}]
+    if 'RuntimeError' in value:
+        return [index, value]
+    return [index] + [value.get(field) for field in fields]
+
+
+# Compact form of (index, result) pairs, results being CALCULATED_FIELDS, {"RuntimeError": ...} or lists of errors
+def compact(option_values):
+    fields = _fields([value for _, value in option_values])
+    return {"FIELDS": fields, "ROWS": [_compact_row(index, value, fields) for index, value in option_values]}
+
+
+def _encode(body, encoding):
+    if encoding == MSGPACK:
+        return msgpack.packb(body, default=_default)
+    return dumps(body)
+
+
+# JSON response of any other body, encoded like the results
+def json_response(value):
+    return Response(dumps(value), media_type=JSON)
+
+
+# Response of (index, result) pairs, results with errors as {"RuntimeError": ...}
+def results_response(option_values, encoding):
+    body = option_values if encoding == JSON else compact(option_values)
+    return Response(_encode(body, encoding), media_type=encoding)
+
+
+# Response of a single row's result: the result itself in JSON, a compact form of one row (index 0) otherwise
+def result_response(value, encoding):
+    body = value if encoding == JSON else compact([(0, value)])
+    return Response(_encode(body, encoding), media_type=encoding)
+
+
+# Streamed results: the header of the compact encodings, None for JSON
+def stream_header(encoding):
+    if encoding == JSON:
+        return None
+    header = {"FIELDS": RESULT_FIELDS + MONTE_CARLO_FIELDS}
+    return msgpack.packb(header) if encoding == MSGPACK else dumps(header) + b"\n"
+
+
+# Streamed result of a row
+def stream_row(index, value, encoding):
+    if encoding == JSON:
+        return dumps({"index": index, "result": {"RuntimeError": value[0]} if isinstance(value, list) else value}) + b"\n"
+    row = _compact_row(index, value, RESULT_FIELDS + MONTE_CARLO_FIELDS)
+    return msgpack.packb(row, default=_default) if encoding == MSGPACK else dumps(row) + b"\n"
+
+
+class _Compressor:
+
+    def __init__(self, coding):
+        self.coding = coding
+        if coding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    # Compressed bytes of a chunk, flushed so that streamed chunks can be decoded as they arrive
+    def compress(self, data, last):
+        if self.coding == 'br':
+            return self.compressor.process(data) + (self.compressor.finish() if last else self.compressor.flush())
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+# Content coding asked for by an Accept-Encoding header: 'br', 'gzip' or None
+def content_coding(accept_encoding):
+    accepted = {coding: quality for coding, quality in _parse_header(accept_encoding or '') if quality > 0}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+# ASGI middleware compressing the responses (and streams) with brotli or gzip, as the client accepts
+class CompressionMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get('headers', []))
+        coding = content_coding(headers.get(b'accept-encoding', b'').decode('latin-1'))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body':
+                await send(message)
+                return
+            if start is not None:
+                body = message.get('body', b'')
+                more_body = message.get('more_body', False)
+                response_headers = [(name, value) for name, value in start.get('headers', [])]
+                already_encoded = any(name.lower() == b'content-encoding' for name, _ in response_headers)
+                if already_encoded or (not more_body and len(body) < COMPRESSION_MIN_SIZE):
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                compressor = _Compressor(coding)
+                response_headers = [(name, value) for name, value in response_headers if name.lower() != b'content-length']
+                response_headers += [(b'content-encoding', coding.encode()), (b'vary', b'Accept-Encoding')]
+                if not more_body:
+                    # Whole response at once, its length is known
+                    compressed = compressor.compress(body, True)
+                    response_headers.append((b'content-length', str(len(compressed)).encode()))
+                    await send(dict(start, headers=response_headers))
+                    start = None
+                    await send({'type': 'http.response.body', 'body': compressed})
+                    return
+                await send(dict(start, headers=response_headers))
+                start = None
+            if compressor is None:
+                await send(message)
+                return
+            more_body = message.get('more_body', False)
+            await send({'type': 'http.response.body', 'body': compressor.compress(message.get('body', b''), not more_body),
+                        'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
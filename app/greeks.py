@@ -0,0 +1,128 @@
+import QuantLib as ql
+
+from marketdata import CALENDAR
+
+# Bump-and-reprice greeks of built options (pricer.build_option)
+# The options' SPOT & VOLATILITY SimpleQuotes are moved and their NPVs read again on the same instruments, engines
+# and processes, so a greek costs engine evaluations only. Per option, on top of its NPV:
+#   DELTA & GAMMA : 2 evaluations (spot up & down, the central second difference reuses the NPV)
+#   VEGA          : 2 evaluations (volatility up & down)
+#   THETA         : 1 evaluation (evaluation date rolled THETA_DAYS business days past the curves' reference date,
+#                   or the NPV of the option's ROLLED_OPTION, a copy on curves fixed at the rolled date, see live.py)
+# Greeks the engine provides (analytic European) are read from it instead.
+# Every quote move and evaluation date roll notifies the QuantLib objects observing it, so a batch moves each quote
+# shared by its options (rows of a batch with the same pair, SPOT & VOLATILITY) and the evaluation date once for all of them.
+
+# Relative SPOT bump and absolute VOLATILITY bump
+SPOT_BUMP = 1e-4
+VOLATILITY_BUMP = 1e-4
+# Business days the evaluation date is moved forward by for THETA: from Friday to Monday, from a weekend to Tuesday
+THETA_DAYS = 1
+
+
+# Evaluation date of the THETA roll: THETA_DAYS business days after the reference date of the rate & volatility
+# curves (the evaluation date moved to a business day), so that the curves move on weekends too
+def rolled_reference_date(evaluation_date):
+    return CALENDAR.advance(CALENDAR.advance(evaluation_date, 0, ql.Days), THETA_DAYS, ql.Days)
+
+
+# NPVs of the options while a quote is set to each of the values, the quote is restored afterwards
+# Returns one list per value, None for the options the engine failed on
+def bumped_npvs(OPTION_PARAMS, quote, values):
+    value = quote.value()
+    npvs = []
+    try:
+        for bumped in values:
+            quote.setValue(bumped)
+            npvs.append([_npv(OPTION_PARAM) for OPTION_PARAM in OPTION_PARAMS])
+    finally:
+        quote.setValue(value)
+    return npvs
+
+
+def _npv(OPTION_PARAM):
+    try:
+        return OPTION_PARAM['OPTION'].NPV()
+    except RuntimeError:
+        return None
+
+
+# Options grouped by one of their quotes: {id: (quote, [option positions])}
+def _by_quote(OPTION_PARAMS, positions, quote_name):
+    groups = {}
+    for k in positions:
+        quote = OPTION_PARAMS[k][quote_name]
+        groups.setdefault(id(quote), (quote, []))[1].append(k)
+    return groups
+
+
+# DELTA, GAMMA, VEGA and THETA of options per unit of foreign notional, npvs being their current NPVs
+# THETA is the change of NPV over the roll, None if the option expires by then
+# Returns one [DELTA, GAMMA, VEGA, THETA] list per option, or None for the options a bumped evaluation failed on
+def batch_greeks(OPTION_PARAMS, npvs):
+    greeks = [[None, None, None, None] for _ in OPTION_PARAMS]
+    failed = set()
+
+    # Greeks from the engines
+    spot_bumped = []
+    volatility_bumped = []
+    for k, OPTION_PARAM in enumerate(OPTION_PARAMS):
+        option = OPTION_PARAM['OPTION']
+        try:
+            greeks[k][0], greeks[k][1] = option.delta(), option.gamma()
+        except RuntimeError:
+            spot_bumped.append(k)
+        try:
+            greeks[k][2] = option.vega()
+        except RuntimeError:
+            volatility_bumped.append(k)
+
+    # DELTA & GAMMA, one spot up & down per shared SPOT quote
+    for quote, members in _by_quote(OPTION_PARAMS, spot_bumped, 'SPOT_QUOTE').values():
+        spot_bump = quote.value() * SPOT_BUMP
+        up, down = bumped_npvs([OPTION_PARAMS[k] for k in members], quote, [quote.value() + spot_bump, quote.value() - spot_bump])
+        for k, npv_up, npv_down in zip(members, up, down):
+            if npv_up is None or npv_down is None:
+                failed.add(k)
+                continue
+            greeks[k][0] = (npv_up - npv_down) / (2 * spot_bump)
+            greeks[k][1] = (npv_up - 2 * npvs[k] + npv_down) / (spot_bump * spot_bump)
+
+    # VEGA, one volatility up & down per shared VOLATILITY quote
+    for quote, members in _by_quote(OPTION_PARAMS, volatility_bumped, 'VOLATILITY_QUOTE').values():
+        up, down = bumped_npvs([OPTION_PARAMS[k] for k in members], quote, [quote.value() + VOLATILITY_BUMP, quote.value() - VOLATILITY_BUMP])
+        for k, npv_up, npv_down in zip(members, up, down):
+            if npv_up is None or npv_down is None:
+                failed.add(k)
+                continue
+            greeks[k][2] = (npv_up - npv_down) / (2 * VOLATILITY_BUMP)
+
+    # THETA, one roll per evaluation date, none for the options with a rolled copy
+    evaluation_dates = {}
+    for k, OPTION_PARAM in enumerate(OPTION_PARAMS):
+        evaluation_date = OPTION_PARAM['EVALUATION_DATE']
+        if OPTION_PARAM.get('ROLLED_OPTION') is not None:
+            try:
+                greeks[k][3] = OPTION_PARAM['ROLLED_OPTION'].NPV() - npvs[k]
+            except RuntimeError:
+                failed.add(k)
+        elif OPTION_PARAM['EXPIRY_DATE'] > rolled_reference_date(evaluation_date):
+            evaluation_dates.setdefault(evaluation_date, []).append(k)
+    for evaluation_date, members in evaluation_dates.items():
+        ql.Settings.instance().evaluationDate = rolled_reference_date(evaluation_date)
+        try:
+            for k in members:
+                rolled = _npv(OPTION_PARAMS[k])
+                if rolled is None:
+                    failed.add(k)
+                else:
+                    greeks[k][3] = rolled - npvs[k]
+        finally:
+            ql.Settings.instance().evaluationDate = evaluation_date
+
+    return [None if k in failed else values for k, values in enumerate(greeks)]
+
+
+# DELTA, GAMMA, VEGA and THETA of a single option, see batch_greeks
+def option_greeks(OPTION_PARAM, npv):
+    return batch_greeks([OPTION_PARAM], [npv])[0]
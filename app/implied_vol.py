@@ -0,0 +1,277 @@
+import QuantLib as ql
+import logging
+
+import numpy as np
+
+from marketdata import volatility
+from pricer import build_option
+from vectorized import garman_kohlhagen, parse_rows, SINGLE_BARRIER_TYPES, DOUBLE_BARRIER_TYPES
+from vectorized_barrier import barrier_npv
+from metrics import StageClock
+from montecarlo import MONTE_CARLO_TYPES
+
+# Implied volatility of option rows from a target PREMIUM or OPTION_NPV
+# 'vectorized' engine: European vanilla rows are solved together by a bracketed Newton iteration,
+#                      European single & double barrier rows together by a volatility scan and Illinois regula falsi,
+#                      the others one at a time by QuantLib's Brent solver
+# 'quantlib' engine  : every row by the Brent solver, repricing the option built once by pricer.build_option
+
+log = logging.getLogger('pricer.implied_vol')
+
+# Volatilities searched
+VOLATILITY_MIN = 0.001
+VOLATILITY_MAX = 4.0
+# Convergence: estimated volatility error or bracket width, or a price error at the resolution of a double
+# (relative to SPOT, OPTION_NPV is per unit of foreign notional)
+VOLATILITY_ACCURACY = 1e-8
+PRICE_ACCURACY = 1e-15
+# Rows that stop with a larger price error (relative to SPOT), e.g. on a jump of a barrier price, are not converged
+RESIDUAL_TOLERANCE = 1e-7
+MAX_ITERATIONS = 50
+# Volatilities of the barrier scan, whose price is not monotonic in the volatility
+SCAN_POINTS = 40
+# Starting point of the Brent solver when the row has no VOLATILITY
+DEFAULT_GUESS = 0.1
+
+NO_SOLUTION = f"No VOLATILITY between {VOLATILITY_MIN:.1%} and {VOLATILITY_MAX:.0%} matches the target price."
+
+
+def _positive(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+# Target OPTION_NPV of a row: its OPTION_NPV, or its PREMIUM unscaled as in CALCULATED_FIELDS
+# Returns (target, None) or (None, error)
+def target_npv(params):
+    if params.get('OPTION_NPV', '') != '':
+        target = _positive(params['OPTION_NPV'])
+        return (target, None) if target is not None else (None, "OPTION_NPV must be > 0.")
+    if params.get('PREMIUM', '') != '':
+        premium = _positive(params['PREMIUM'])
+        if premium is None:
+            return None, "PREMIUM must be > 0."
+        spot = _positive(params['SPOT'])
+        notional = _positive(params['NOTIONAL'])
+        if spot is None or notional is None:
+            return None, "PREMIUM needs a valid SPOT & NOTIONAL."
+        return premium * spot / notional, None
+    return None, "PREMIUM or OPTION_NPV is required."
+
+
+# Volatility to start from: the row's VOLATILITY, the pair's volatility, or DEFAULT_GUESS
+def volatility_guess(params):
+    guess = _positive(params['VOLATILITY'])
+    if guess is None:
+        guess = volatility(str(params['CURRENCY_PAIR']).upper())
+    return guess if guess is not None else DEFAULT_GUESS
+
+
+def _take(columns, indices):
+    return {name: column[indices] for name, column in columns.items()}
+
+
+def _result(implied_volatility, converged, iterations, residual, method):
+    return {
+        'IMPLIED_VOLATILITY': implied_volatility,
+        'CONVERGED': converged,
+        'ITERATIONS': iterations,
+        'RESIDUAL': residual,
+        'METHOD': method
+    }
+
+
+def _vanilla_npv(columns, vol):
+    return garman_kohlhagen(columns['SPOT'], columns['STRIKE'], columns['DOMESTIC_RATE'], columns['FOREIGN_RATE'],
+                            vol, columns['T_RATE'], columns['T_VOL'], columns['IS_CALL'])
+
+
+# Corrado-Miller approximation of the implied volatility of European vanillas
+def corrado_miller_guess(columns, target):
+    spot = columns['SPOT'] * np.exp(-columns['FOREIGN_RATE'] * columns['T_RATE'])
+    strike = columns['STRIKE'] * np.exp(-columns['DOMESTIC_RATE'] * columns['T_RATE'])
+    call = np.where(columns['IS_CALL'], target, target + spot - strike)
+    half = call - (spot - strike) / 2
+    root = np.sqrt(np.maximum(half * half - (spot - strike) ** 2 / np.pi, 0.0))
+    guess = np.sqrt(2 * np.pi) / (spot + strike) * (half + root) / np.sqrt(columns['T_VOL'])
+    return np.clip(np.where(np.isfinite(guess) & (guess > 0), guess, DEFAULT_GUESS), VOLATILITY_MIN, VOLATILITY_MAX)
+
+
+# Newton iteration on the Garman-Kohlhagen price, falling back to bisection whenever a step leaves the bracket
+# Returns (volatility, converged, iterations, residual, solvable) columns
+def solve_vanilla_columns(columns, target):
+    lower = np.full_like(target, VOLATILITY_MIN)
+    upper = np.full_like(target, VOLATILITY_MAX)
+    tolerance = PRICE_ACCURACY * columns['SPOT']
+    # The price increases with the volatility: targets outside [price(min), price(max)] have no solution
+    solvable = (_vanilla_npv(columns, lower)['NPV'] <= target) & (target <= _vanilla_npv(columns, upper)['NPV'])
+
+    vol = corrado_miller_guess(columns, target)
+    residual = np.full_like(target, np.nan)
+    converged = np.zeros(len(target), dtype=bool)
+    iterations = np.zeros(len(target), dtype=int)
+    active = np.flatnonzero(solvable)
+    for _ in range(MAX_ITERATIONS):
+        if not len(active):
+            break
+        subset = _take(columns, active)
+        raw = _vanilla_npv(subset, vol[active])
+        diff = raw['NPV'] - target[active]
+        residual[active] = diff
+        iterations[active] += 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step_size = diff / raw['VEGA']
+        done = (np.abs(step_size) <= VOLATILITY_ACCURACY) | (np.abs(diff) <= tolerance[active]) | (upper[active] - lower[active] <= VOLATILITY_ACCURACY)
+        converged[active[done]] = True
+        lower[active] = np.where(diff < 0, vol[active], lower[active])
+        upper[active] = np.where(diff > 0, vol[active], upper[active])
+        newton = vol[active] - step_size
+        bisect = ~np.isfinite(newton) | (newton <= lower[active]) | (newton >= upper[active])
+        step = np.where(bisect, 0.5 * (lower[active] + upper[active]), newton)
+        vol[active] = np.where(done, vol[active], step)
+        active = active[~done]
+    converged &= np.abs(residual) <= RESIDUAL_TOLERANCE * columns['SPOT']
+    return vol, converged, iterations, residual, solvable
+
+
+# Scan the volatility range for the first bracket of the target price, then narrow it by Illinois regula falsi
+# Returns (volatility, converged, iterations, residual, number of brackets found) columns
+def solve_barrier_columns(columns, target):
+    n = len(target)
+    grid = np.geomspace(VOLATILITY_MIN, VOLATILITY_MAX, SCAN_POINTS)
+    tiled = {name: np.repeat(column, SCAN_POINTS) for name, column in columns.items()}
+    with np.errstate(all='ignore'):
+        scan = (barrier_npv(tiled, tiled['SPOT'], np.tile(grid, n)) - np.repeat(target, SCAN_POINTS)).reshape(n, SCAN_POINTS)
+    brackets = scan[:, :-1] * scan[:, 1:] <= 0
+    roots = brackets.sum(axis=1)
+    first = brackets.argmax(axis=1)
+    rows = np.arange(n)
+
+    a, f_a = grid[first], scan[rows, first]
+    b, f_b = grid[first + 1], scan[rows, first + 1]
+    vol = np.where(np.abs(f_a) < np.abs(f_b), a, b)
+    residual = np.where(np.abs(f_a) < np.abs(f_b), f_a, f_b)
+    tolerance = PRICE_ACCURACY * columns['SPOT']
+    converged = (roots > 0) & (np.abs(residual) <= tolerance)
+    iterations = np.zeros(n, dtype=int)
+    active = np.flatnonzero((roots > 0) & ~converged)
+    for _ in range(MAX_ITERATIONS):
+        if not len(active):
+            break
+        with np.errstate(all='ignore'):
+            c = b[active] - f_b[active] * (b[active] - a[active]) / (f_b[active] - f_a[active])
+            c = np.where(np.isfinite(c), c, 0.5 * (a[active] + b[active]))
+            f_c = barrier_npv(_take(columns, active), columns['SPOT'][active], c) - target[active]
+        iterations[active] += 1
+        vol[active] = c
+        residual[active] = f_c
+
+        # Keep the bracket: the new point replaces the end with the same sign, the other end's value is halved if it stays
+        flip = f_c * f_b[active] < 0
+        a[active] = np.where(flip, b[active], a[active])
+        f_a[active] = np.where(flip, f_b[active], f_a[active] / 2)
+        b[active] = c
+        f_b[active] = f_c
+
+        done = (np.abs(f_c) <= tolerance[active]) | (np.abs(b[active] - a[active]) <= VOLATILITY_ACCURACY)
+        converged[active[done]] = True
+        active = active[~done]
+    converged &= np.abs(residual) <= RESIDUAL_TOLERANCE * columns['SPOT']
+    return vol, converged, iterations, residual, roots
+
+
+# Brent solver on the option built once by pricer.build_option, repricing it through its own VOLATILITY quote
+# Path simulation prices are estimates, their rows are not solved
+def solve_quantlib_row(params, target):
+    if str(params['EXOTIC_TYPE']).upper() in MONTE_CARLO_TYPES:
+        return [f"Implied volatility is not available for {', '.join(MONTE_CARLO_TYPES)}."]
+    guess = min(max(volatility_guess(params), VOLATILITY_MIN), VOLATILITY_MAX)
+    clock = StageClock(params['EXOTIC_TYPE'], 'quantlib')
+    OPTION_PARAM = build_option(dict(params, VOLATILITY=repr(guess)), clock)
+    if isinstance(OPTION_PARAM, list):
+        return OPTION_PARAM
+    option = OPTION_PARAM['OPTION']
+    option.setPricingEngine(OPTION_PARAM['ENGINE'])
+    quote = OPTION_PARAM['VOLATILITY_QUOTE']
+
+    evaluations = [0]
+
+    def difference(vol):
+        evaluations[0] += 1
+        quote.setValue(vol)
+        return option.NPV() - target
+
+    try:
+        difference(guess)
+    except RuntimeError:
+        return ["RuntimeError in calculating option price & greeks."]
+
+    solver = ql.Brent()
+    solver.setMaxEvaluations(MAX_ITERATIONS)
+    solver.setLowerBound(VOLATILITY_MIN)
+    solver.setUpperBound(VOLATILITY_MAX)
+    try:
+        implied_volatility = solver.solve(difference, VOLATILITY_ACCURACY, guess, 0.01)
+    except RuntimeError:
+        return [NO_SOLUTION]
+    residual = difference(implied_volatility)
+    clock.lap('implied_volatility')
+    # Brent raises rather than return before reaching VOLATILITY_ACCURACY
+    return _result(implied_volatility, True, evaluations[0], residual, 'brent')
+
+
+# Implied volatilities of a batch of rows (OPTION_FIELDS plus PREMIUM or OPTION_NPV)
+# Returns a list of (index, result) pairs in the original row order, indices starting at start
+def implied_volatilities(rows, start=0, engine='vectorized'):
+    targets = {}
+    results = {}
+    for i, params in enumerate(rows):
+        target, error = target_npv(params)
+        if error is not None:
+            results[i] = [error]
+        else:
+            targets[i] = target
+
+    if engine == 'vectorized' and targets:
+        # parse_rows needs a volatility, any valid one will do
+        candidates = [i for i in targets]
+        parseable = [dict(rows[i], VOLATILITY=repr(volatility_guess(rows[i]))) for i in candidates]
+
+        clock = StageClock('VANILLA', 'vectorized')
+        indices, columns = parse_rows(parseable, ['VANILLA'])
+        if indices:
+            rows_solved = [candidates[j] for j in indices]
+            vol, converged, iterations, residual, solvable = solve_vanilla_columns(columns, np.array([targets[i] for i in rows_solved]))
+            for k, i in enumerate(rows_solved):
+                results[i] = [NO_SOLUTION] if not solvable[k] else \
+                    _result(float(vol[k]), bool(converged[k]), int(iterations[k]), float(residual[k]), 'newton')
+        clock.lap('implied_volatility')
+
+        clock = StageClock('BARRIER', 'vectorized')
+        indices, columns = parse_rows(parseable, SINGLE_BARRIER_TYPES + DOUBLE_BARRIER_TYPES)
+        if indices:
+            rows_solved = [candidates[j] for j in indices]
+            vol, converged, iterations, residual, roots = solve_barrier_columns(columns, np.array([targets[i] for i in rows_solved]))
+            for k, i in enumerate(rows_solved):
+                if not roots[k]:
+                    results[i] = [NO_SOLUTION]
+                    continue
+                results[i] = _result(float(vol[k]), bool(converged[k]), int(iterations[k]), float(residual[k]), 'illinois')
+                if roots[k] > 1:
+                    results[i]['WARNING'] = "Several volatilities match the target price, the lowest one is returned."
+        clock.lap('implied_volatility')
+
+    option_values = []
+    for i, params in enumerate(rows):
+        if i not in results:
+            try:
+                results[i] = solve_quantlib_row(params, targets[i])
+            except Exception as e:
+                log.warning("Unexpected error solving row %s: %s", start + i, e, exc_info=log.isEnabledFor(logging.DEBUG))
+                results[i] = [f"RuntimeError in pricing: {e}"]
+        option_values.append((start + i, results[i]))
+    return option_values
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import time
+
+import QuantLib as ql
+from starlette.websockets import WebSocketDisconnect
+
+from marketdata import CALENDAR, DAY_COUNT_VOLATILITY
+from greeks import rolled_reference_date
+from pricer import build_option, calculate_batch_fields, make_engine, QUANTLIB_BATCH_SIZE
+from scenarios import barrier_touched
+from streaming import parse_payload
+from metrics import StageClock
+
+log = logging.getLogger('pricer.live')
+
+# Live repricing over a WebSocket (/live)
+# A client registers a book once: its rows are built with QuantLib and kept alive, rows of the same pair, SPOT & VOLATILITY
+# sharing their SimpleQuotes and process. A spot or volatility tick of a pair sets the quotes of that pair's rows and
+# re-evaluates these rows only, so its cost does not depend on the rest of the book. Only the results that changed
+# are pushed back.
+# Client messages:
+#   {"action": "register", "payloads": [<webpricer payload>, ...]}
+#   {"action": "tick", "CURRENCY_PAIR": "EURUSD", "SPOT": 1.09, "VOLATILITY": 0.11}  (SPOT and/or VOLATILITY)
+# Server messages:
+#   {"type": "registered", "rows": ..., "errors": ..., "results": [[index, result], ...]}
+#   {"type": "update", "CURRENCY_PAIR": ..., "SPOT": ..., "VOLATILITY": ..., "results": [[index, result], ...], "ms": ...}
+#   {"type": "error", "detail": ...}
+# Ticks of a pair that arrive while the server is busy are merged, only the latest SPOT & VOLATILITY are priced.
+# THETA of the live rows is read from a copy of each option on curves fixed at the rolled date (ROLLED_OPTION): rolling
+# the evaluation date would notify every live instrument of the process, every book's, on each tick.
+
+TICK_FIELDS = ['SPOT', 'VOLATILITY']
+
+
+def _result(value):
+    return {"RuntimeError": value[0]} if isinstance(value, list) else value
+
+
+# Copy of a built option priced on its market seen from the THETA roll date: the rate curves implied at that date
+# from the shared ones and a volatility on the row's quote, so the copy follows the quotes & market data updates
+# rolled holds the processes & engines of the copies, shared like those of the options
+def _rolled_option(OPTION_PARAM, rolled):
+    rolled_date = rolled_reference_date(OPTION_PARAM['EVALUATION_DATE'])
+    if OPTION_PARAM['EXPIRY_DATE'] <= rolled_date:
+        return None
+    process_key = (id(OPTION_PARAM['SPOT_QUOTE']), id(OPTION_PARAM['VOLATILITY_QUOTE']), id(OPTION_PARAM['FOREIGN_RF_RATE']),
+                   id(OPTION_PARAM['DOMESTIC_RF_RATE']), rolled_date)
+    if process_key not in rolled:
+        volatility = ql.BlackVolTermStructureHandle(ql.BlackConstantVol(rolled_date, CALENDAR, OPTION_PARAM['VOLATILITY_HANDLE'], DAY_COUNT_VOLATILITY))
+        foreign = ql.YieldTermStructureHandle(ql.ImpliedTermStructure(OPTION_PARAM['FOREIGN_RF_RATE'], rolled_date))
+        domestic = ql.YieldTermStructureHandle(ql.ImpliedTermStructure(OPTION_PARAM['DOMESTIC_RF_RATE'], rolled_date))
+        rolled[process_key] = ql.BlackScholesMertonProcess(OPTION_PARAM['SPOT_HANDLE'], foreign, domestic, volatility)
+    engine_key = process_key + (OPTION_PARAM['ENGINE_NAME'],)
+    if engine_key not in rolled:
+        rolled[engine_key] = make_engine(OPTION_PARAM['ENGINE_NAME'], rolled[process_key])
+
+    exotic_type = OPTION_PARAM['EXOTIC_TYPE'].upper()
+    if exotic_type == 'VANILLA':
+        option = ql.VanillaOption(OPTION_PARAM['PAYOFF'], OPTION_PARAM['EXERCISE_Q'])
+    elif exotic_type in ['KI_BARRIER', 'KO_BARRIER']:
+        option = ql.BarrierOption(OPTION_PARAM['BARRIER_TYPE'], OPTION_PARAM['BARRIER'], OPTION_PARAM['REBATE'], OPTION_PARAM['PAYOFF'], OPTION_PARAM['EXERCISE_Q'])
+    else:
+        option = ql.DoubleBarrierOption(OPTION_PARAM['BARRIER_TYPE'], OPTION_PARAM['LOWER_BARRIER'], OPTION_PARAM['UPPER_BARRIER'], OPTION_PARAM['REBATE'], OPTION_PARAM['PAYOFF'], OPTION_PARAM['EXERCISE_Q'])
+    option.setPricingEngine(rolled[engine_key])
+    return option
+
+
+# Built rows of a registered book, grouped by CURRENCY_PAIR
+class LiveBook:
+
+    def __init__(self, payloads):
+        self.options = {}
+        self.clocks = {}
+        self.results = {}
+        self.pairs = {}
+        engines = {}
+        rolled = {}
+        for i, item in enumerate(payloads):
+            params, error = parse_payload(item) if isinstance(item, dict) else (None, "Invalid payload. Must be an object.")
+            if error is not None:
+                self.results[i] = [error]
+                continue
+            clock = StageClock(params['EXOTIC_TYPE'], 'quantlib')
+            try:
+                OPTION_PARAM = build_option(params, clock, engines)
+            except Exception as e:
+                log.warning("Unexpected error building row %s: %s", i, e, exc_info=log.isEnabledFor(logging.DEBUG))
+                OPTION_PARAM = [f"RuntimeError in pricing: {e}"]
+            if isinstance(OPTION_PARAM, list):
+                self.results[i] = OPTION_PARAM
+                continue
+            # Path simulation rows have no QuantLib option, their THETA needs no roll (montecarlo.simulation_inputs)
+            if 'OPTION' in OPTION_PARAM:
+                OPTION_PARAM['ROLLED_OPTION'] = _rolled_option(OPTION_PARAM, rolled)
+            self.options[i] = OPTION_PARAM
+            self.clocks[i] = clock
+            self.pairs.setdefault(OPTION_PARAM['CURRENCY_PAIR'].upper(), []).append(i)
+        self.size = len(payloads)
+        self.results.update(self.price(list(self.options)))
+
+    # Price built rows together, rows whose spot is beyond a barrier get an error instead
+    # Returns {row index: result}
+    def price(self, indices):
+        results = {}
+        priced = []
+        for i in indices:
+            error = barrier_touched(self.options[i], self.options[i]['SPOT_QUOTE'].value())
+            if error is not None:
+                results[i] = [error]
+            else:
+                priced.append(i)
+        for start in range(0, len(priced), QUANTLIB_BATCH_SIZE):
+            batch = priced[start:start + QUANTLIB_BATCH_SIZE]
+            try:
+                values = calculate_batch_fields([self.options[i] for i in batch], [self.clocks[i] for i in batch])
+            except Exception as e:
+                log.warning("Unexpected error repricing live rows: %s", e, exc_info=log.isEnabledFor(logging.DEBUG))
+                values = [[f"RuntimeError in pricing: {e}"]] * len(batch)
+            results.update(zip(batch, values))
+        return results
+
+    # Move the SPOT and/or VOLATILITY of a pair's rows and reprice them
+    # Returns the (index, result) pairs that changed, in row order
+    def tick(self, currency_pair, values):
+        indices = self.pairs.get(currency_pair, [])
+        quotes = {}
+        for i in indices:
+            OPTION_PARAM = self.options[i]
+            if 'SPOT' in values:
+                quotes[id(OPTION_PARAM['SPOT_QUOTE'])] = (OPTION_PARAM['SPOT_QUOTE'], values['SPOT'])
+                # PREMIUM & the greeks are scaled by the row's SPOT
+                OPTION_PARAM['SPOT'] = values['SPOT']
+            if 'VOLATILITY' in values:
+                quotes[id(OPTION_PARAM['VOLATILITY_QUOTE'])] = (OPTION_PARAM['VOLATILITY_QUOTE'], values['VOLATILITY'])
+        # Rows sharing a market share their quotes, each is set once
+        for quote, value in quotes.values():
+            quote.setValue(value)
+
+        changed = []
+        for i, value in sorted(self.price(indices).items()):
+            if value != self.results.get(i):
+                self.results[i] = value
+                changed.append((i, value))
+        return changed
+
+    def snapshot(self):
+        return [(i, self.results[i]) for i in range(self.size)]
+
+
+# Tick of a message: (CURRENCY_PAIR, {'SPOT': ..., 'VOLATILITY': ...}, None) or (None, None, error message)
+def parse_tick(message):
+    currency_pair = str(message.get('CURRENCY_PAIR') or '').strip().upper()
+    if len(currency_pair) != 6:
+        return None, None, "Invalid CURRENCY_PAIR. Ex: USDEUR"
+    values = {}
+    for field in TICK_FIELDS:
+        if message.get(field) is None:
+            continue
+        try:
+            values[field] = float(message[field])
+        except (TypeError, ValueError):
+            return None, None, f"{field} is not a valid float"
+        if values[field] <= 0:
+            return None, None, f"{field} must be > 0."
+    if not values:
+        return None, None, "SPOT or VOLATILITY is required."
+    return currency_pair, values, None
+
+
+# Read the client's messages into a queue, None when the client disconnects
+async def _read_messages(websocket, messages):
+    while True:
+        try:
+            message = await websocket.receive_json()
+        except WebSocketDisconnect:
+            break
+        except ValueError:
+            message = {'action': 'invalid', 'detail': "Invalid JSON message."}
+        messages.put_nowait((message, time.perf_counter()))
+    messages.put_nowait(None)
+
+
+# Serve a live repricing session until the client disconnects
+async def serve_live(websocket):
+    messages = asyncio.Queue()
+    reader = asyncio.ensure_future(_read_messages(websocket, messages))
+    book = None
+    try:
+        while True:
+            # Every message received while the previous ones were priced
+            batch = [await messages.get()]
+            while not messages.empty():
+                batch.append(messages.get_nowait())
+            # Latest tick per pair and when its oldest merged tick arrived
+            ticks = {}
+            for entry in batch:
+                if entry is None:
+                    return
+                message, received = entry
+                action = message.get('action') if isinstance(message, dict) else None
+                if action == 'tick':
+                    currency_pair, values, error = parse_tick(message)
+                    if error is not None:
+                        await websocket.send_json({"type": "error", "detail": error})
+                    elif currency_pair in ticks:
+                        ticks[currency_pair][0].update(values)
+                    else:
+                        ticks[currency_pair] = (values, received)
+                    continue
+                # Ticks go out before whatever came after them
+                await _send_ticks(websocket, book, ticks)
+                ticks = {}
+                if action == 'register':
+                    payloads = message.get('payloads')
+                    if not isinstance(payloads, list):
+                        await websocket.send_json({"type": "error", "detail": "payloads must be a list."})
+                        continue
+                    book = LiveBook(payloads)
+                    errors = sum(isinstance(value, list) for value in book.results.values())
+                    log.info("Live book registered", extra={'fields': {'rows': book.size, 'errors': errors, 'pairs': len(book.pairs)}})
+                    await websocket.send_json({"type": "registered", "rows": book.size, "errors": errors,
+                                               "results": [(i, _result(value)) for i, value in book.snapshot()]})
+                else:
+                    detail = message.get('detail') if action == 'invalid' else "Invalid action. Ex: register, tick."
+                    await websocket.send_json({"type": "error", "detail": detail})
+            await _send_ticks(websocket, book, ticks)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        reader.cancel()
+
+
+async def _send_ticks(websocket, book, ticks):
+    for currency_pair, (values, received) in ticks.items():
+        if book is None:
+            await websocket.send_json({"type": "error", "detail": "Register a book before sending ticks."})
+            return
+        if currency_pair not in book.pairs:
+            await websocket.send_json({"type": "error", "detail": f"No row of the book is on {currency_pair}."})
+            continue
+        changed = book.tick(currency_pair, values)
+        update = {"type": "update", "CURRENCY_PAIR": currency_pair, "results": [(i, _result(value)) for i, value in changed],
+                  "ms": (time.perf_counter() - received) * 1000}
+        update.update(values)
+        log.debug("Live tick", extra={'fields': {'CURRENCY_PAIR': currency_pair, 'rows': len(book.pairs[currency_pair]), 'changed': len(changed)}})
+        await websocket.send_json(update)
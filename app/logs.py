@@ -0,0 +1,90 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+# Structured (one JSON object per line), leveled logging of the pricer
+# Records are handed to a queue and written to stderr by a background thread, so logging never blocks a request
+
+# Level of the 'pricer' loggers, DEBUG shows the per-row pricing details
+LOG_LEVEL = os.environ.get('PRICER_LOG_LEVEL', 'INFO').upper()
+
+_listener = None
+
+
+# Formats a record as one JSON line, with the fields passed as logger.info(..., extra={'fields': {...}})
+# (the QueueHandler has already merged any traceback into the message)
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+# Route the 'pricer' loggers through a queue to a JSON stderr handler
+# Called in the web server process at startup and in every pricing worker process
+def configure_logging():
+    global _listener
+    stop_logging()
+
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+    logger = logging.getLogger('pricer')
+    for existing in list(logger.handlers):
+        logger.removeHandler(existing)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+
+# Flush the queued records and stop the background thread
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# ASGI middleware writing one log line per request
+class RequestLogMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+        self.log = logging.getLogger('pricer.request')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            client = scope.get('client')
+            self.log.info("request", extra={'fields': {
+                'method': scope['method'],
+                'path': scope['path'],
+                'status': status[0],
+                'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                'client': client[0] if client else None
+            }})
@@ -0,0 +1,209 @@
+# Market data shared by the QuantLib and vectorized pricing paths
+# Every process keeps one long-lived SimpleQuote and term structure handle per currency (and a volatility quote per pair).
+# Pricing links to these shared objects, updates bump the quotes in place and QuantLib lazily re-evaluates
+# whatever depends on them.
+# A pair can also have a volatility surface (tenors x strikes), built once per evaluation date and shared by every
+# request: rows that leave VOLATILITY empty take the surface's volatility at their expiry & strike.
+import QuantLib as ql
+
+# Same conventions as the QuantLib path in pricer.py
+CALENDAR = ql.UnitedStates(ql.UnitedStates.GovernmentBond)
+DAY_COUNT_RATE = ql.Actual360()
+DAY_COUNT_VOLATILITY = ql.ActualActual(ql.ActualActual.ISDA)
+
+# Currencies accepted in a CURRENCY_PAIR
+CURRENCIES = ['USD', 'EUR', 'GBP', 'AUD', 'NZD', 'CAD', 'CHF', 'JPY']
+
+# Initial risk free rates of the currencies when quoted as FOREIGN (first 3 letters of the pair) or DOMESTIC (last 3 letters)
+# can fetch from database or API here.
+FOREIGN_RF_RATES = {'USD': 0.05322, 'EUR': 0.03549, 'GBP': 0.02}
+DOMESTIC_RF_RATES = {'USD': 0.05, 'EUR': 0.01, 'GBP': 0.02}
+# Initial volatility per CURRENCY_PAIR, used by rows that leave VOLATILITY empty
+VOLATILITIES = {}
+# Initial volatility surface per CURRENCY_PAIR, e.g.
+# {'EURUSD': {'TENORS': ['1M', '1Y'], 'STRIKES': [1.0, 1.2], 'VOLATILITIES': [[0.10, 0.09], [0.12, 0.11]]}}
+# VOLATILITIES holds one list per tenor, one volatility per strike
+SURFACES = {}
+
+# Sides of a currency in a pair
+FOREIGN = 'FOREIGN'
+DOMESTIC = 'DOMESTIC'
+
+_rate_quotes = {FOREIGN: {}, DOMESTIC: {}}
+_rate_curves = {FOREIGN: {}, DOMESTIC: {}}
+_volatility_quotes = {}
+_surfaces = {}
+# {currency pair: (evaluation date, BlackVarianceSurface)}, the surface built for the last evaluation date asked for
+_built_surfaces = {}
+# Bumped on every update so that other processes (and caches) can tell their market data is stale
+_version = 0
+
+
+def _add_rate(side, currency, value):
+    quote = ql.SimpleQuote(value)
+    _rate_quotes[side][currency] = quote
+    _rate_curves[side][currency] = ql.YieldTermStructureHandle(ql.FlatForward(0, CALENDAR, ql.QuoteHandle(quote), DAY_COUNT_RATE))
+
+
+def _add_volatility(currency_pair, value):
+    _volatility_quotes[currency_pair] = ql.SimpleQuote(value)
+
+
+# Errors of a volatility surface, see SURFACES
+def _surface_errors(currency_pair, surface):
+    tenors = surface.get('TENORS') or []
+    strikes = surface.get('STRIKES') or []
+    volatilities = surface.get('VOLATILITIES') or []
+    if len(tenors) < 2 or len(strikes) < 2:
+        return [f"Volatility surface of {currency_pair} needs at least 2 TENORS and 2 STRIKES."]
+    errors = []
+    try:
+        periods = [ql.Period(str(tenor)) for tenor in tenors]
+        # Tenors are compared on a fixed date, a month is not a fixed number of days
+        dates = [ql.Date(1, 1, 2001) + period for period in periods]
+        if any(period.length() <= 0 for period in periods) or any(a >= b for a, b in zip(dates, dates[1:])):
+            errors.append(f"TENORS of the volatility surface of {currency_pair} must be increasing. Ex: 1M, 3M, 1Y.")
+    except RuntimeError:
+        errors.append(f"Invalid TENORS in the volatility surface of {currency_pair}. Ex: 1W, 1M, 1Y.")
+    if strikes[0] <= 0 or any(a >= b for a, b in zip(strikes, strikes[1:])):
+        errors.append(f"STRIKES of the volatility surface of {currency_pair} must be > 0 and increasing.")
+    if len(volatilities) != len(tenors) or any(len(row) != len(strikes) for row in volatilities):
+        errors.append(f"VOLATILITIES of the volatility surface of {currency_pair} must have one list per tenor, one volatility per strike.")
+    elif any(value <= 0 for row in volatilities for value in row):
+        errors.append(f"VOLATILITIES of the volatility surface of {currency_pair} must be > 0.")
+    return errors
+
+
+# BlackVarianceSurface of a pair for an evaluation date: the tenors run from the evaluation date, volatilities are
+# interpolated bilinearly in variance and kept flat beyond the first & last strikes and tenors
+def _build_surface(surface, evaluation_date):
+    dates = [evaluation_date + ql.Period(str(tenor)) for tenor in surface['TENORS']]
+    matrix = ql.Matrix(len(surface['STRIKES']), len(dates))
+    for j, row in enumerate(surface['VOLATILITIES']):
+        for k, value in enumerate(row):
+            matrix[k][j] = value
+    extrapolation = ql.BlackVarianceSurface.ConstantExtrapolation
+    built = ql.BlackVarianceSurface(CALENDAR.advance(evaluation_date, 0, ql.Days), CALENDAR, dates, surface['STRIKES'], matrix,
+                                    DAY_COUNT_VOLATILITY, extrapolation, extrapolation)
+    built.enableExtrapolation()
+    return built
+
+
+for _currency, _value in FOREIGN_RF_RATES.items():
+    _add_rate(FOREIGN, _currency, _value)
+for _currency, _value in DOMESTIC_RF_RATES.items():
+    _add_rate(DOMESTIC, _currency, _value)
+for _pair, _value in VOLATILITIES.items():
+    _add_volatility(_pair, _value)
+_surfaces.update(SURFACES)
+
+
+def version():
+    return _version
+
+
+# Flat risk free curve of a currency on the given side, None if the currency has no rate
+def rate_curve(side, currency):
+    return _rate_curves[side].get(currency)
+
+
+# Current risk free rate of a currency on the given side, None if the currency has no rate
+def rate(side, currency):
+    quote = _rate_quotes[side].get(currency)
+    return quote.value() if quote is not None else None
+
+
+# Current volatility of a currency pair, None if the pair has no volatility
+def volatility(currency_pair):
+    quote = _volatility_quotes.get(currency_pair)
+    return quote.value() if quote is not None else None
+
+
+# Volatility of the surface of a currency pair at an expiry date & strike, None if the pair has no surface
+# The surface is built on the first call of each evaluation date, later calls of the same date only interpolate
+def surface_volatility(currency_pair, evaluation_date, expiry_date, strike):
+    surface = _surfaces.get(currency_pair)
+    if surface is None:
+        return None
+    built = _built_surfaces.get(currency_pair)
+    if built is None or built[0] != evaluation_date:
+        built = _built_surfaces[currency_pair] = (evaluation_date, _build_surface(surface, evaluation_date))
+    return built[1].blackVol(expiry_date, strike)
+
+
+# Build the surface of every pair for an evaluation date ahead of the rows that use them (warmup.py)
+def build_surfaces(evaluation_date):
+    for currency_pair, surface in _surfaces.items():
+        built = _built_surfaces.get(currency_pair)
+        if built is None or built[0] != evaluation_date:
+            _built_surfaces[currency_pair] = (evaluation_date, _build_surface(surface, evaluation_date))
+    return len(_surfaces)
+
+
+# Set risk free rates, pair volatilities and volatility surfaces, bumping the existing quotes in place
+# rates: {side: {currency: rate}}, volatilities: {currency pair: volatility}, surfaces: {currency pair: surface}
+# A surface replaces the pair's previous one
+# Returns the list of errors, nothing is updated if there is any
+def update(rates=None, volatilities=None, surfaces=None):
+    global _version
+    rates = rates or {}
+    volatilities = volatilities or {}
+    surfaces = surfaces or {}
+
+    errors = []
+    for side, values in rates.items():
+        if side not in [FOREIGN, DOMESTIC]:
+            errors.append(f"Invalid rate side: {side}. Ex: {FOREIGN}, {DOMESTIC}.")
+            continue
+        for currency in values:
+            if currency not in CURRENCIES:
+                errors.append(f"Currency not supported: {currency}. Supported currencies: [{', '.join(CURRENCIES)}]")
+    for currency_pair, value in volatilities.items():
+        if len(currency_pair) != 6 or currency_pair[0:3] not in CURRENCIES or currency_pair[3:6] not in CURRENCIES:
+            errors.append(f"Invalid CURRENCY_PAIR: {currency_pair}. Ex: USDEUR")
+        elif value <= 0:
+            errors.append(f"VOLATILITY of {currency_pair} must be > 0.")
+    for currency_pair, surface in surfaces.items():
+        if len(currency_pair) != 6 or currency_pair[0:3] not in CURRENCIES or currency_pair[3:6] not in CURRENCIES:
+            errors.append(f"Invalid CURRENCY_PAIR: {currency_pair}. Ex: USDEUR")
+        else:
+            errors.extend(_surface_errors(currency_pair, surface))
+    if errors:
+        return errors
+
+    for side, values in rates.items():
+        for currency, value in values.items():
+            if currency in _rate_quotes[side]:
+                _rate_quotes[side][currency].setValue(value)
+            else:
+                _add_rate(side, currency, value)
+    for currency_pair, value in volatilities.items():
+        if currency_pair in _volatility_quotes:
+            _volatility_quotes[currency_pair].setValue(value)
+        else:
+            _add_volatility(currency_pair, value)
+    for currency_pair, surface in surfaces.items():
+        _surfaces[currency_pair] = surface
+        _built_surfaces.pop(currency_pair, None)
+    if rates or volatilities or surfaces:
+        _version += 1
+    return errors
+
+
+# Current market data as plain values, e.g. to send to the pricing worker processes
+def snapshot():
+    return {
+        'VERSION': _version,
+        'RATES': {side: {currency: quote.value() for currency, quote in quotes.items()} for side, quotes in _rate_quotes.items()},
+        'VOLATILITIES': {currency_pair: quote.value() for currency_pair, quote in _volatility_quotes.items()},
+        'SURFACES': dict(_surfaces)
+    }
+
+
+# Bring this process' market data in line with a snapshot of another process
+def apply_snapshot(market_data):
+    global _version
+    if market_data['VERSION'] == _version:
+        return
+    update(market_data['RATES'], market_data['VOLATILITIES'], market_data['SURFACES'])
+    _version = market_data['VERSION']
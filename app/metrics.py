@@ -0,0 +1,120 @@
+import time
+from contextvars import ContextVar
+
+# Per-stage pricing latency histograms, exposed in the Prometheus text format by /metrics
+# and per request in the Server-Timing response header
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+# EXOTIC_TYPE label values, anything else is labelled OTHER to keep the number of series bounded
+EXOTIC_TYPES = ['VANILLA', 'KO_BARRIER', 'KI_BARRIER', 'KO_DB_BARRIER', 'KI_DB_BARRIER', 'KIKO', 'KOKI', 'BARRIER', 'ASIAN', 'GEO_ASIAN', 'KO_WINDOW_BARRIER', 'KI_WINDOW_BARRIER']
+
+# {(stage, exotic type, engine): [cumulative bucket counts..., sum, count]}
+_histograms = {}
+# Stage durations of the current request: {stage: seconds}
+_trace = ContextVar('pricer_trace', default=None)
+
+
+def exotic_type_label(exotic_type):
+    exotic_type = str(exotic_type).upper()
+    return exotic_type if exotic_type in EXOTIC_TYPES else 'OTHER'
+
+
+def _add(key, bucket_counts, total, count):
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+    for i, bucket_count in enumerate(bucket_counts):
+        histogram[i] += bucket_count
+    histogram[-2] += total
+    histogram[-1] += count
+
+    add_to_trace(key[0], total)
+
+
+# Add to the current request's Server-Timing only
+def add_to_trace(stage, seconds):
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+# Record the duration of one pricing stage
+def observe(stage, seconds, exotic_type, engine):
+    bucket_counts = [1 if seconds <= bound else 0 for bound in BUCKETS]
+    _add((stage, exotic_type_label(exotic_type), engine), bucket_counts, seconds, 1)
+
+
+# Times consecutive stages of one pricing: each lap records the time since the previous one
+class StageClock:
+
+    def __init__(self, exotic_type, engine):
+        self.exotic_type = exotic_type
+        self.engine = engine
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        observe(stage, now - self.last, self.exotic_type, self.engine)
+        self.last = now
+
+
+# Take the samples recorded in this process since the last drain (pricing worker side)
+def drain():
+    global _histograms
+    samples, _histograms = _histograms, {}
+    return samples
+
+
+# Add the samples drained in a pricing worker process (web server side)
+def merge(samples):
+    for key, histogram in samples.items():
+        _add(key, histogram[:-2], histogram[-2], histogram[-1])
+
+
+def _labels(stage, exotic_type, engine, le=None):
+    labels = f'stage="{stage}",exotic_type="{exotic_type}",engine="{engine}"'
+    return labels if le is None else labels + f',le="{le}"'
+
+
+# Histograms in the Prometheus text exposition format
+def render():
+    lines = [
+        '# HELP pricer_stage_seconds Duration of the pricing stages.',
+        '# TYPE pricer_stage_seconds histogram'
+    ]
+    for (stage, exotic_type, engine), histogram in sorted(_histograms.items()):
+        for bound, bucket_count in zip(BUCKETS, histogram):
+            lines.append(f'pricer_stage_seconds_bucket{{{_labels(stage, exotic_type, engine, repr(bound))}}} {bucket_count}')
+        lines.append(f'pricer_stage_seconds_bucket{{{_labels(stage, exotic_type, engine, "+Inf")}}} {histogram[-1]}')
+        lines.append(f'pricer_stage_seconds_sum{{{_labels(stage, exotic_type, engine)}}} {histogram[-2]}')
+        lines.append(f'pricer_stage_seconds_count{{{_labels(stage, exotic_type, engine)}}} {histogram[-1]}')
+    return "\n".join(lines) + "\n"
+
+
+# ASGI middleware collecting the stage durations of each request into its Server-Timing header
+class ServerTimingMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        trace = {}
+        token = _trace.set(trace)
+        start = time.perf_counter()
+
+        async def send_with_server_timing(message):
+            if message['type'] == 'http.response.start':
+                timings = [f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in trace.items()]
+                timings.append(f"total;dur={(time.perf_counter() - start) * 1000:.3f}")
+                message = dict(message, headers=list(message.get('headers', [])) + [(b'server-timing', ", ".join(timings).encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            _trace.reset(token)
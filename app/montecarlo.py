@@ -0,0 +1,297 @@
+import math
+import os
+from functools import lru_cache
+
+import numpy as np
+import QuantLib as ql
+
+from marketdata import CALENDAR, DAY_COUNT_VOLATILITY
+from dates import parse_date
+from greeks import rolled_reference_date
+from metrics import StageClock
+from vectorized import norm_cdf, scale_fields
+
+# scipy is optional, norm_inv falls back to a NumPy implementation without it
+try:
+    from scipy.special import ndtri as _ndtri
+except ImportError:
+    _ndtri = None
+
+# Path simulation (Monte Carlo) engine of the Asian and window barrier options
+# Spot paths are simulated under the Black-Scholes process of the QuantLib path (the same rate curves & volatility)
+# on every business day between WINDOW_START_DATE and WINDOW_END_DATE (the fixings), plus the expiry.
+# Paths are simulated in blocks of BLOCK_PATHS, block b drawing its numbers from the seed sequence (SEED, b), so that
+# results do not depend on how the blocks are spread over processes (workers.run_monte_carlo).
+# The greeks reprice the same paths (common random numbers): spot bumps rescale them, volatility bumps and the THETA roll
+# rebuild them from the same normals.
+
+# EXOTIC_TYPEs priced by path simulation
+# 'ASIAN'             : arithmetic average of the fixings against STRIKE, paid at expiry
+# 'GEO_ASIAN'         : geometric average of the fixings against STRIKE, paid at expiry
+# 'KO_WINDOW_BARRIER' : European option knocked out if a fixing touches the barrier (calls: UPPER_BARRIER, puts: LOWER_BARRIER)
+# 'KI_WINDOW_BARRIER' : European option knocked in if a fixing touches the barrier
+MONTE_CARLO_TYPES = ['ASIAN', 'GEO_ASIAN', 'KO_WINDOW_BARRIER', 'KI_WINDOW_BARRIER']
+
+# Variance reduction of the rows that do not pick one (VARIANCE_REDUCTION field)
+# 'antithetic' : every normal draw is also used with the opposite sign
+# 'sobol'      : Sobol points, randomly shifted per block (the standard error is measured between blocks)
+VARIANCE_REDUCTIONS = ['antithetic', 'sobol']
+VARIANCE_REDUCTION = os.environ.get('PRICER_MC_VARIANCE_REDUCTION', 'antithetic').lower()
+# Paths of the rows that do not set PATHS, and the most a row may ask for
+PATHS = int(os.environ.get('PRICER_MC_PATHS', 16384))
+MAX_PATHS = int(os.environ.get('PRICER_MC_MAX_PATHS', 1048576))
+# Paths simulated at once, the unit of work spread over processes (memory grows with paths x fixings)
+BLOCK_PATHS = int(os.environ.get('PRICER_MC_BLOCK_PATHS', 2048)) // 2 * 2
+# Seed of the rows that do not set SEED
+SEED = int(os.environ.get('PRICER_MC_SEED', 42))
+
+# Relative SPOT bump and absolute VOLATILITY bump of the greeks, larger than the analytic ones (greeks.py) so that
+# payoff kinks and barrier hits of single paths average out
+SPOT_BUMP = 1e-2
+VOLATILITY_BUMP = 1e-2
+
+
+# Inverse of the standard normal cumulative distribution
+# Without scipy: Acklam's rational approximation refined by one Halley step
+def norm_inv(p):
+    if _ndtri is not None:
+        return _ndtri(p)
+    p = np.asarray(p, dtype=float)
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02, 1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02, 6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00, -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00]
+
+    tail = np.minimum(p, 1 - p)
+    q = np.sqrt(-2 * np.log(np.maximum(tail, 1e-300)))
+    x_tail = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1)
+    x_tail = np.where(p < 0.5, x_tail, -x_tail)
+    r = (p - 0.5) ** 2
+    x_central = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * (p - 0.5) / (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+    x = np.where(tail < 0.02425, x_tail, x_central)
+
+    error = norm_cdf(x) - p
+    u = error * math.sqrt(2 * math.pi) * np.exp(0.5 * x * x)
+    return x - u / (1 + 0.5 * x * u)
+
+
+# Business days between two dates, both included
+def fixing_dates(start, end):
+    dates = []
+    day = start
+    while day <= end:
+        if CALENDAR.isBusinessDay(day):
+            dates.append(day)
+        day = day + 1
+    return dates
+
+
+# Validate the fields specific to path simulation rows and store their fixings & simulation settings in OPTION_PARAM
+# WINDOW_START_DATE defaults to the business day after the curves' reference date, WINDOW_END_DATE to the expiry
+# Returns the list of errors
+def simulation_errors(OPTION_PARAM, params):
+    errors = []
+    if OPTION_PARAM['EXERCISE'].upper() != 'E':
+        errors.append(f"EXERCISE must be E for {', '.join(MONTE_CARLO_TYPES)}.")
+
+    start = CALENDAR.advance(CALENDAR.advance(OPTION_PARAM['EVALUATION_DATE'], 0, ql.Days), 1, ql.Days)
+    end = OPTION_PARAM['EXPIRY_DATE']
+    if OPTION_PARAM['WINDOW_START_DATE'] != '':
+        start = parse_date(OPTION_PARAM['WINDOW_START_DATE'])
+        if start is None:
+            errors.append("Invalid WINDOW_START_DATE format. Ex: 29Sep2023.")
+        elif start <= OPTION_PARAM['EVALUATION_DATE']:
+            errors.append("WINDOW_START_DATE must be after today's date.")
+    if OPTION_PARAM['WINDOW_END_DATE'] != '':
+        end = parse_date(OPTION_PARAM['WINDOW_END_DATE'])
+        if end is None:
+            errors.append("Invalid WINDOW_END_DATE format. Ex: 29Sep2023.")
+        elif end > OPTION_PARAM['EXPIRY_DATE']:
+            errors.append("WINDOW_END_DATE must not be after MATURITY.")
+    if not errors:
+        OPTION_PARAM['FIXING_DATES'] = fixing_dates(start, end)
+        if not OPTION_PARAM['FIXING_DATES']:
+            errors.append("No business day between WINDOW_START_DATE and WINDOW_END_DATE.")
+
+    try:
+        paths = int(params.get('PATHS') or PATHS)
+        if not 2 <= paths <= MAX_PATHS:
+            raise ValueError
+    except ValueError:
+        errors.append(f"Invalid PATHS. Must be an integer between 2 and {MAX_PATHS}.")
+        paths = PATHS
+    try:
+        OPTION_PARAM['SEED'] = int(params.get('SEED') or SEED)
+        if OPTION_PARAM['SEED'] < 0:
+            raise ValueError
+    except ValueError:
+        errors.append("Invalid SEED. Must be a non-negative integer.")
+    OPTION_PARAM['VARIANCE_REDUCTION'] = str(params.get('VARIANCE_REDUCTION') or VARIANCE_REDUCTION).lower()
+    if OPTION_PARAM['VARIANCE_REDUCTION'] not in VARIANCE_REDUCTIONS:
+        errors.append(f"Invalid VARIANCE_REDUCTION. Ex: {', '.join(VARIANCE_REDUCTIONS)}.")
+
+    # Whole blocks of paths, Sobol standard errors need at least 2 blocks
+    minimum_blocks = 2 if OPTION_PARAM['VARIANCE_REDUCTION'] == 'sobol' else 1
+    OPTION_PARAM['BLOCKS'] = max(minimum_blocks, math.ceil(paths / BLOCK_PATHS))
+    return errors
+
+
+# Simulation times & forward drifts of the dates as seen from reference_date, discounts are taken relative to it
+# so the rolled dates of THETA need no evaluation date roll (which notifies every live instrument)
+def _times(OPTION_PARAM, dates, reference_date):
+    foreign = OPTION_PARAM['FOREIGN_RF_RATE']
+    domestic = OPTION_PARAM['DOMESTIC_RF_RATE']
+    foreign_reference = foreign.discount(reference_date)
+    domestic_reference = domestic.discount(reference_date)
+    return {
+        'T_VOL': np.array([DAY_COUNT_VOLATILITY.yearFraction(reference_date, day) for day in dates]),
+        # log(forward / spot) at every date
+        'DRIFT': np.array([math.log(foreign.discount(day) / foreign_reference * domestic_reference / domestic.discount(day)) for day in dates]),
+        'DISCOUNT': domestic.discount(OPTION_PARAM['EXPIRY_DATE']) / domestic_reference
+    }
+
+
+# Inputs of the simulation of a validated row (pricer.build_option), plain numbers & arrays that can be sent to other processes
+def simulation_inputs(OPTION_PARAM):
+    fixings = OPTION_PARAM['FIXING_DATES']
+    dates = fixings + ([OPTION_PARAM['EXPIRY_DATE']] if fixings[-1] < OPTION_PARAM['EXPIRY_DATE'] else [])
+    exotic_type = OPTION_PARAM['EXOTIC_TYPE'].upper()
+    volatility = OPTION_PARAM['VOLATILITY_QUOTE'].value()
+    inputs = {
+        'EXOTIC_TYPE': exotic_type,
+        'IS_CALL': OPTION_PARAM['TYPE'] == ql.Option.Call,
+        'SPOT': OPTION_PARAM['SPOT_QUOTE'].value(),
+        'STRIKE': OPTION_PARAM['STRIKE'],
+        'NOTIONAL': OPTION_PARAM['NOTIONAL'],
+        'VOLATILITY': volatility,
+        'VOLATILITY_BUMP': min(VOLATILITY_BUMP, volatility / 2),
+        'FIXINGS': np.array([day <= fixings[-1] for day in dates]),
+        'SEED': OPTION_PARAM['SEED'],
+        'VARIANCE_REDUCTION': OPTION_PARAM['VARIANCE_REDUCTION'],
+        'BLOCKS': OPTION_PARAM['BLOCKS'],
+        'ROLLED': None
+    }
+    if exotic_type in ['KO_WINDOW_BARRIER', 'KI_WINDOW_BARRIER']:
+        inputs['IS_UP'] = OPTION_PARAM['BARRIER_TYPE'] in [ql.Barrier.UpIn, ql.Barrier.UpOut]
+        inputs['BARRIER'] = OPTION_PARAM['UPPER_BARRIER'] if inputs['IS_UP'] else OPTION_PARAM['LOWER_BARRIER']
+
+    evaluation_date = OPTION_PARAM['EVALUATION_DATE']
+    if ql.Settings.instance().evaluationDate != evaluation_date:
+        ql.Settings.instance().evaluationDate = evaluation_date
+    inputs.update(_times(OPTION_PARAM, dates, CALENDAR.advance(evaluation_date, 0, ql.Days)))
+    # THETA: the same dates seen from the rolled evaluation date, unless a fixing comes before it
+    rolled_date = rolled_reference_date(evaluation_date)
+    if fixings[0] >= rolled_date and OPTION_PARAM['EXPIRY_DATE'] > rolled_date:
+        inputs['ROLLED'] = _times(OPTION_PARAM, dates, rolled_date)
+    return inputs
+
+
+# Sobol points of a block, shared by every block of the same shape
+# Joe-Kuo direction integers: the default ones are initialized at random (from the clock) beyond 32 dimensions
+@lru_cache(maxsize=8)
+def _sobol_points(paths, dimensions):
+    generator = ql.SobolRsg(dimensions, 0, ql.SobolRsg.JoeKuoD7)
+    return np.array([generator.nextSequence().value() for _ in range(paths)])
+
+
+# Standard normal draws of a block, one row per path and one column per date
+def _normals(inputs, block):
+    rng = np.random.default_rng([inputs['SEED'], block])
+    dimensions = len(inputs['T_VOL'])
+    if inputs['VARIANCE_REDUCTION'] == 'sobol':
+        shifted = (_sobol_points(BLOCK_PATHS, dimensions) + rng.random(dimensions)) % 1.0
+        return norm_inv(np.clip(shifted, 1e-12, 1 - 1e-12))
+    normals = rng.standard_normal((BLOCK_PATHS // 2, dimensions))
+    return np.concatenate([normals, -normals])
+
+
+# Spot paths divided by the spot
+def _relative_paths(normals, times, volatility):
+    steps = np.sqrt(np.diff(times['T_VOL'], prepend=0.0))
+    brownian = np.cumsum(normals * steps, axis=1)
+    return np.exp(times['DRIFT'] - 0.5 * volatility * volatility * times['T_VOL'] + volatility * brownian)
+
+
+# Discounted payoffs of the paths
+def _payoffs(inputs, paths, discount):
+    fixings = paths[:, inputs['FIXINGS']]
+    phi = 1.0 if inputs['IS_CALL'] else -1.0
+    if inputs['EXOTIC_TYPE'] == 'ASIAN':
+        underlying = fixings.mean(axis=1)
+    elif inputs['EXOTIC_TYPE'] == 'GEO_ASIAN':
+        underlying = np.exp(np.log(fixings).mean(axis=1))
+    else:
+        underlying = paths[:, -1]
+    payoffs = np.maximum(phi * (underlying - inputs['STRIKE']), 0.0)
+    if inputs['EXOTIC_TYPE'] in ['KO_WINDOW_BARRIER', 'KI_WINDOW_BARRIER']:
+        hit = (fixings >= inputs['BARRIER']).any(axis=1) if inputs['IS_UP'] else (fixings <= inputs['BARRIER']).any(axis=1)
+        payoffs = np.where(hit == (inputs['EXOTIC_TYPE'] == 'KI_WINDOW_BARRIER'), payoffs, 0.0)
+    return discount * payoffs
+
+
+# Independent estimates of the NPV: antithetic pairs are averaged
+def _estimates(inputs, payoffs):
+    if inputs['VARIANCE_REDUCTION'] == 'antithetic':
+        half = len(payoffs) // 2
+        return 0.5 * (payoffs[:half] + payoffs[half:])
+    return payoffs
+
+
+# Simulate blocks of paths of a row
+# Returns one array per block: [number of estimates, sum & sum of squares of the NPV estimates, then the sums of the spot up, spot down,
+# volatility up, volatility down & rolled estimates]
+def simulate_blocks(inputs, blocks):
+    clock = StageClock(inputs['EXOTIC_TYPE'], 'montecarlo')
+    spot = inputs['SPOT']
+    volatility = inputs['VOLATILITY']
+    volatility_bump = inputs['VOLATILITY_BUMP']
+    results = []
+    for block in blocks:
+        normals = _normals(inputs, block)
+        paths = spot * _relative_paths(normals, inputs, volatility)
+        npv = _estimates(inputs, _payoffs(inputs, paths, inputs['DISCOUNT']))
+        sums = [len(npv), npv.sum(), (npv * npv).sum()]
+        for scale in [1 + SPOT_BUMP, 1 - SPOT_BUMP]:
+            sums.append(_estimates(inputs, _payoffs(inputs, paths * scale, inputs['DISCOUNT'])).sum())
+        for bumped in [volatility + volatility_bump, volatility - volatility_bump]:
+            bumped_paths = spot * _relative_paths(normals, inputs, bumped)
+            sums.append(_estimates(inputs, _payoffs(inputs, bumped_paths, inputs['DISCOUNT'])).sum())
+        if inputs['ROLLED'] is not None:
+            rolled_paths = spot * _relative_paths(normals, inputs['ROLLED'], volatility)
+            sums.append(_estimates(inputs, _payoffs(inputs, rolled_paths, inputs['ROLLED']['DISCOUNT'])).sum())
+        else:
+            sums.append(math.nan)
+        results.append(np.array(sums))
+    clock.lap('simulation')
+    return results
+
+
+# CALCULATED_FIELDS of a row from the results of all its blocks, plus the STD_ERROR of OPTION_NPV and the number of PATHS
+def combine(inputs, results):
+    totals = np.sum(results, axis=0)
+    count = totals[0]
+    npv, spot_up, spot_down, volatility_up, volatility_down, rolled = totals[[1, 3, 4, 5, 6, 7]] / count
+    if inputs['VARIANCE_REDUCTION'] == 'sobol':
+        block_npvs = np.array([result[1] / result[0] for result in results])
+        std_error = block_npvs.std(ddof=1) / math.sqrt(len(results))
+    else:
+        variance = max(totals[2] / count - npv * npv, 0.0) * count / max(count - 1, 1)
+        std_error = math.sqrt(variance / count)
+
+    spot = inputs['SPOT']
+    spot_bump = spot * SPOT_BUMP
+    delta = (spot_up - spot_down) / (2 * spot_bump)
+    gamma = (spot_up - 2 * npv + spot_down) / (spot_bump * spot_bump)
+    vega = (volatility_up - volatility_down) / (2 * inputs['VOLATILITY_BUMP'])
+    CALCULATED_FIELDS = {field: float(value) for field, value in scale_fields(npv, delta, gamma, vega, rolled - npv, spot, inputs['NOTIONAL']).items()}
+    if math.isnan(CALCULATED_FIELDS['THETA']):
+        CALCULATED_FIELDS['THETA'] = None
+    CALCULATED_FIELDS['STD_ERROR'] = float(std_error)
+    CALCULATED_FIELDS['PATHS'] = len(results) * BLOCK_PATHS
+    return CALCULATED_FIELDS
+
+
+# Price a validated row in-process, every block in turn
+def price_paths(OPTION_PARAM):
+    inputs = simulation_inputs(OPTION_PARAM)
+    return combine(inputs, simulate_blocks(inputs, range(inputs['BLOCKS'])))
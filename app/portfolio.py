@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+import dates
+import result_cache
+
+
+# Portfolio aggregation: a book is priced PORTFOLIO_CHUNK_SIZE rows at a time through the bulk path (and its result cache),
+# each chunk's results are added to running sums as soon as it comes back and then dropped, unless the rows are asked for
+# Sums are kept per CURRENCY_PAIR, and per CURRENCY_PAIR, EXOTIC_TYPE & maturity bucket. PREMIUM and the greeks
+# are in the units of each pair, so there is no total across pairs.
+
+# Rows priced at a time, larger than PRICER_CHUNK_SIZE: the NumPy engines have a fixed cost per batch
+PORTFOLIO_CHUNK_SIZE = int(os.environ.get('PRICER_PORTFOLIO_CHUNK_SIZE', 4096))
+# Summed result fields, rows with a null THETA add nothing to it
+AGGREGATED_FIELDS = ['PREMIUM', 'DELTA', 'GAMMA', 'VEGA', 'THETA']
+# Maturity buckets: (label, calendar days to expiry up to), the last one has no limit
+MATURITY_BUCKETS = [('0-1W', 7), ('1W-1M', 31), ('1M-3M', 92), ('3M-6M', 184), ('6M-1Y', 366), ('1Y-2Y', 731), ('2Y+', None)]
+
+
+def _bucket(days):
+    for label, limit in MATURITY_BUCKETS:
+        if limit is None or days <= limit:
+            return label
+
+
+# Running sums of the priced rows of a book
+class Portfolio:
+
+    def __init__(self):
+        self.evaluation_date = dates.evaluation_date()
+        self.rows = 0
+        self.errors = 0
+        self.pairs = {}
+        self.groups = {}
+        # Maturity bucket by MATURITY string & pair, books repeat a handful of tenors
+        self.buckets = {}
+
+    def bucket(self, maturity, currency_pair):
+        key = (maturity, currency_pair)
+        if key not in self.buckets:
+            maturity_dates, _ = dates.maturity_dates(maturity, currency_pair)
+            self.buckets[key] = _bucket(maturity_dates[0] - self.evaluation_date) if maturity_dates is not None else 'OTHER'
+        return self.buckets[key]
+
+    # Add a row's result (CALCULATED_FIELDS, or list of errors)
+    def add(self, params, value):
+        self.rows += 1
+        if isinstance(value, list):
+            self.errors += 1
+            return
+        pair = str(params['CURRENCY_PAIR']).strip().upper()
+        group = (pair, str(params['EXOTIC_TYPE']).strip().upper(), self.bucket(str(params['MATURITY']).strip(), pair))
+        for key, sums in [(pair, self.pairs), (group, self.groups)]:
+            totals = sums.get(key)
+            if totals is None:
+                totals = sums[key] = dict.fromkeys(['ROWS'] + AGGREGATED_FIELDS, 0)
+            totals['ROWS'] += 1
+            for field in AGGREGATED_FIELDS:
+                if value.get(field) is not None:
+                    totals[field] += value[field]
+
+    # {"ROWS", "ERRORS", "PAIRS": [...], "GROUPS": [...]}, pairs & groups sorted by their keys
+    def result(self):
+        order = {label: k for k, (label, _) in enumerate(MATURITY_BUCKETS)}
+        return {
+            'ROWS': self.rows,
+            'ERRORS': self.errors,
+            'PAIRS': [dict({'CURRENCY_PAIR': pair}, **totals) for pair, totals in sorted(self.pairs.items())],
+            'GROUPS': [dict({'CURRENCY_PAIR': pair, 'EXOTIC_TYPE': exotic_type, 'MATURITY_BUCKET': bucket}, **totals)
+                       for (pair, exotic_type, bucket), totals in sorted(self.groups.items(), key=lambda item: (item[0][0], item[0][1], order.get(item[0][2], len(order))))]
+        }
+
+
+# Price a book with the given engine and aggregate it, the next chunk is priced while the previous one is being added up
+# Returns the Portfolio result, plus the rows' (index, result) pairs in row order under "DETAILS" if details is set
+async def price_portfolio(rows, engine='vectorized', details=False):
+    portfolio = Portfolio()
+    option_values = [] if details else None
+
+    def add(start, chunk_values):
+        for i, value in chunk_values:
+            portfolio.add(rows[start + i], value)
+            if details:
+                option_values.append((start + i, value))
+
+    pending = None
+    for start in range(0, len(rows), PORTFOLIO_CHUNK_SIZE):
+        chunk = asyncio.ensure_future(result_cache.cached_batch(rows[start:start + PORTFOLIO_CHUNK_SIZE], engine))
+        if pending is not None:
+            add(pending[0], await pending[1])
+        pending = (start, chunk)
+    if pending is not None:
+        add(pending[0], await pending[1])
+
+    aggregated = portfolio.result()
+    if details:
+        aggregated['DETAILS'] = option_values
+    return aggregated
@@ -0,0 +1,677 @@
+import QuantLib as ql
+import logging
+import os
+import time
+
+from marketdata import CALENDAR, DAY_COUNT_VOLATILITY, CURRENCIES, FOREIGN, DOMESTIC, rate_curve, volatility, surface_volatility
+from dates import evaluation_date, maturity_dates, settlement_date
+from vectorized import price_vanilla_rows
+from vectorized_barrier import price_barrier_rows
+from metrics import StageClock, observe
+from greeks import batch_greeks
+from montecarlo import MONTE_CARLO_TYPES, simulation_errors, price_paths
+
+log = logging.getLogger('pricer.pricer')
+
+
+# Input fields of a single pricing row, in the order the Google Sheet sends them
+OPTION_FIELDS = [
+    'CURRENCY_PAIR',
+    'MATURITY',
+    'STRIKE',
+    'NOTIONAL',
+    'EXOTIC_TYPE',
+    'EXERCISE',
+    'TYPE',
+    'UPPER_BARRIER',
+    'LOWER_BARRIER',
+    'WINDOW_START_DATE',
+    'WINDOW_END_DATE',
+    'SPOT',
+    'VOLATILITY'
+]
+# Optional input fields, empty when left out
+OPTIONAL_OPTION_FIELDS = ['AMERICAN_ENGINE', 'PATHS', 'SEED', 'VARIANCE_REDUCTION']
+# Input fields holding numbers
+NUMERIC_FIELDS = ['STRIKE', 'NOTIONAL', 'UPPER_BARRIER', 'LOWER_BARRIER', 'SPOT', 'VOLATILITY']
+# Output fields of a priced row
+RESULT_FIELDS = ['PREMIUM', 'DELTA', 'GAMMA', 'VEGA', 'THETA', 'OPTION_NPV']
+# Additional output fields of the rows priced by path simulation (MONTE_CARLO_TYPES)
+MONTE_CARLO_FIELDS = ['STD_ERROR', 'PATHS']
+
+# Bulk pricing engines
+# 'quantlib'   : every row is priced by price_option
+# 'vectorized' : European vanilla, single & double barrier rows are priced as one batch by the NumPy engines,
+#                the others by price_option
+ENGINES = ['quantlib', 'vectorized']
+
+# Engines of American exercise VANILLA rows, from fastest to most accurate
+# 'baw'       : Barone-Adesi-Whaley approximation
+# 'bjerksund' : Bjerksund-Stensland approximation
+# 'binomial'  : Cox-Ross-Rubinstein tree with AMERICAN_TIME_STEPS steps
+# 'fd'        : finite differences on an AMERICAN_TIME_STEPS x AMERICAN_SPACE_STEPS grid
+AMERICAN_ENGINES = ['baw', 'bjerksund', 'binomial', 'fd']
+# Engine of rows that do not pick one (AMERICAN_ENGINE field)
+AMERICAN_ENGINE = os.environ.get('PRICER_AMERICAN_ENGINE', 'bjerksund').lower()
+AMERICAN_TIME_STEPS = int(os.environ.get('PRICER_AMERICAN_TIME_STEPS', 200))
+AMERICAN_SPACE_STEPS = int(os.environ.get('PRICER_AMERICAN_SPACE_STEPS', 200))
+
+# Rows of a bulk request built & priced together on the QuantLib path, their greeks bump the shared quotes once per batch
+QUANTLIB_BATCH_SIZE = 256
+
+
+# Engine of a process for the given engine name
+def make_engine(name, process):
+    if name == 'european':
+        return ql.AnalyticEuropeanEngine(process)
+    elif name == 'barrier':
+        return ql.AnalyticBarrierEngine(process)
+    elif name == 'double_barrier':
+        return ql.AnalyticDoubleBarrierEngine(process)
+    elif name == 'baw':
+        return ql.BaroneAdesiWhaleyApproximationEngine(process)
+    elif name == 'bjerksund':
+        return ql.BjerksundStenslandApproximationEngine(process)
+    elif name == 'binomial':
+        return ql.BinomialVanillaEngine(process, 'crr', AMERICAN_TIME_STEPS)
+    elif name == 'fd':
+        return ql.FdBlackScholesVanillaEngine(process, AMERICAN_TIME_STEPS, AMERICAN_SPACE_STEPS)
+    raise RuntimeError(f"Unknown engine {name}")
+
+
+# Price a single option row given as a dict of the OPTION_FIELDS strings
+# Rows may also set AMERICAN_ENGINE, see AMERICAN_ENGINES
+# engines: optional dict shared by the rows of a batch, rows with the same pair, SPOT & VOLATILITY reuse one process & engine
+# Returns the CALCULATED_FIELDS dict, or the list of errors if a stage failed
+def price_option(params, engines=None):
+    # Time the stages (recorded in the pricer_stage_seconds histograms)
+    clock = StageClock(params['EXOTIC_TYPE'], 'quantlib')
+    OPTION_PARAM = build_option(params, clock, engines)
+    if isinstance(OPTION_PARAM, list):
+        return OPTION_PARAM
+    return calculate_fields(OPTION_PARAM, clock)
+
+
+# Validate a row and build its QuantLib option, process & engine
+# Returns the OPTION_PARAM dict, or the list of errors if a stage failed
+# SPOT_QUOTE & VOLATILITY_QUOTE are the option's SimpleQuotes, setting their value reprices the option
+# (when the process comes from engines, they are shared with the other rows using it and must be restored after a bump)
+def build_option(params, clock, engines=None):
+    # Extract the input parameters from the row
+    CURRENCY_PAIR = params['CURRENCY_PAIR']
+    MATURITY = params['MATURITY']
+    STRIKE = params['STRIKE']
+    NOTIONAL = params['NOTIONAL']
+    EXOTIC_TYPE = params['EXOTIC_TYPE']
+    EXERCISE = params['EXERCISE']
+    TYPE = params['TYPE']
+    UPPER_BARRIER = params['UPPER_BARRIER']
+    LOWER_BARRIER = params['LOWER_BARRIER']
+    WINDOW_START_DATE = params['WINDOW_START_DATE']
+    WINDOW_END_DATE = params['WINDOW_END_DATE']
+    SPOT = params['SPOT']
+    VOLATILITY = params['VOLATILITY']
+
+    # Log the extracted input parameters
+    log.debug("Incoming input parameters", extra={'fields': {'params': params}})
+
+    # Preprocess the fields
+    OPTION_PARAM = {
+        'CURRENCY_PAIR': CURRENCY_PAIR,
+        'MATURITY': MATURITY,
+        'STRIKE': STRIKE,
+        'NOTIONAL': NOTIONAL,
+        'EXOTIC_TYPE': EXOTIC_TYPE,
+        'EXERCISE': EXERCISE,
+        'TYPE': TYPE,
+        'UPPER_BARRIER': UPPER_BARRIER,
+        'LOWER_BARRIER': LOWER_BARRIER,
+        'WINDOW_START_DATE': WINDOW_START_DATE,
+        'WINDOW_END_DATE': WINDOW_END_DATE,
+        'SPOT': SPOT,
+        'VOLATILITY': VOLATILITY
+    }
+
+    # Create a list to store errors
+    errors = []
+
+    # CURRECY_PAIR
+    try:
+        # Process currency pair
+        # If length is 6, assume format is 'USDEUR'
+        if len(OPTION_PARAM['CURRENCY_PAIR']) == 6:
+            # If the first 3 characters are in the list of currencies, and the last 3 characters are in the list of currencies
+            if CURRENCY_PAIR[0:3].upper() in CURRENCIES and CURRENCY_PAIR[3:6].upper() in CURRENCIES:
+                # Create new common fields
+                OPTION_PARAM['FOREIGN_CURRENCY'] = OPTION_PARAM['CURRENCY_PAIR'][0:3]
+                OPTION_PARAM['DOMESTIC_CURRENCY'] = OPTION_PARAM['CURRENCY_PAIR'][3:6]
+                # Link the shared risk free curves of the FOREIGN & DOMESTIC currencies
+                if rate_curve(FOREIGN, OPTION_PARAM['FOREIGN_CURRENCY']) is not None:
+                    OPTION_PARAM['FOREIGN_RF_RATE'] = rate_curve(FOREIGN, OPTION_PARAM['FOREIGN_CURRENCY'])
+
+                if rate_curve(DOMESTIC, OPTION_PARAM['DOMESTIC_CURRENCY']) is not None:
+                    OPTION_PARAM['DOMESTIC_RF_RATE'] = rate_curve(DOMESTIC, OPTION_PARAM['DOMESTIC_CURRENCY'])
+
+
+            else:
+                errors.append("CURRENCY_PAIR not supported. Supported currencies: [USD, EUR, GBP, AUD, NZD, CAD, CHF, JPY")
+        else:
+            errors.append("Invalid CURRENCY_PAIR. Ex: USDEUR")
+    except:
+        errors.append("Runtime error in CURRENCY_PAIR.")
+        return errors
+
+    clock.lap('currency')
+
+    # MATURITY
+    try:
+        # Expiry & delivery dates from the date service's tables of the day (dates.py)
+        MATURITY_DATES, MATURITY_ERROR = maturity_dates(OPTION_PARAM['MATURITY'], CURRENCY_PAIR)
+        if MATURITY_ERROR is not None:
+            errors.append(MATURITY_ERROR)
+            log.debug(MATURITY_ERROR)
+            return errors
+        OPTION_PARAM['EXPIRY_DATE'], OPTION_PARAM['DELIVERY_DATE'] = MATURITY_DATES
+        OPTION_PARAM['EVALUATION_DATE'] = evaluation_date()
+        OPTION_PARAM['SETTLEMENT_DATE'] = settlement_date(CURRENCY_PAIR)
+        log.debug("Evaluation date: %s.", OPTION_PARAM['EVALUATION_DATE'])
+        log.debug("Settlement date: %s.", OPTION_PARAM['SETTLEMENT_DATE'])
+        log.debug("Expiry date: %s.", OPTION_PARAM['EXPIRY_DATE'])
+        log.debug("Delivery date: %s.", OPTION_PARAM['DELIVERY_DATE'])
+
+        # Set evaluation date
+        if ql.Settings.instance().evaluationDate != OPTION_PARAM['EVALUATION_DATE']:
+            ql.Settings.instance().evaluationDate = OPTION_PARAM['EVALUATION_DATE']
+    except RuntimeError:
+        errors.append("Runtime error with MATURITY. Ex: 29Sep2023, 1m, 3M, 12M, 1y, 1w, 1d.")
+        log.debug("Runtime error with MATURITY. Ex: 29Sep2023, 1m, 3M, 12M, 1y, 1w, 1d.")
+        return errors
+    
+    clock.lap('maturity')
+
+    # STRIKE
+    try:
+        # Process strike
+        if OPTION_PARAM['STRIKE'] == '':
+            errors.append("STRIKE is empty")
+        else:
+            try:
+                if isinstance(float(OPTION_PARAM['STRIKE']), float) and float(OPTION_PARAM['STRIKE']) <= 0:
+                    errors.append("STRIKE must be > 0.")
+                else:
+                    OPTION_PARAM['STRIKE'] = float(OPTION_PARAM['STRIKE'])
+            except ValueError:
+                errors.append("Invalid STRIKE. Must be a float.")
+        log.debug("Strike: %s", OPTION_PARAM['STRIKE'])    
+    except RuntimeError:
+        errors.append("Runtime error with STRIKE. Ex: 29Sep2023, 1m, 3M, 1y, 1w, 1d.")
+        log.debug("Runtime error with STRIKE. Ex: 29Sep2023, 1m, 3M, 1y, 1w, 1d.")
+        return errors
+    
+    # NOTIONAL
+    try:
+        # Process notional
+        if OPTION_PARAM['NOTIONAL'] == '':
+            errors.append("NOTIONAL is empty.")
+        else:
+            try:
+                if isinstance(float(OPTION_PARAM['NOTIONAL']), float):
+                    if float(OPTION_PARAM['NOTIONAL']) > 0:
+                        OPTION_PARAM['NOTIONAL'] = float(OPTION_PARAM['NOTIONAL'])
+                        NotionalGlobal = ql.SimpleQuote(float(OPTION_PARAM['NOTIONAL']))
+                        OPTION_PARAM['NOTIONAL_HANDLE'] = ql.QuoteHandle(NotionalGlobal)
+                    elif float(OPTION_PARAM['NOTIONAL']) <= 0:
+                        errors.append("NOTIONAL must be > 0.")
+            except ValueError:
+                errors.append("NOTIONAL is not a valid float")
+
+        log.debug("Notional: %s", OPTION_PARAM['NOTIONAL'])
+    except RuntimeError:
+        errors.append("Runtime Error with NOTIONAL. Ex: 100.")
+        log.debug("Runtime Error with NOTIONAL. Ex: 100.")
+        return errors
+    
+    # SPOT
+    try:
+        # Process spot    
+        if OPTION_PARAM['SPOT'] == '':
+            errors.append("SPOT is empty.")
+        else:
+            try:
+                if isinstance(float(OPTION_PARAM['SPOT']), float):
+                    if float(OPTION_PARAM['SPOT']) > 0:
+                        SpotGlobal = ql.SimpleQuote(float(OPTION_PARAM['SPOT']))
+                        OPTION_PARAM['SPOT_QUOTE'] = SpotGlobal
+                        OPTION_PARAM['SPOT_HANDLE'] = ql.QuoteHandle(SpotGlobal)
+                    elif float(OPTION_PARAM['SPOT']) <= 0:
+                        errors.append("SPOT must be > 0.")
+            except ValueError:   
+                errors.append("SPOT is not a valid float")
+                
+        log.debug("Spot: %s", OPTION_PARAM['SPOT'])   
+    except RuntimeError:
+        errors.append("Runtime Error with SPOT. Ex: 100.")
+        log.debug("Runtime Error with SPOT. Ex: 100.")
+        return errors
+    
+    # VOLATILITY
+    try:
+        # Process volatility
+        if OPTION_PARAM['VOLATILITY'] == '':
+            # Fall back to the volatility surface of the pair at the row's expiry & strike, or to the current volatility
+            # of the pair, if there is one
+            SURFACE_VOLATILITY = None
+            if 'EXPIRY_DATE' in OPTION_PARAM and isinstance(OPTION_PARAM['STRIKE'], float):
+                SURFACE_VOLATILITY = surface_volatility(CURRENCY_PAIR.upper(), OPTION_PARAM['EVALUATION_DATE'], OPTION_PARAM['EXPIRY_DATE'], OPTION_PARAM['STRIKE'])
+            if SURFACE_VOLATILITY is not None:
+                VolatilityGlobal = ql.SimpleQuote(SURFACE_VOLATILITY)
+                OPTION_PARAM['VOLATILITY_QUOTE'] = VolatilityGlobal
+                OPTION_PARAM['VOLATILITY_HANDLE'] = ql.QuoteHandle(VolatilityGlobal)
+            elif volatility(CURRENCY_PAIR.upper()) is not None:
+                VolatilityGlobal = ql.SimpleQuote(volatility(CURRENCY_PAIR.upper()))
+                OPTION_PARAM['VOLATILITY_QUOTE'] = VolatilityGlobal
+                OPTION_PARAM['VOLATILITY_HANDLE'] = ql.QuoteHandle(VolatilityGlobal)
+            else:
+                errors.append("VOLATILITY is empty.")
+        else:
+            try:
+                if isinstance(float(OPTION_PARAM['VOLATILITY']), float):
+                    if float(OPTION_PARAM['VOLATILITY']) > 0:
+                        VolatilityGlobal = ql.SimpleQuote(float(OPTION_PARAM['VOLATILITY']))
+                        OPTION_PARAM['VOLATILITY_QUOTE'] = VolatilityGlobal
+                        OPTION_PARAM['VOLATILITY_HANDLE'] = ql.QuoteHandle(VolatilityGlobal)
+                    elif float(OPTION_PARAM['VOLATILITY']) <= 0:
+                        errors.append("VOLATILITY must be > 0.")
+            except ValueError:
+                errors.append("VOLATILITY is not a valid float")
+
+        log.debug("Volatility: %s", OPTION_PARAM['VOLATILITY'])
+    except RuntimeError:
+        errors.append("Runtime Error with VOLATILITY. Ex: 0.2.")
+        log.debug("Runtime Error with VOLATILITY. Ex: 0.2.")
+        return errors
+    
+    # EXERCISE
+    try:
+        ## Process exercise type
+        if OPTION_PARAM['EXERCISE'].upper() == 'E':
+            OPTION_PARAM['EXERCISE_Q'] = ql.EuropeanExercise(OPTION_PARAM['EXPIRY_DATE'])
+            log.debug("EuropeanExercise")
+        elif OPTION_PARAM['EXERCISE'].upper() == 'A':
+            OPTION_PARAM['EXERCISE_Q'] = ql.AmericanExercise(OPTION_PARAM['EVALUATION_DATE'], OPTION_PARAM['EXPIRY_DATE'])
+            OPTION_PARAM['AMERICAN_ENGINE'] = str(params.get('AMERICAN_ENGINE') or AMERICAN_ENGINE).lower()
+            log.debug("AmericanExercise")
+        else:
+            errors.append("Invalid EXERCISE. Ex: E, A.")
+            log.debug("Invalid EXERCISE. Ex: E, A.")
+    except RuntimeError:
+        errors.append("Runtime Error with EXERCISE. Ex: E, A.")
+        log.debug("Runtime Error with EXERCISE. Ex: E, A.")
+        return errors
+    
+    # OPTION_TYPE
+    try:
+        # Process option type
+        if str(OPTION_PARAM['TYPE']).upper() == 'CALL':
+            OPTION_PARAM['TYPE'] = ql.Option.Call
+            log.debug("Call")
+            # Set evaluation date
+            ql.Settings.instance().evaluationDate = OPTION_PARAM['EVALUATION_DATE']
+        elif str(OPTION_PARAM['TYPE']).upper() == 'PUT':
+            OPTION_PARAM['TYPE'] = ql.Option.Put
+            log.debug("Put")
+            # Set evaluation date
+            ql.Settings.instance().evaluationDate = OPTION_PARAM['EVALUATION_DATE']
+        else:
+            errors.append("Invalid TYPE. Ex: CALL, PUT.")
+            log.debug("Invalid TYPE. Ex: CALL, PUT.")
+    except RuntimeError:
+        errors.append("Runtime Error with TYPE. Ex: CALL, PUT.")
+        log.debug("Runtime Error with TYPE. Ex: CALL, PUT.")
+        return errors
+    
+    # EXOTIC_TYPE
+    try:
+        # Barrier options
+        if OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_BARRIER', 'KI_BARRIER', 'KO_WINDOW_BARRIER', 'KI_WINDOW_BARRIER']:
+            log.debug("Barrier options")
+            if OPTION_PARAM['TYPE'] == ql.Option.Call:
+
+                if OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_BARRIER', 'KO_WINDOW_BARRIER']:
+                    OPTION_PARAM['BARRIER_TYPE'] = ql.Barrier.UpOut
+                    log.debug("Knock Out")
+                elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KI_BARRIER', 'KI_WINDOW_BARRIER']:
+                    OPTION_PARAM['BARRIER_TYPE'] = ql.Barrier.UpIn
+                    log.debug("Knock In")
+
+                if OPTION_PARAM['UPPER_BARRIER'] == '':
+                    errors.append("UPPER_BARRIER is empty")
+                else:
+                    try:              
+                        if isinstance(float(OPTION_PARAM['UPPER_BARRIER']), float) and float(OPTION_PARAM['UPPER_BARRIER']) > float(OPTION_PARAM['SPOT']):
+                            # Convert to float
+                            OPTION_PARAM['UPPER_BARRIER'] = float(OPTION_PARAM['UPPER_BARRIER'])
+                        elif isinstance(float(OPTION_PARAM['UPPER_BARRIER']), float) and float(OPTION_PARAM['UPPER_BARRIER']) <= float(OPTION_PARAM['SPOT']):
+                            errors.append("UPPER_BARRIER must be > SPOT.")
+                    except ValueError:
+                        errors.append("Invalid UPPER_BARRIER. Must be a float.")
+                log.debug("UPPER_BARRIER: %s", OPTION_PARAM['UPPER_BARRIER'])   
+            
+            elif OPTION_PARAM['TYPE'] == ql.Option.Put:
+
+                if OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_BARRIER', 'KO_WINDOW_BARRIER']:
+                    OPTION_PARAM['BARRIER_TYPE'] = ql.Barrier.DownOut
+                    log.debug("Knock Out")
+                elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KI_BARRIER', 'KI_WINDOW_BARRIER']:
+                    OPTION_PARAM['BARRIER_TYPE'] = ql.Barrier.DownIn
+                    log.debug("Knock In")
+
+                if OPTION_PARAM['LOWER_BARRIER'] == '':
+                    errors.append("LOWER_BARRIER is empty")
+                else:
+                    try:              
+                        if isinstance(float(OPTION_PARAM['LOWER_BARRIER']), float) and float(OPTION_PARAM['LOWER_BARRIER']) < float(OPTION_PARAM['SPOT']):
+                            # Convert to float
+                            OPTION_PARAM['LOWER_BARRIER'] = float(OPTION_PARAM['LOWER_BARRIER'])
+                        elif isinstance(float(OPTION_PARAM['LOWER_BARRIER']), float) and float(OPTION_PARAM['LOWER_BARRIER']) >= float(OPTION_PARAM['SPOT']):
+                            errors.append("LOWER_BARRIER must be < SPOT.")
+                    except ValueError:
+                        errors.append("Invalid LOWER_BARRIER. Must be a float.")
+                log.debug("LOWER_BARRIER: %s", OPTION_PARAM['LOWER_BARRIER'])   
+            
+        # Double barrier options
+        elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_DB_BARRIER', 'KI_DB_BARRIER', 'KIKO', 'KOKI']:
+            if OPTION_PARAM['EXOTIC_TYPE'].upper() == 'KO_DB_BARRIER':
+                OPTION_PARAM['BARRIER_TYPE'] = ql.DoubleBarrier.KnockOut
+            elif OPTION_PARAM['EXOTIC_TYPE'].upper() == 'KI_DB_BARRIER':
+                OPTION_PARAM['BARRIER_TYPE'] = ql.DoubleBarrier.KnockIn
+            elif OPTION_PARAM['EXOTIC_TYPE'].upper() == 'KIKO':
+                OPTION_PARAM['BARRIER_TYPE'] = ql.DoubleBarrier.KIKO
+            elif OPTION_PARAM['EXOTIC_TYPE'].upper() == 'KOKI':
+                OPTION_PARAM['BARRIER_TYPE'] = ql.DoubleBarrier.KOKI
+            
+            # The spot must lie between the two barriers for calls and puts
+            if OPTION_PARAM['UPPER_BARRIER'] == '':
+                errors.append("UPPER_BARRIER is empty")
+            else:
+                try:              
+                    if isinstance(float(OPTION_PARAM['UPPER_BARRIER']), float) and float(OPTION_PARAM['UPPER_BARRIER']) > float(OPTION_PARAM['SPOT']):
+                        # Convert to float
+                        OPTION_PARAM['UPPER_BARRIER'] = float(OPTION_PARAM['UPPER_BARRIER'])
+                    elif isinstance(float(OPTION_PARAM['UPPER_BARRIER']), float) and float(OPTION_PARAM['UPPER_BARRIER']) <= float(OPTION_PARAM['SPOT']):
+                        errors.append("UPPER_BARRIER must be > SPOT.")
+                except ValueError:
+                    errors.append("Invalid UPPER_BARRIER. Must be a float.")
+            log.debug("UPPER_BARRIER: %s", OPTION_PARAM['UPPER_BARRIER'])  
+            
+            if OPTION_PARAM['LOWER_BARRIER'] == '':
+                errors.append("LOWER_BARRIER is empty")
+            else:
+                try:              
+                    if isinstance(float(OPTION_PARAM['LOWER_BARRIER']), float) and float(OPTION_PARAM['LOWER_BARRIER']) < float(OPTION_PARAM['SPOT']):
+                        # Convert to float
+                        OPTION_PARAM['LOWER_BARRIER'] = float(OPTION_PARAM['LOWER_BARRIER'])
+                    elif isinstance(float(OPTION_PARAM['LOWER_BARRIER']), float) and float(OPTION_PARAM['LOWER_BARRIER']) >= float(OPTION_PARAM['SPOT']):
+                        errors.append("LOWER_BARRIER must be < SPOT.")
+                except ValueError:
+                    errors.append("Invalid LOWER_BARRIER. Must be a float.")
+            log.debug("LOWER_BARRIER: %s", OPTION_PARAM['LOWER_BARRIER'])  
+            log.debug('DoubleBarrier options')
+
+        # Asian & window barrier options: fixings (WINDOW_START_DATE to WINDOW_END_DATE) & simulation settings
+        if OPTION_PARAM['EXOTIC_TYPE'].upper() in MONTE_CARLO_TYPES and not errors:
+            errors.extend(simulation_errors(OPTION_PARAM, params))
+            log.debug("Path simulation options")
+    except RuntimeError:
+        errors.append("RuntimeError in EXOTIC_TYPE selection.")
+        log.debug("RuntimeError in EXOTIC_TYPE selection.")
+        return errors
+    except TypeError:
+        errors.append("TypeError in EXOTIC_TYPE selection.")
+        log.debug("TypeError in EXOTIC_TYPE selection.")
+        return errors
+        
+    clock.lap('validation')
+
+    # Path simulation options have no QuantLib option, process or engine, see montecarlo.py
+    if OPTION_PARAM['EXOTIC_TYPE'].upper() in MONTE_CARLO_TYPES:
+        if errors:
+            return errors
+        if 'FOREIGN_RF_RATE' not in OPTION_PARAM or 'DOMESTIC_RF_RATE' not in OPTION_PARAM:
+            return ["RuntimeError in constructing process."]
+        return OPTION_PARAM
+
+    # Construct payoff & option
+    try:
+        # Create rebate
+        OPTION_PARAM['REBATE'] = 0.0
+
+        if OPTION_PARAM['EXOTIC_TYPE'].upper() == 'VANILLA':
+            OPTION_PARAM['PAYOFF'] = ql.PlainVanillaPayoff(OPTION_PARAM['TYPE'], OPTION_PARAM['STRIKE'])
+            OPTION_PARAM['OPTION'] = ql.VanillaOption(OPTION_PARAM['PAYOFF'], OPTION_PARAM['EXERCISE_Q'])
+            log.debug("VanillaOption")
+        elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KI_BARRIER', 'KO_BARRIER']:
+            # Up barriers (calls) use UPPER_BARRIER, down barriers (puts) use LOWER_BARRIER
+            if OPTION_PARAM['BARRIER_TYPE'] in [ql.Barrier.UpIn, ql.Barrier.UpOut]:
+                OPTION_PARAM['BARRIER'] = OPTION_PARAM['UPPER_BARRIER']
+            else:
+                OPTION_PARAM['BARRIER'] = OPTION_PARAM['LOWER_BARRIER']
+            OPTION_PARAM['PAYOFF'] = ql.PlainVanillaPayoff(OPTION_PARAM['TYPE'], OPTION_PARAM['STRIKE'])
+            OPTION_PARAM['OPTION'] = ql.BarrierOption(OPTION_PARAM['BARRIER_TYPE'], OPTION_PARAM['BARRIER'], OPTION_PARAM['REBATE'], OPTION_PARAM['PAYOFF'], OPTION_PARAM['EXERCISE_Q'])
+            log.debug("BarrierOption")
+        elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_DB_BARRIER', 'KI_DB_BARRIER', 'KIKO', 'KOKI']:
+            OPTION_PARAM['PAYOFF'] = ql.PlainVanillaPayoff(OPTION_PARAM['TYPE'], OPTION_PARAM['STRIKE'])
+            OPTION_PARAM['OPTION'] = ql.DoubleBarrierOption(OPTION_PARAM['BARRIER_TYPE'], OPTION_PARAM['LOWER_BARRIER'], OPTION_PARAM['UPPER_BARRIER'], OPTION_PARAM['REBATE'], OPTION_PARAM['PAYOFF'], OPTION_PARAM['EXERCISE_Q'])
+            log.debug("DoubleBarrierOption")
+        else:
+            errors.append("Invalid EXOTIC_TYPE. Supported types: VANILLA, KO_BARRIER, KI_BARRIER, KO_DB_BARRIER, KI_DB_BARRIER, KIKO, KOKI, ASIAN, GEO_ASIAN, KO_WINDOW_BARRIER, KI_WINDOW_BARRIER.")
+            log.debug('Invalid EXOTIC_TYPE. Supported types: VANILLA, KO_BARRIER, KI_BARRIER, KO_DB_BARRIER, KI_DB_BARRIER, KIKO, KOKI, ASIAN, GEO_ASIAN, KO_WINDOW_BARRIER, KI_WINDOW_BARRIER.')
+    except RuntimeError:
+        errors.append("Runtime Error with constructing payoff & option.")
+        log.debug("Runtime Error with constructing payoff & option.")
+        return errors
+    
+    clock.lap('payoff')
+
+    #Settings such as calendar, evaluationdate; daycount
+    try:           
+        # Built once per process in marketdata.py
+        calendar = CALENDAR
+        # Setting the evaluation date notifies every live instrument, even to the same date
+        if ql.Settings.instance().evaluationDate != OPTION_PARAM['EVALUATION_DATE']:
+            ql.Settings.instance().evaluationDate = OPTION_PARAM['EVALUATION_DATE']
+        DayCountVolatility = DAY_COUNT_VOLATILITY
+    except RuntimeError:
+        errors.append("RuntimeError in calendar settings.")
+        log.debug("RuntimeError in calendar settings.")
+        return errors
+    
+    # Construct process
+    try:
+        # TODAY = ql.Date().todaysDate()
+        # Rate curves are shared, the volatility term structure is built on the row's own quote
+        DOMESTIC_RF_RATE = OPTION_PARAM['DOMESTIC_RF_RATE']
+        FOREIGN_RF_RATE = OPTION_PARAM['FOREIGN_RF_RATE']
+        PROCESS_KEY = (CURRENCY_PAIR.upper(), OPTION_PARAM['SPOT_QUOTE'].value(), OPTION_PARAM['VOLATILITY_QUOTE'].value())
+        if engines is not None and PROCESS_KEY in engines:
+            # Same market as an earlier row of the batch
+            OPTION_PARAM['SPOT_QUOTE'], OPTION_PARAM['VOLATILITY_QUOTE'], PROCESS = engines[PROCESS_KEY]
+        else:
+            VOLATILITY_TS = ql.BlackVolTermStructureHandle(ql.BlackConstantVol(0, calendar, OPTION_PARAM['VOLATILITY_HANDLE'], DayCountVolatility))
+
+            # Processes
+            # BS Process
+            PROCESS = ql.BlackScholesMertonProcess(OPTION_PARAM['SPOT_HANDLE'], FOREIGN_RF_RATE, DOMESTIC_RF_RATE, VOLATILITY_TS)
+            if engines is not None:
+                engines[PROCESS_KEY] = (OPTION_PARAM['SPOT_QUOTE'], OPTION_PARAM['VOLATILITY_QUOTE'], PROCESS)
+        # GK Process
+        # PROCESS = ql.GarmanKohlagenProcess(OPTION_PARAM['SPOT_HANDLE'], FOREIGN_RF_RATE, DOMESTIC_RF_RATE, VOLATILITY_TS)
+        # Vanna Volga Process ?    
+    except:
+        errors.append("RuntimeError in constructing process.")
+        log.debug("RuntimeError in constructing process.")
+        return errors
+    
+    clock.lap('process')
+
+    # Construct engine
+    try:
+        ENGINE_NAME = None
+        if OPTION_PARAM['EXOTIC_TYPE'].upper() == 'VANILLA' and OPTION_PARAM['EXERCISE'].upper() == 'A':
+            if OPTION_PARAM['AMERICAN_ENGINE'] not in AMERICAN_ENGINES:
+                errors.append(f"Invalid AMERICAN_ENGINE. Ex: {', '.join(AMERICAN_ENGINES)}.")
+                return errors
+            ENGINE_NAME = OPTION_PARAM['AMERICAN_ENGINE']
+        elif OPTION_PARAM['EXOTIC_TYPE'].upper() == 'VANILLA':
+            ENGINE_NAME = 'european'
+        elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_BARRIER', 'KI_BARRIER']:
+            ENGINE_NAME = 'barrier'
+        elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_DB_BARRIER', 'KI_DB_BARRIER', 'KIKO', 'KOKI']:
+            ENGINE_NAME = 'double_barrier'
+
+        if ENGINE_NAME is not None:
+            # Engines only depend on the process (and the grid sizes, which are fixed per deployment)
+            ENGINE_KEY = PROCESS_KEY + (ENGINE_NAME,)
+            if engines is not None and ENGINE_KEY in engines:
+                OPTION_PARAM['ENGINE'] = engines[ENGINE_KEY]
+            else:
+                OPTION_PARAM['ENGINE'] = make_engine(ENGINE_NAME, PROCESS)
+                if engines is not None:
+                    engines[ENGINE_KEY] = OPTION_PARAM['ENGINE']
+            OPTION_PARAM['ENGINE_NAME'] = ENGINE_NAME
+            log.debug("Engine: %s", ENGINE_NAME)
+    except RuntimeError:
+        errors.append("RuntimeError in constructing engine.")
+        log.debug("RuntimeError in constructing engine.")
+        return errors
+    
+    clock.lap('engine')
+
+    return OPTION_PARAM
+
+
+# Price a built option (build_option)
+# Returns the CALCULATED_FIELDS dict, or the list of errors
+def calculate_fields(OPTION_PARAM, clock):
+    return calculate_batch_fields([OPTION_PARAM], [clock])[0]
+
+
+# Price built options together: the NPV of each, then the greeks the engines do not provide (barrier, American
+# approximation & lattice engines) and THETA by bumping & repricing the batch, see greeks.py
+# Path simulation options are priced one by one by montecarlo.py (timed as its 'simulation' stage)
+# Returns one CALCULATED_FIELDS dict, or list of errors, per option
+def calculate_batch_fields(OPTION_PARAMS, clocks):
+    calculated = [None] * len(OPTION_PARAMS)
+    seconds = [0.0] * len(OPTION_PARAMS)
+    simulated = set()
+    priced = []
+    npvs = []
+    for k, OPTION_PARAM in enumerate(OPTION_PARAMS):
+        if OPTION_PARAM['EXOTIC_TYPE'].upper() in MONTE_CARLO_TYPES:
+            simulated.add(k)
+            try:
+                calculated[k] = price_paths(OPTION_PARAM)
+            except RuntimeError:
+                calculated[k] = ["RuntimeError in calculating option price & greeks."]
+                log.debug("RuntimeError in calculating option price & greeks.")
+            continue
+        start = time.perf_counter()
+        try:
+            # Set the pricing engine
+            OPTION_PARAM['OPTION'].setPricingEngine(OPTION_PARAM['ENGINE'])
+            # Moving the evaluation date notifies every QuantLib object, rows of a batch share it
+            if ql.Settings.instance().evaluationDate != OPTION_PARAM['EVALUATION_DATE']:
+                ql.Settings.instance().evaluationDate = OPTION_PARAM['EVALUATION_DATE']
+            npvs.append(OPTION_PARAM['OPTION'].NPV())
+            priced.append(k)
+        except RuntimeError:
+            calculated[k] = ["RuntimeError in calculating option price & greeks."]
+            log.debug("RuntimeError in calculating option price & greeks.")
+        seconds[k] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    greeks = batch_greeks([OPTION_PARAMS[k] for k in priced], npvs)
+    # The batch's greeks are timed as a whole, each row gets an equal share
+    greek_seconds = (time.perf_counter() - start) / max(len(priced), 1)
+
+    for k, npv, values in zip(priced, npvs, greeks):
+        seconds[k] += greek_seconds
+        if values is None:
+            calculated[k] = ["RuntimeError in calculating option price & greeks."]
+            log.debug("RuntimeError in calculating option price & greeks.")
+            continue
+        OPTION_PARAM = OPTION_PARAMS[k]
+        delta, gamma, vega, theta = values
+
+        # Create a new dictionary to store the calculated fields
+        CALCULATED_FIELDS = {}
+        CALCULATED_FIELDS['OPTION_NPV'] = npv
+        CALCULATED_FIELDS['PREMIUM'] = npv*OPTION_PARAM['NOTIONAL']/float(OPTION_PARAM['SPOT'])
+        CALCULATED_FIELDS['DELTA'] = delta*OPTION_PARAM['NOTIONAL']/float(OPTION_PARAM['SPOT'])
+        CALCULATED_FIELDS['GAMMA'] = (gamma*float(OPTION_PARAM['SPOT']))/100
+        CALCULATED_FIELDS['VEGA'] = vega*OPTION_PARAM['NOTIONAL']*(1/100)/float(OPTION_PARAM['SPOT'])
+        # Change of the premium over one business day, None if the option expires by then
+        CALCULATED_FIELDS['THETA'] = None if theta is None else theta*OPTION_PARAM['NOTIONAL']/float(OPTION_PARAM['SPOT'])
+        calculated[k] = CALCULATED_FIELDS
+
+        # Log the calculated fields
+        log.debug("CALCULATED_FIELDS", extra={'fields': {'EXOTIC_TYPE': OPTION_PARAM['EXOTIC_TYPE'], 'CALCULATED_FIELDS': CALCULATED_FIELDS}})
+
+    for k, clock in enumerate(clocks):
+        if k not in simulated:
+            observe('npv_greeks', seconds[k], clock.exotic_type, clock.engine)
+    return calculated
+
+
+# Price a batch of option rows in-process with the given engine
+# positions: optional row numbers of the rows in the request, for the log lines (start + their index by default)
+# Returns a list of (index, result) pairs in the original row order, indices starting at start
+def price_batch(rows, start=0, engine='vectorized', positions=None):
+    positions = list(range(start, start + len(rows))) if positions is None else positions
+    # Price the rows the NumPy engines support in one go
+    calculated = {}
+    if engine == 'vectorized':
+        calculated = price_vanilla_rows(rows)
+        calculated.update(price_barrier_rows(rows))
+
+    # Processes & engines shared by the rows with the same market
+    engines = {}
+    built = []
+    for i, params in enumerate(rows):
+        if i in calculated:
+            continue
+        clock = StageClock(params['EXOTIC_TYPE'], 'quantlib')
+        try:
+            OPTION_PARAM = build_option(params, clock, engines)
+        except Exception as e:
+            # An unexpected error in one row must not abort the rest of the batch
+            log.warning("Unexpected error pricing row %s: %s", positions[i], e, exc_info=log.isEnabledFor(logging.DEBUG))
+            OPTION_PARAM = [f"RuntimeError in pricing: {e}"]
+        if isinstance(OPTION_PARAM, list):
+            calculated[i] = OPTION_PARAM
+        else:
+            built.append((i, OPTION_PARAM, clock))
+        if len(built) == QUANTLIB_BATCH_SIZE:
+            calculated.update(_calculate_built(built, positions))
+            built = []
+    calculated.update(_calculate_built(built, positions))
+    return [(start + i, calculated[i]) for i in range(len(rows))]
+
+
+# Price rows built by price_batch: {row index: result}
+def _calculate_built(built, positions):
+    if not built:
+        return {}
+    try:
+        return dict(zip([i for i, _, _ in built], calculate_batch_fields([OPTION_PARAM for _, OPTION_PARAM, _ in built], [clock for _, _, clock in built])))
+    except Exception as e:
+        # Unexpected error: price the rows one by one so that it only fails the row it comes from
+        log.warning("Unexpected error pricing rows %s to %s as a batch: %s", positions[built[0][0]], positions[built[-1][0]], e, exc_info=log.isEnabledFor(logging.DEBUG))
+    calculated = {}
+    for i, OPTION_PARAM, clock in built:
+        try:
+            calculated[i] = calculate_fields(OPTION_PARAM, clock)
+        except Exception as e:
+            log.warning("Unexpected error pricing row %s: %s", positions[i], e, exc_info=log.isEnabledFor(logging.DEBUG))
+            calculated[i] = [f"RuntimeError in pricing: {e}"]
+    return calculated
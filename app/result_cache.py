@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+
+import marketdata
+import shared_cache
+from pricer import OPTION_FIELDS, NUMERIC_FIELDS, AMERICAN_ENGINE
+from vectorized import SINGLE_BARRIER_TYPES, DOUBLE_BARRIER_TYPES
+from workers import run_single, run_batch
+
+
+# Maximum number of cached results, least recently used results are evicted first (0 disables the cache)
+CACHE_SIZE = int(os.environ.get('PRICER_CACHE_SIZE', 100000))
+# Seconds a cached result stays valid
+CACHE_TTL = float(os.environ.get('PRICER_CACHE_TTL', 3600))
+
+_results = OrderedDict()
+_hits = 0
+_misses = 0
+# Results found in the shared cache of the host (shared_cache.py) after missing this process' cache
+_shared_hits = 0
+# Rows being priced by a request of this process: {key: Future}, concurrent requests for the same rows wait for
+# these results instead of pricing them again (single flight)
+_inflight = {}
+# Rows served by another request's pricing
+_coalesced = 0
+# Result of the rows whose pricing request was cancelled: the requests waiting for them price them again
+_ABANDONED = object()
+
+log = logging.getLogger('pricer.result_cache')
+
+
+# NUMERIC_FIELDS are compared as numbers, so that '1.10' and '1.1' share a result
+def _normalize(field, value):
+    value = str(value).strip()
+    if field in NUMERIC_FIELDS:
+        try:
+            return repr(float(value))
+        except ValueError:
+            return value
+    return value.upper()
+
+
+# Normalized contents of a row: its fields, American engine and simulation settings
+def row_fields(params):
+    fields = tuple(_normalize(field, params[field]) for field in OPTION_FIELDS)
+    american_engine = str(params.get('AMERICAN_ENGINE') or AMERICAN_ENGINE).lower()
+    # Simulation settings, empty (the PRICER_MC_* defaults) unless the row sets them
+    simulation = tuple(str(params.get(field) or '').strip().lower() for field in ['PATHS', 'SEED', 'VARIANCE_REDUCTION'])
+    return fields + (american_engine,) + simulation
+
+
+# EXOTIC_TYPEs of the European rows the vectorized engine prices, the other rows are priced by QuantLib with either engine
+VECTORIZED_TYPES = ['VANILLA'] + SINGLE_BARRIER_TYPES + DOUBLE_BARRIER_TYPES
+
+
+# Engine pricing a row: rows the vectorized engine leaves to QuantLib share their results with the 'quantlib' requests
+def row_engine(params, engine):
+    if engine == 'vectorized' and (str(params.get('EXERCISE', '')).strip().upper() != 'E'
+                                   or str(params.get('EXOTIC_TYPE', '')).strip().upper() not in VECTORIZED_TYPES):
+        return 'quantlib'
+    return engine
+
+
+# Cache key of a row: its normalized contents, the engine pricing it, the evaluation date, the cache generation
+# (shared_cache.py) and the market data version
+def cache_key(params, engine):
+    return row_fields(params) + (row_engine(params, engine), date.today().isoformat(), shared_cache.generation(), marketdata.version())
+
+
+def get(key):
+    global _hits, _misses
+    entry = _results.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+            del _results[key]
+        _misses += 1
+        return None
+    _results.move_to_end(key)
+    _hits += 1
+    return entry[1]
+
+
+def put(key, value):
+    if CACHE_SIZE <= 0:
+        return
+    _results[key] = (time.monotonic() + CACHE_TTL, value)
+    _results.move_to_end(key)
+    while len(_results) > CACHE_SIZE:
+        _results.popitem(last=False)
+
+
+# Results of the keys in the shared cache, {key: result}, added to this process' cache
+async def _get_shared(keys):
+    global _shared_hits
+    if not keys or not shared_cache.enabled() or CACHE_SIZE <= 0:
+        return {}
+    found = await shared_cache.get_results(keys)
+    for key, value in found.items():
+        put(key, value)
+    _shared_hits += len(found)
+    return found
+
+
+async def _put_shared(entries):
+    if entries and shared_cache.enabled() and CACHE_SIZE > 0:
+        await shared_cache.put_results([(key, key[-1], value) for key, value in entries], CACHE_TTL)
+
+
+# Drop every cached result, the shared ones too (the other processes' results are left behind with the generation)
+async def invalidate():
+    _results.clear()
+    if shared_cache.enabled():
+        await shared_cache.clear_results()
+
+
+# Price the missing rows (their keys) with price(keys) -> results, except those another request is pricing already,
+# whose results are awaited (or priced here after all if that request is cancelled). Returns {key: result}
+async def _single_flight(missing, price):
+    global _coalesced
+    waiting = {key: _inflight[key] for key in missing if key in _inflight}
+    _coalesced += len(waiting)
+    own = [key for key in missing if key not in waiting]
+    loop = asyncio.get_running_loop()
+    futures = {}
+    for key in own:
+        futures[key] = _inflight[key] = loop.create_future()
+    results = {}
+    try:
+        if own:
+            priced = await price(own)
+            for key, value in zip(own, priced):
+                results[key] = value
+                # Errors are not cached, the row is priced again by the next request
+                if not isinstance(value, list):
+                    put(key, value)
+                futures[key].set_result(value)
+            await _put_shared([(key, results[key]) for key in own if not isinstance(results[key], list)])
+    except Exception as e:
+        # The waiting requests fail as this one does
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(e)
+                # Retrieved here, so that rows nobody waits for are not reported as unhandled
+                future.exception()
+        raise
+    except BaseException:
+        for future in futures.values():
+            if not future.done():
+                future.set_result(_ABANDONED)
+        raise
+    finally:
+        for key in own:
+            if _inflight.get(key) is futures[key]:
+                del _inflight[key]
+    if waiting:
+        log.debug("Coalesced rows", extra={'fields': {'rows': len(waiting)}})
+        abandoned = []
+        for key, future in waiting.items():
+            # Shielded: a cancelled waiter must not cancel the pricing of the other requests
+            results[key] = await asyncio.shield(future)
+            if results[key] is _ABANDONED:
+                abandoned.append(key)
+        if abandoned:
+            log.debug("Abandoned rows priced again", extra={'fields': {'rows': len(abandoned)}})
+            results.update(await _single_flight(abandoned, price))
+    return results
+
+
+# Hits are the lookups served by this process' cache or the shared one
+async def stats():
+    lookups = _hits + _misses
+    cache_stats = {
+        'size': len(_results),
+        'max_size': CACHE_SIZE,
+        'ttl': CACHE_TTL,
+        'hits': _hits + _shared_hits,
+        'misses': _misses - _shared_hits,
+        'hit_rate': (_hits + _shared_hits) / lookups if lookups else 0.0,
+        'coalesced': _coalesced,
+        'inflight': len(_inflight)
+    }
+    if shared_cache.enabled():
+        cache_stats['shared'] = await shared_cache.stats()
+    return cache_stats
+
+
+# Price a single row with the given engine through the cache, shared with the bulk requests
+async def cached_single(params, engine='vectorized'):
+    key = cache_key(params, engine)
+    value = get(key)
+    if value is None:
+        value = (await _get_shared([key])).get(key)
+    if value is None:
+        if row_engine(params, engine) == 'quantlib':
+            price = lambda keys: _price_single(params)
+        else:
+            price = lambda keys: _price_batch([params], engine)
+        value = (await _single_flight([key], price))[key]
+    return value
+
+
+async def _price_single(params):
+    return [await run_single(params)]
+
+
+async def _price_batch(rows, engine, positions=None):
+    return [value for _, value in await run_batch(rows, engine, positions)]
+
+
+# Price a batch of rows with the given engine through the cache
+# Only the distinct rows missing from the cache and not being priced by another request are priced, results come back as (index, result) pairs in row order
+async def cached_batch(rows, engine='vectorized'):
+    keys = [cache_key(params, engine) for params in rows]
+    values = [get(key) for key in keys]
+    shared = await _get_shared(list({key for key, value in zip(keys, values) if value is None}))
+    if shared:
+        values = [shared.get(key) if value is None else value for key, value in zip(keys, values)]
+
+    # {key: position of its first row}, the positions number the rows of the log lines as in the request
+    missing = {}
+    for i, key in enumerate(keys):
+        if values[i] is None and key not in missing:
+            missing[key] = i
+    if missing:
+        priced = await _single_flight(list(missing), lambda own: _price_batch([rows[missing[key]] for key in own], engine,
+                                                                              [missing[key] for key in own]))
+        for i, key in enumerate(keys):
+            if values[i] is None:
+                values[i] = priced[key]
+
+    return list(enumerate(values))
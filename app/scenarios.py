@@ -0,0 +1,227 @@
+import QuantLib as ql
+import logging
+
+from pricer import RESULT_FIELDS, build_option, calculate_fields
+from metrics import StageClock
+from greeks import rolled_reference_date
+from montecarlo import MONTE_CARLO_TYPES
+
+# Spot x volatility scenario grids ("ladders") of an option
+# The option, its process & engine are built once, every grid point only sets the value of the option's own
+# SPOT & VOLATILITY SimpleQuotes and reprices it: one engine evaluation per grid point
+# The greeks the engine does not provide (barrier engines) are differenced between neighbouring grid points instead of
+# bumped at each of them: DELTA & GAMMA along the spot axis, VEGA along the volatility axis. They need 3 points on the
+# axis (2 give DELTA or VEGA only) and are as coarse as the grid. THETA is only priced when asked for: the evaluation
+# date is rolled once for the whole grid and every point is priced once more.
+# Path simulation rows are priced point by point with their own estimators (montecarlo.py).
+
+log = logging.getLogger('pricer.scenarios')
+
+
+# Spot & volatility of every grid point
+# spot_bumps are relative to the row's SPOT (0.01 is +1%), volatility_bumps are added to its VOLATILITY (0.01 is +1 vol)
+def grid_axes(spot, vol, spot_bumps, volatility_bumps):
+    return [spot * (1 + bump) for bump in spot_bumps], [vol + bump for bump in volatility_bumps]
+
+
+# Reason a grid spot cannot be priced by the analytic barrier engines, None if it can
+def barrier_touched(OPTION_PARAM, spot):
+    if OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_BARRIER', 'KI_BARRIER']:
+        if OPTION_PARAM['BARRIER_TYPE'] in [ql.Barrier.UpIn, ql.Barrier.UpOut] and spot >= OPTION_PARAM['BARRIER']:
+            return "SPOT is beyond UPPER_BARRIER."
+        if OPTION_PARAM['BARRIER_TYPE'] in [ql.Barrier.DownIn, ql.Barrier.DownOut] and spot <= OPTION_PARAM['BARRIER']:
+            return "SPOT is beyond LOWER_BARRIER."
+    elif OPTION_PARAM['EXOTIC_TYPE'].upper() in ['KO_DB_BARRIER', 'KI_DB_BARRIER', 'KIKO', 'KOKI']:
+        if spot >= OPTION_PARAM['UPPER_BARRIER']:
+            return "SPOT is beyond UPPER_BARRIER."
+        if spot <= OPTION_PARAM['LOWER_BARRIER']:
+            return "SPOT is beyond LOWER_BARRIER."
+    return None
+
+
+# Error of a grid point before it is priced, None if it can be priced
+def point_error(OPTION_PARAM, spot, vol):
+    if spot <= 0:
+        return "SPOT must be > 0."
+    error = barrier_touched(OPTION_PARAM, spot)
+    if error is None and vol <= 0:
+        return "VOLATILITY must be > 0."
+    return error
+
+
+# Positions of the points of an axis used to difference at position k: three neighbouring priced points, centred
+# where possible, two when only two are next to each other, None otherwise. order is the axis sorted by value.
+def _stencil(order, values, k):
+    low = high = order.index(k)
+    while low > 0 and values[order[low - 1]] is not None:
+        low -= 1
+    while high < len(order) - 1 and values[order[high + 1]] is not None:
+        high += 1
+    if high - low >= 2:
+        first = min(max(order.index(k) - 1, low), high - 2)
+        return order[first:first + 3]
+    if high - low == 1:
+        return order[low:high + 1]
+    return None
+
+
+# First & second derivatives of values (None where not priced) along an axis, at each point, from the polynomial
+# through the point and its neighbours (see _stencil). Returns two lists, None where there are too few points.
+def axis_derivatives(xs, values):
+    order = sorted(range(len(xs)), key=lambda k: xs[k])
+    first, second = [None] * len(xs), [None] * len(xs)
+    for k, value in enumerate(values):
+        if value is None:
+            continue
+        stencil = _stencil(order, values, k)
+        if stencil is None or len({xs[m] for m in stencil}) < len(stencil):
+            continue
+        if len(stencil) == 2:
+            a, b = stencil
+            first[k] = (values[b] - values[a]) / (xs[b] - xs[a])
+            continue
+        x, (a, b, c) = xs[k], stencil
+        weights = [1 / ((xs[a] - xs[b]) * (xs[a] - xs[c])), 1 / ((xs[b] - xs[a]) * (xs[b] - xs[c])), 1 / ((xs[c] - xs[a]) * (xs[c] - xs[b]))]
+        first[k] = (values[a] * weights[0] * (2 * x - xs[b] - xs[c]) + values[b] * weights[1] * (2 * x - xs[a] - xs[c])
+                    + values[c] * weights[2] * (2 * x - xs[a] - xs[b]))
+        second[k] = 2 * (values[a] * weights[0] + values[b] * weights[1] + values[c] * weights[2])
+    return first, second
+
+
+def _engine_greek(greek):
+    try:
+        return greek()
+    except RuntimeError:
+        return None
+
+
+# Price the spot x volatility grid of one option row, THETA too if theta
+# Returns {'SPOT': [...], 'VOLATILITY': [...], <RESULT_FIELDS>: [[...]], 'RuntimeError': [[...]]}, matrices indexed
+# [spot][volatility] with None where a grid point could not be priced, or the list of errors if the row is invalid
+def price_scenario(params, spot_bumps, volatility_bumps, theta=False):
+    clock = StageClock(params['EXOTIC_TYPE'], 'quantlib')
+    OPTION_PARAM = build_option(params, clock)
+    if isinstance(OPTION_PARAM, list):
+        return OPTION_PARAM
+    if 'SPOT_QUOTE' not in OPTION_PARAM or 'VOLATILITY_QUOTE' not in OPTION_PARAM:
+        return ["SPOT & VOLATILITY must be valid numbers."]
+
+    spots, vols = grid_axes(OPTION_PARAM['SPOT_QUOTE'].value(), OPTION_PARAM['VOLATILITY_QUOTE'].value(), spot_bumps, volatility_bumps)
+    grid = {'SPOT': spots, 'VOLATILITY': vols}
+    for field in RESULT_FIELDS + ['RuntimeError']:
+        grid[field] = [[None] * len(vols) for _ in spots]
+    if OPTION_PARAM['EXOTIC_TYPE'].upper() in MONTE_CARLO_TYPES:
+        _simulate_grid(OPTION_PARAM, clock, grid)
+    else:
+        _price_grid(OPTION_PARAM, clock, grid, theta)
+
+    log.debug("Scenario grid", extra={'fields': {'params': params, 'points': len(spots) * len(vols), 'theta': theta}})
+    return grid
+
+
+# Path simulation rows: each point is priced with its estimators
+def _simulate_grid(OPTION_PARAM, clock, grid):
+    for i, spot in enumerate(grid['SPOT']):
+        for j, vol in enumerate(grid['VOLATILITY']):
+            error = point_error(OPTION_PARAM, spot, vol)
+            if error is None:
+                OPTION_PARAM['SPOT_QUOTE'].setValue(spot)
+                OPTION_PARAM['VOLATILITY_QUOTE'].setValue(vol)
+                # PREMIUM & the greeks are scaled by the point's SPOT
+                OPTION_PARAM['SPOT'] = spot
+                calculated_values = calculate_fields(OPTION_PARAM, clock)
+            else:
+                calculated_values = [error]
+            if isinstance(calculated_values, list):
+                grid['RuntimeError'][i][j] = calculated_values[0]
+            else:
+                for field in RESULT_FIELDS:
+                    grid[field][i][j] = calculated_values.get(field)
+
+
+# Engine rows: one NPV per point, the greeks from the engine or differenced across the grid (see above)
+def _price_grid(OPTION_PARAM, clock, grid, theta):
+    spots, vols = grid['SPOT'], grid['VOLATILITY']
+    option = OPTION_PARAM['OPTION']
+    option.setPricingEngine(OPTION_PARAM['ENGINE'])
+    evaluation_date = OPTION_PARAM['EVALUATION_DATE']
+    if ql.Settings.instance().evaluationDate != evaluation_date:
+        ql.Settings.instance().evaluationDate = evaluation_date
+
+    # [spot][volatility] NPVs and the engine's [DELTA, GAMMA, VEGA], None where not provided
+    npvs = [[None] * len(vols) for _ in spots]
+    greeks = [[[None, None, None] for _ in vols] for _ in spots]
+    for i, spot in enumerate(spots):
+        for j, vol in enumerate(vols):
+            error = point_error(OPTION_PARAM, spot, vol)
+            if error is None:
+                OPTION_PARAM['SPOT_QUOTE'].setValue(spot)
+                OPTION_PARAM['VOLATILITY_QUOTE'].setValue(vol)
+                try:
+                    npvs[i][j] = option.NPV()
+                    greeks[i][j] = [_engine_greek(option.delta), _engine_greek(option.gamma), _engine_greek(option.vega)]
+                except RuntimeError:
+                    error = "RuntimeError in calculating option price & greeks."
+                clock.lap('npv_greeks')
+            grid['RuntimeError'][i][j] = error
+
+    thetas = [[None] * len(vols) for _ in spots]
+    rolled_date = rolled_reference_date(evaluation_date)
+    if theta and OPTION_PARAM['EXPIRY_DATE'] > rolled_date:
+        # One roll of the evaluation date for the grid, it notifies every QuantLib object
+        ql.Settings.instance().evaluationDate = rolled_date
+        try:
+            for i, spot in enumerate(spots):
+                for j, vol in enumerate(vols):
+                    if npvs[i][j] is None:
+                        continue
+                    OPTION_PARAM['SPOT_QUOTE'].setValue(spot)
+                    OPTION_PARAM['VOLATILITY_QUOTE'].setValue(vol)
+                    try:
+                        thetas[i][j] = option.NPV() - npvs[i][j]
+                    except RuntimeError:
+                        pass
+        finally:
+            ql.Settings.instance().evaluationDate = evaluation_date
+
+    # Missing greeks from the neighbouring points: DELTA & GAMMA per volatility column, VEGA per spot row
+    for j in range(len(vols)):
+        deltas, gammas = axis_derivatives(spots, [npvs[i][j] for i in range(len(spots))])
+        for i in range(len(spots)):
+            if greeks[i][j][0] is None:
+                greeks[i][j][0] = deltas[i]
+            if greeks[i][j][1] is None:
+                greeks[i][j][1] = gammas[i]
+    for i in range(len(spots)):
+        vegas, _ = axis_derivatives(vols, npvs[i])
+        for j in range(len(vols)):
+            if greeks[i][j][2] is None:
+                greeks[i][j][2] = vegas[j]
+
+    # PREMIUM & the greeks are scaled by the point's SPOT, as CALCULATED_FIELDS are by the row's
+    notional = OPTION_PARAM['NOTIONAL']
+    for i, spot in enumerate(spots):
+        for j in range(len(vols)):
+            if npvs[i][j] is None:
+                continue
+            delta, gamma, vega = greeks[i][j]
+            grid['OPTION_NPV'][i][j] = npvs[i][j]
+            grid['PREMIUM'][i][j] = npvs[i][j] * notional / spot
+            grid['DELTA'][i][j] = None if delta is None else delta * notional / spot
+            grid['GAMMA'][i][j] = None if gamma is None else gamma * spot / 100
+            grid['VEGA'][i][j] = None if vega is None else vega * notional * (1 / 100) / spot
+            grid['THETA'][i][j] = None if thetas[i][j] is None else thetas[i][j] * notional / spot
+
+
+# Price the scenario grids of a list of rows, THETA too if theta
+# Returns a list of (index, result) pairs in the original row order, indices starting at start
+def price_scenarios(rows, spot_bumps, volatility_bumps, start=0, theta=False):
+    option_values = []
+    for i, params in enumerate(rows):
+        try:
+            calculated_values = price_scenario(params, spot_bumps, volatility_bumps, theta)
+        except Exception as e:
+            log.warning("Unexpected error pricing scenarios of row %s: %s", start + i, e, exc_info=log.isEnabledFor(logging.DEBUG))
+            calculated_values = [f"RuntimeError in pricing: {e}"]
+        option_values.append((start + i, calculated_values))
+    return option_values
@@ -0,0 +1,323 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+import marketdata
+
+log = logging.getLogger('pricer.shared_cache')
+
+# Cache shared by the server processes of a host (gunicorn workers): priced results and the market data, in one SQLite
+# file. Market data updates are written with a version that every process brings its own market data up to before
+# serving requests, so all processes price with the same market data and compute the same result cache keys
+# (which hold the version). Results of older versions are deleted with the update.
+# Each process keeps its in-memory result cache (result_cache.py) in front of the shared one. Clearing the cache moves
+# a shared generation on, which the keys hold too, so the other processes stop reading their in-memory results.
+# Processes check the shared version & generation at most every PRICER_SHARED_SYNC_INTERVAL seconds; the health
+# probes never check.
+# Every query runs in a thread of the threadpool with a connection of that thread, so a file locked by another process
+# (an update, a clear) never blocks the event loop. The functions called from requests are coroutines for that reason.
+
+# Path of the SQLite file, empty to keep the results & market data of each process to itself
+SHARED_CACHE = os.environ.get('PRICER_SHARED_CACHE', '')
+# Maximum number of shared results, those closest to expiring are deleted first
+SHARED_CACHE_SIZE = int(os.environ.get('PRICER_SHARED_CACHE_SIZE', 1000000))
+# Seconds between two checks of the shared market data version & cache generation by a process
+SYNC_INTERVAL = float(os.environ.get('PRICER_SHARED_SYNC_INTERVAL', 0.25))
+# Puts of a process between two trims of the shared results: the expired ones are deleted, then the oldest beyond
+# SHARED_CACHE_SIZE (counting the results scans the table, the puts themselves do not)
+TRIM_PUTS = 100
+# Keys looked up per query, below SQLite's limit on query parameters
+LOOKUP_SIZE = 500
+# Paths served without checking the shared version, they must answer while the file is locked
+SYNC_SKIP_PATHS = ['/health', '/ready']
+
+# Connection of each thread, {'connection', 'pid'}
+_local = threading.local()
+# Cache generation of this process' results
+_generation = 0
+_last_sync = 0.0
+_syncing = False
+_puts = 0
+# Shared results counted by the last trim of this process, None before the first one
+_size = None
+
+
+def enabled():
+    return bool(SHARED_CACHE)
+
+
+def _open():
+    connection = sqlite3.connect(SHARED_CACHE, timeout=10, isolation_level=None, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version INTEGER, expires REAL, value TEXT)')
+    connection.execute('CREATE INDEX IF NOT EXISTS results_expires ON results (expires)')
+    connection.execute('CREATE TABLE IF NOT EXISTS market_data (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER, data TEXT)')
+    connection.execute('CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), generation INTEGER)')
+    connection.execute('CREATE TABLE IF NOT EXISTS sync_sessions (session TEXT PRIMARY KEY, used REAL)')
+    connection.execute('CREATE TABLE IF NOT EXISTS sync_rows (session TEXT, key TEXT, hash TEXT, stamp TEXT, value TEXT, PRIMARY KEY (session, key))')
+    return connection
+
+
+# Connection of this thread, opened on first use (and again in a forked process)
+def _connect():
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.connection = _open()
+        _local.pid = os.getpid()
+    return _local.connection
+
+
+# Cache generation of the result cache keys, moved on by clear_results in any process
+def generation():
+    return _generation
+
+
+def _key(key):
+    return json.dumps(key, separators=(',', ':'))
+
+
+# Cached results of the keys (result_cache.cache_key) that are in the shared cache: {key: result}
+async def get_results(keys):
+    return await run_in_threadpool(_get_results, keys)
+
+
+def _get_results(keys):
+    connection = _connect()
+    now = time.time()
+    texts = {_key(key): key for key in keys}
+    found = {}
+    text_keys = list(texts)
+    for start in range(0, len(text_keys), LOOKUP_SIZE):
+        chunk = text_keys[start:start + LOOKUP_SIZE]
+        query = f"SELECT key, value FROM results WHERE expires > ? AND key IN ({', '.join('?' * len(chunk))})"
+        for text, value in connection.execute(query, [now] + chunk):
+            found[texts[text]] = json.loads(value)
+    return found
+
+
+# Add results: (key, market data version, result) triples, valid for ttl seconds
+async def put_results(entries, ttl):
+    await run_in_threadpool(_put_results, entries, ttl)
+
+
+def _put_results(entries, ttl):
+    global _puts
+    connection = _connect()
+    expires = time.time() + ttl
+    connection.execute('BEGIN')
+    try:
+        connection.executemany('INSERT OR REPLACE INTO results (key, version, expires, value) VALUES (?, ?, ?, ?)',
+                               [(_key(key), version, expires, json.dumps(value)) for key, version, value in entries])
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+        raise
+    _puts += 1
+    if _puts % TRIM_PUTS == 0:
+        _trim()
+
+
+# Delete the expired results, then the results closest to expiring beyond SHARED_CACHE_SIZE
+def _trim():
+    global _size
+    connection = _connect()
+    connection.execute('BEGIN')
+    try:
+        connection.execute('DELETE FROM results WHERE expires <= ?', (time.time(),))
+        size = connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        if size > SHARED_CACHE_SIZE:
+            connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY expires LIMIT ?)', (size - SHARED_CACHE_SIZE,))
+            size = SHARED_CACHE_SIZE
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+        raise
+    _size = size
+
+
+# Drop every shared result and move the cache generation on
+async def clear_results():
+    await run_in_threadpool(_clear_results)
+
+
+def _clear_results():
+    global _generation, _size
+    connection = _connect()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.execute('DELETE FROM results')
+        connection.execute('INSERT OR IGNORE INTO generation (id, generation) VALUES (0, 0)')
+        connection.execute('UPDATE generation SET generation = generation + 1 WHERE id = 0')
+        _generation = connection.execute('SELECT generation FROM generation WHERE id = 0').fetchone()[0]
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+        raise
+    _size = 0
+
+
+# The size is the count of the last trim (TRIM_PUTS), a trim runs first if this process has not trimmed yet
+async def stats():
+    if _size is None:
+        await run_in_threadpool(_trim)
+    return {
+        'path': SHARED_CACHE,
+        'size': _size,
+        'max_size': SHARED_CACHE_SIZE,
+        'generation': _generation
+    }
+
+
+# Rows of a delta sync session (sync.py): {key: (hash, stamp)}
+async def session_rows(session):
+    return await run_in_threadpool(_session_rows, session)
+
+
+def _session_rows(session):
+    return {key: (row_hash, stamp) for key, row_hash, stamp in
+            _connect().execute('SELECT key, hash, stamp FROM sync_rows WHERE session = ?', (session,))}
+
+
+# Last results (JSON) of some keys of a delta sync session: {key: value}
+async def session_values(session, keys):
+    return await run_in_threadpool(_session_values, session, keys)
+
+
+def _session_values(session, keys):
+    connection = _connect()
+    values = {}
+    for start in range(0, len(keys), LOOKUP_SIZE):
+        chunk = keys[start:start + LOOKUP_SIZE]
+        query = f"SELECT key, value FROM sync_rows WHERE session = ? AND key IN ({', '.join('?' * len(chunk))})"
+        values.update(connection.execute(query, [session] + chunk))
+    return values
+
+
+# Store the (key, hash, stamp, value) rows of a delta sync session and drop its removed keys, then the sessions
+# unused for ttl seconds
+async def save_session(session, rows, removed, ttl):
+    await run_in_threadpool(_save_session, session, rows, removed, ttl)
+
+
+def _save_session(session, rows, removed, ttl):
+    connection = _connect()
+    now = time.time()
+    connection.execute('BEGIN')
+    try:
+        connection.executemany('INSERT OR REPLACE INTO sync_rows (session, key, hash, stamp, value) VALUES (?, ?, ?, ?, ?)',
+                               [(session,) + row for row in rows])
+        connection.executemany('DELETE FROM sync_rows WHERE session = ? AND key = ?', [(session, key) for key in removed])
+        connection.execute('INSERT OR REPLACE INTO sync_sessions (session, used) VALUES (?, ?)', (session, now))
+        connection.execute('DELETE FROM sync_rows WHERE session IN (SELECT session FROM sync_sessions WHERE used < ?)', (now - ttl,))
+        connection.execute('DELETE FROM sync_sessions WHERE used < ?', (now - ttl,))
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+        raise
+
+
+# Shared market data (JSON) if its version is not this process', None otherwise, and the shared cache generation
+def _read_shared_state():
+    connection = _connect()
+    row = connection.execute('SELECT data FROM market_data WHERE id = 0 AND version != ?', (marketdata.version(),)).fetchone()
+    shared_generation = connection.execute('SELECT generation FROM generation WHERE id = 0').fetchone()
+    return (row[0] if row is not None else None), (shared_generation[0] if shared_generation is not None else 0)
+
+
+def _apply_shared_state(data, shared_generation):
+    global _generation
+    if data is not None:
+        marketdata.apply_snapshot(json.loads(data))
+        log.info("Market data synced", extra={'fields': {'version': marketdata.version()}})
+    if shared_generation != _generation:
+        _generation = shared_generation
+        log.info("Cache generation synced", extra={'fields': {'generation': _generation}})
+
+
+# Bring this process' market data and cache generation up to the shared ones (at startup)
+def sync_market_data():
+    if SHARED_CACHE:
+        _apply_shared_state(*_read_shared_state())
+
+
+# sync_market_data from a request, every SYNC_INTERVAL seconds at most and off the event loop; requests arriving
+# while a check runs are served with what the process has
+async def sync_if_due():
+    global _last_sync, _syncing
+    if not SHARED_CACHE or _syncing or time.monotonic() - _last_sync < SYNC_INTERVAL:
+        return
+    _syncing = True
+    try:
+        _apply_shared_state(*(await run_in_threadpool(_read_shared_state)))
+    except sqlite3.Error as e:
+        log.warning("Shared cache sync failed: %s", e)
+    finally:
+        _last_sync = time.monotonic()
+        _syncing = False
+
+
+# Start an update: take the write lock of the file (other processes' updates wait for this one) on a connection of the
+# update, whose steps may run in different threads. Returns the connection and the shared market data (JSON) or None
+def _begin_update():
+    _connect()
+    connection = sqlite3.connect(SHARED_CACHE, timeout=10, isolation_level=None, check_same_thread=False)
+    try:
+        connection.execute('BEGIN IMMEDIATE')
+        row = connection.execute('SELECT data FROM market_data WHERE id = 0').fetchone()
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection, (row[0] if row is not None else None)
+
+
+# Write the market data snapshot with its version and delete the results of the previous versions, or roll back if
+# snapshot is None
+def _end_update(connection, snapshot):
+    try:
+        if snapshot is None:
+            connection.execute('ROLLBACK')
+            return
+        connection.execute('INSERT OR REPLACE INTO market_data (id, version, data) VALUES (0, ?, ?)', (snapshot['VERSION'], json.dumps(snapshot)))
+        connection.execute('DELETE FROM results WHERE version < ?', (snapshot['VERSION'],))
+        connection.execute('COMMIT')
+    except sqlite3.Error:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+
+# marketdata.update for every process of the host: the update is applied on top of the shared market data and
+# written back with the next version, results of the previous versions are deleted
+# The file is read & written in the threadpool, the market data of the process is updated on the event loop
+# Returns the list of errors, nothing is updated if there is any
+async def update_market_data(rates=None, volatilities=None, surfaces=None):
+    if not SHARED_CACHE:
+        return marketdata.update(rates, volatilities, surfaces)
+    connection, data = await run_in_threadpool(_begin_update)
+    try:
+        if data is not None:
+            marketdata.apply_snapshot(json.loads(data))
+        errors = marketdata.update(rates, volatilities, surfaces)
+    except BaseException:
+        await run_in_threadpool(_end_update, connection, None)
+        raise
+    await run_in_threadpool(_end_update, connection, None if errors else marketdata.snapshot())
+    return errors
+
+
+# Sync the market data & cache generation with HTTP requests & WebSocket connections, see sync_if_due
+class MarketDataSyncMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] in ['http', 'websocket'] and scope['path'] not in SYNC_SKIP_PATHS:
+            await sync_if_due()
+        await self.app(scope, receive, send)
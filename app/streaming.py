@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+
+from fastapi.responses import StreamingResponse
+
+from pricer import OPTION_FIELDS, OPTIONAL_OPTION_FIELDS
+from workers import CHUNK_SIZE, run_batch
+from encoding import JSON, stream_header, stream_row
+
+# Chunks of CHUNK_SIZE lines read ahead of the pricing: reading the request body pauses while they wait, so the memory
+# of a stream stays bounded whatever the size of the file and the pace of the client
+STREAM_BUFFER_CHUNKS = max(int(os.environ.get('PRICER_STREAM_BUFFER_CHUNKS', 2)), 1)
+
+
+# StreamingResponse that may keep reading the request body while it streams
+# (Starlette's listens for the disconnect on the same channel and would swallow the body)
+class DuplexStreamingResponse(StreamingResponse):
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# Split an async stream of bytes into lines without holding more than one partial line
+async def read_lines(chunks):
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        lines = buffer.split(b'\n')
+        buffer = lines.pop()
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+# Pricing row of one NDJSON line: a JSON object with the OPTION_FIELDS (same shape as a /webpricer payload)
+# Returns (row, None) or (None, error message)
+def parse_line(line):
+    try:
+        item = json.loads(line)
+    except ValueError:
+        return None, "Invalid JSON line."
+    if not isinstance(item, dict):
+        return None, "Invalid JSON line. Must be an object."
+    return parse_payload(item)
+
+
+# Pricing row of a decoded /webpricer payload, values as strings
+# Returns (row, None) or (None, error message)
+def parse_payload(item):
+    missing = [field for field in OPTION_FIELDS if field not in item]
+    if missing:
+        return None, f"Missing fields: {', '.join(missing)}."
+    row = {field: str(item[field]) if item[field] is not None else "" for field in OPTION_FIELDS}
+    row.update({field: str(item.get(field) or "") for field in OPTIONAL_OPTION_FIELDS})
+    return row, None
+
+
+# Price a batch of rows (None for rows that failed to parse) and return its encoded results (NDJSON lines by default)
+# Streamed rows bypass the result cache, a large file would otherwise fill it with rows seen once
+async def _price_chunk(start, rows, errors, engine, media_type):
+    parsed = [(i, row) for i, row in enumerate(rows) if row is not None]
+    option_values = await run_batch([row for _, row in parsed], engine) if parsed else []
+    values = dict(errors)
+    for (i, _), (_, value) in zip(parsed, option_values):
+        values[i] = value
+    return [stream_row(start + i, values[i], media_type) for i in range(len(rows))]
+
+
+# Read the request body into chunks of up to CHUNK_SIZE lines, independently of the response
+# The reading waits while STREAM_BUFFER_CHUNKS chunks are queued (backpressure on the upload)
+async def _read_chunks(body, chunks):
+    try:
+        lines = []
+        async for line in read_lines(body):
+            if not line.strip():
+                continue
+            lines.append(line)
+            if len(lines) >= CHUNK_SIZE:
+                await chunks.put(lines)
+                lines = []
+        if lines:
+            await chunks.put(lines)
+    except Exception as e:
+        await chunks.put(e)
+    await chunks.put(None)
+
+
+# Price NDJSON rows as they arrive and yield one indexed result per row in row order, NDJSON lines by default
+# (encoding.py), after the header of the compact encodings
+# Rows are priced CHUNK_SIZE at a time; the next chunk is parsed while the previous one is being priced
+# At most STREAM_BUFFER_CHUNKS chunks are queued and one is being priced, the rest of the body is left unread until then
+async def stream_prices(body, engine, media_type=JSON):
+    chunks = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+    reader = asyncio.ensure_future(_read_chunks(body, chunks))
+    pending = None
+    start = 0
+    try:
+        header = stream_header(media_type)
+        if header is not None:
+            yield header
+        while True:
+            lines = await chunks.get()
+            if isinstance(lines, Exception):
+                raise lines
+            if lines is None:
+                break
+            rows, errors = [], {}
+            for i, line in enumerate(lines):
+                row, error = parse_line(line)
+                if error is not None:
+                    errors[i] = [error]
+                rows.append(row)
+            if pending is not None:
+                for result in await pending:
+                    yield result
+            pending = asyncio.ensure_future(_price_chunk(start, rows, errors, engine, media_type))
+            start += len(rows)
+
+        if pending is not None:
+            for result in await pending:
+                yield result
+    finally:
+        reader.cancel()
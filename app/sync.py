@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+
+import marketdata
+import result_cache
+import shared_cache
+
+# Delta sync of a client's book (/bulkwebpricer/sync)
+# Each row carries a stable KEY and a HASH of its contents. A session remembers, per key, the hash, the day, market data
+# version & engine it was priced with (its stamp) and the last result sent. A sync only prices the rows that are new,
+# whose hash changed or whose stamp is stale, and only returns the results that changed and the keys that are gone.
+# Rows whose hash is unchanged may be sent without their payload: if they need pricing anyway (new market data),
+# their keys come back as MISSING for the client to send again with their payloads.
+# Sessions are kept in this process, or in the shared cache of the host when PRICER_SHARED_CACHE is set.
+
+# Sessions kept in this process, least recently used first out
+SYNC_SESSIONS = int(os.environ.get('PRICER_SYNC_SESSIONS', 64))
+# Seconds an unused session is kept
+SYNC_SESSION_TTL = float(os.environ.get('PRICER_SYNC_SESSION_TTL', 86400))
+
+# {session: (last used, {key: (hash, stamp, value)})}, values as JSON
+_sessions = OrderedDict()
+
+
+# HASH of a row sent without one
+def row_hash(params):
+    return hashlib.blake2b(repr(result_cache.row_fields(params)).encode(), digest_size=16).hexdigest()
+
+
+async def _session_rows(session):
+    if shared_cache.enabled():
+        return await shared_cache.session_rows(session)
+    entry = _sessions.get(session)
+    if entry is not None and entry[0] < time.time() - SYNC_SESSION_TTL:
+        del _sessions[session]
+        entry = None
+    return {key: (content_hash, stamp) for key, (content_hash, stamp, _) in entry[1].items()} if entry is not None else {}
+
+
+async def _session_values(session, keys):
+    if shared_cache.enabled():
+        return await shared_cache.session_values(session, keys)
+    rows = _sessions[session][1] if session in _sessions else {}
+    return {key: rows[key][2] for key in keys if key in rows}
+
+
+async def _save_session(session, rows, removed):
+    if shared_cache.enabled():
+        await shared_cache.save_session(session, rows, removed, SYNC_SESSION_TTL)
+        return
+    session_rows = _sessions[session][1] if session in _sessions else {}
+    for key, content_hash, stamp, value in rows:
+        session_rows[key] = (content_hash, stamp, value)
+    for key in removed:
+        session_rows.pop(key, None)
+    _sessions[session] = (time.time(), session_rows)
+    _sessions.move_to_end(session)
+    while len(_sessions) > SYNC_SESSIONS:
+        _sessions.popitem(last=False)
+
+
+# Sync a session's book: rows are (KEY, HASH or None, params or None) triples, the whole book in any order
+# Returns {"CHANGED": [(key, result), ...], "REMOVED": [key, ...], "MISSING": [key, ...], "ROWS", "PRICED"}
+async def sync_book(session, rows, engine='vectorized'):
+    stamp = f"{date.today().isoformat()}|{marketdata.version()}|{engine}"
+    known = await _session_rows(session)
+
+    priced = []
+    missing = []
+    keys = set()
+    for key, content_hash, params in rows:
+        keys.add(key)
+        if content_hash is None and params is not None:
+            content_hash = row_hash(params)
+        if known.get(key) == (content_hash, stamp):
+            continue
+        if params is None:
+            missing.append(key)
+        else:
+            priced.append((key, content_hash, params))
+
+    changed = []
+    updates = []
+    if priced:
+        values = await result_cache.cached_batch([params for _, _, params in priced], engine)
+        previous = await _session_values(session, [key for key, _, _ in priced])
+        for (key, content_hash, _), (_, value) in zip(priced, values):
+            text = json.dumps(value)
+            updates.append((key, content_hash, stamp, text))
+            if previous.get(key) != text:
+                changed.append((key, value))
+    removed = [key for key in known if key not in keys]
+    # Saved even without updates, to mark the session as used
+    await _save_session(session, updates, removed)
+
+    return {'CHANGED': changed, 'REMOVED': removed, 'MISSING': missing, 'ROWS': len(rows), 'PRICED': len(priced)}
@@ -0,0 +1,257 @@
+import math
+
+import numpy as np
+import QuantLib as ql
+
+import dates
+from metrics import StageClock
+from marketdata import CALENDAR, DAY_COUNT_RATE, DAY_COUNT_VOLATILITY, FOREIGN, DOMESTIC, snapshot, surface_volatility
+from greeks import rolled_reference_date
+
+# scipy is optional, norm_cdf falls back to a NumPy implementation without it
+try:
+    from scipy.special import ndtr as _ndtr
+except ImportError:
+    _ndtr = None
+
+
+SINGLE_BARRIER_TYPES = ['KO_BARRIER', 'KI_BARRIER']
+DOUBLE_BARRIER_TYPES = ['KO_DB_BARRIER', 'KI_DB_BARRIER']
+
+# Columns produced by parse_rows and their dtypes
+COLUMNS = {
+    'EXOTIC_TYPE': object,
+    'SPOT': float,
+    'STRIKE': float,
+    'NOTIONAL': float,
+    'UPPER_BARRIER': float,
+    'LOWER_BARRIER': float,
+    'DOMESTIC_RATE': float,
+    'FOREIGN_RATE': float,
+    'VOLATILITY': float,
+    'T_RATE': float,
+    'T_VOL': float,
+    # Times from the evaluation date of the THETA roll (greeks.rolled_reference_date), NaN if the option expires by then
+    'T_RATE_ROLLED': float,
+    'T_VOL_ROLLED': float,
+    'IS_CALL': bool
+}
+
+# Standard normal cumulative distribution
+# Without scipy: Hart's double precision algorithm (as given in G. West, "Better approximations to cumulative normal functions")
+def norm_cdf(x):
+    if _ndtr is not None:
+        return _ndtr(x)
+    x = np.asarray(x, dtype=float)
+    x_abs = np.abs(x)
+    exponential = np.exp(-0.5 * x_abs * x_abs)
+
+    numerator = ((((((3.52624965998911e-02 * x_abs + 0.700383064443688) * x_abs + 6.37396220353165) * x_abs
+                    + 33.912866078383) * x_abs + 112.079291497871) * x_abs + 221.213596169931) * x_abs + 220.206867912376)
+    denominator = (((((((8.83883476483184e-02 * x_abs + 1.75566716318264) * x_abs + 16.064177579207) * x_abs
+                      + 86.7807322029461) * x_abs + 296.564248779674) * x_abs + 637.333633378831) * x_abs
+                    + 793.826512519948) * x_abs + 440.413735824752)
+    continued_fraction = x_abs + 1 / (x_abs + 2 / (x_abs + 3 / (x_abs + 4 / (x_abs + 0.65))))
+
+    tail = np.where(x_abs < 7.07106781186547, exponential * numerator / denominator,
+                    exponential / continued_fraction / 2.506628274631)
+    tail = np.where(x_abs > 37, 0.0, tail)
+    return np.where(x > 0, 1 - tail, tail)
+
+
+# Standard normal density
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / math.sqrt(2.0 * math.pi)
+
+
+# Garman-Kohlhagen price and greeks of European FX options, one array element per option
+# t_rate is the Actual/360 time used for discounting, t_vol the Actual/Actual (ISDA) time used for the variance
+# Returns per unit of foreign notional: NPV, DELTA, GAMMA and VEGA as QuantLib's AnalyticEuropeanEngine reports them
+def garman_kohlhagen(spot, strike, domestic_rate, foreign_rate, volatility, t_rate, t_vol, is_call):
+    domestic_discount = np.exp(-domestic_rate * t_rate)
+    foreign_discount = np.exp(-foreign_rate * t_rate)
+    forward = spot * foreign_discount / domestic_discount
+    std_dev = volatility * np.sqrt(t_vol)
+
+    d1 = np.log(forward / strike) / std_dev + 0.5 * std_dev
+    d2 = d1 - std_dev
+    phi = np.where(is_call, 1.0, -1.0)
+
+    npv = domestic_discount * phi * (forward * norm_cdf(phi * d1) - strike * norm_cdf(phi * d2))
+    delta = foreign_discount * phi * norm_cdf(phi * d1)
+    density = norm_pdf(d1)
+    gamma = foreign_discount * density / (spot * std_dev)
+    vega = spot * foreign_discount * density * np.sqrt(t_vol)
+
+    return {'NPV': npv, 'DELTA': delta, 'GAMMA': gamma, 'VEGA': vega}
+
+
+# Scale raw prices & greeks the same way as CALCULATED_FIELDS in pricer.py
+def scale_fields(npv, delta, gamma, vega, theta, spot, notional):
+    return {
+        'PREMIUM': npv * notional / spot,
+        'DELTA': delta * notional / spot,
+        'GAMMA': gamma * spot / 100,
+        'VEGA': vega * notional * (1 / 100) / spot,
+        'THETA': theta * notional / spot,
+        'OPTION_NPV': npv
+    }
+
+
+def _parse_positive(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _parse_barriers(params, exotic_type, option_type, spot):
+    upper = lower = 0.0
+    if exotic_type in SINGLE_BARRIER_TYPES + DOUBLE_BARRIER_TYPES:
+        if option_type == 'CALL' or exotic_type in DOUBLE_BARRIER_TYPES:
+            upper = _parse_positive(params['UPPER_BARRIER'])
+            if upper is None or upper <= spot:
+                return None
+        if option_type == 'PUT' or exotic_type in DOUBLE_BARRIER_TYPES:
+            lower = _parse_positive(params['LOWER_BARRIER'])
+            if lower is None or lower >= spot:
+                return None
+    return upper, lower
+
+
+# Columnar inputs of the European rows of the given EXOTIC_TYPEs
+# Rows that the QuantLib path would reject are left out so that they fall back to pricer.price_option
+# and get its error messages
+def parse_rows(rows, exotic_types):
+    evaluation_date = dates.evaluation_date()
+    reference_date = CALENDAR.advance(evaluation_date, 0, ql.Days)
+    rolled_date = rolled_reference_date(evaluation_date)
+    # One consistent view of the shared market data for the whole batch
+    market_data = snapshot()
+    foreign_rates = market_data['RATES'][FOREIGN]
+    domestic_rates = market_data['RATES'][DOMESTIC]
+    volatilities = market_data['VOLATILITIES']
+    surfaces = market_data['SURFACES']
+
+    times = {}
+    # Surface volatility by (pair, MATURITY, strike), books repeat a handful of tenors & strikes
+    surface_volatilities = {}
+    indices = []
+    columns = {name: [] for name in COLUMNS}
+
+    for i, params in enumerate(rows):
+        exotic_type = str(params['EXOTIC_TYPE']).upper()
+        if exotic_type not in exotic_types or str(params['EXERCISE']).upper() != 'E':
+            continue
+        option_type = str(params['TYPE']).upper()
+        if option_type not in ['CALL', 'PUT']:
+            continue
+        currency_pair = params['CURRENCY_PAIR']
+        if len(currency_pair) != 6 or currency_pair[0:3] not in foreign_rates or currency_pair[3:6] not in domestic_rates:
+            continue
+        spot = _parse_positive(params['SPOT'])
+        strike = _parse_positive(params['STRIKE'])
+        notional = _parse_positive(params['NOTIONAL'])
+        # Rows on the pair's volatility surface get their volatility once their expiry is known
+        on_surface = params['VOLATILITY'] == '' and currency_pair.upper() in surfaces
+        if on_surface:
+            volatility = None
+        elif params['VOLATILITY'] == '' and currency_pair.upper() in volatilities:
+            volatility = volatilities[currency_pair.upper()]
+        else:
+            volatility = _parse_positive(params['VOLATILITY'])
+        if spot is None or strike is None or notional is None or (volatility is None and not on_surface):
+            continue
+        barriers = _parse_barriers(params, exotic_type, option_type, spot)
+        if barriers is None:
+            continue
+
+        # Rows sharing a MATURITY & pair share the date arithmetic
+        maturity = (params['MATURITY'], currency_pair)
+        if maturity not in times:
+            maturity_dates, _ = dates.maturity_dates(params['MATURITY'], currency_pair)
+            expiry_date = maturity_dates[0] if maturity_dates is not None else None
+            if expiry_date is None or expiry_date <= reference_date:
+                times[maturity] = None
+            else:
+                rolled = expiry_date > rolled_date
+                times[maturity] = (DAY_COUNT_RATE.yearFraction(reference_date, expiry_date),
+                                   DAY_COUNT_VOLATILITY.yearFraction(reference_date, expiry_date),
+                                   DAY_COUNT_RATE.yearFraction(rolled_date, expiry_date) if rolled else np.nan,
+                                   DAY_COUNT_VOLATILITY.yearFraction(rolled_date, expiry_date) if rolled else np.nan,
+                                   expiry_date)
+        if times[maturity] is None:
+            continue
+        if on_surface:
+            key = (currency_pair.upper(), params['MATURITY'], strike)
+            if key not in surface_volatilities:
+                surface_volatilities[key] = surface_volatility(currency_pair.upper(), evaluation_date, times[maturity][4], strike)
+            volatility = surface_volatilities[key]
+
+        indices.append(i)
+        columns['EXOTIC_TYPE'].append(exotic_type)
+        columns['SPOT'].append(spot)
+        columns['STRIKE'].append(strike)
+        columns['NOTIONAL'].append(notional)
+        columns['UPPER_BARRIER'].append(barriers[0])
+        columns['LOWER_BARRIER'].append(barriers[1])
+        columns['DOMESTIC_RATE'].append(domestic_rates[currency_pair[3:6]])
+        columns['FOREIGN_RATE'].append(foreign_rates[currency_pair[0:3]])
+        columns['VOLATILITY'].append(volatility)
+        columns['T_RATE'].append(times[maturity][0])
+        columns['T_VOL'].append(times[maturity][1])
+        columns['T_RATE_ROLLED'].append(times[maturity][2])
+        columns['T_VOL_ROLLED'].append(times[maturity][3])
+        columns['IS_CALL'].append(option_type == 'CALL')
+
+    return indices, {name: np.asarray(values, dtype=COLUMNS[name]) for name, values in columns.items()}
+
+
+# Columnar inputs of the vanilla European rows
+def parse_vanilla_rows(rows):
+    return parse_rows(rows, ['VANILLA'])
+
+
+# Build {row index: CALCULATED_FIELDS} from the scaled columns, skipping rows with non-finite results
+# A NaN THETA (option expiring within the roll) becomes None, as on the QuantLib path
+def fields_by_row(indices, fields):
+    finite = np.isfinite(fields['OPTION_NPV']) & np.isfinite(fields['DELTA']) & np.isfinite(fields['GAMMA']) & np.isfinite(fields['VEGA'])
+
+    calculated = {}
+    values = {name: column.tolist() for name, column in fields.items()}
+    for j, i in enumerate(indices):
+        if finite[j]:
+            calculated[i] = {
+                'PREMIUM': values['PREMIUM'][j],
+                'DELTA': values['DELTA'][j],
+                'GAMMA': values['GAMMA'][j],
+                'VEGA': values['VEGA'][j],
+                'THETA': None if math.isnan(values['THETA'][j]) else values['THETA'][j],
+                'OPTION_NPV': values['OPTION_NPV'][j]
+            }
+    return calculated
+
+
+# Price a whole batch of vanilla European columns in a few array operations
+# THETA reprices the batch on the rolled times, like greeks.rolled_npv
+# Returns the scaled CALCULATED_FIELDS columns
+def price_vanilla_columns(columns):
+    raw = garman_kohlhagen(columns['SPOT'], columns['STRIKE'], columns['DOMESTIC_RATE'], columns['FOREIGN_RATE'],
+                           columns['VOLATILITY'], columns['T_RATE'], columns['T_VOL'], columns['IS_CALL'])
+    rolled = garman_kohlhagen(columns['SPOT'], columns['STRIKE'], columns['DOMESTIC_RATE'], columns['FOREIGN_RATE'],
+                              columns['VOLATILITY'], columns['T_RATE_ROLLED'], columns['T_VOL_ROLLED'], columns['IS_CALL'])
+    return scale_fields(raw['NPV'], raw['DELTA'], raw['GAMMA'], raw['VEGA'], rolled['NPV'] - raw['NPV'], columns['SPOT'], columns['NOTIONAL'])
+
+
+# Price the vanilla European rows of a batch
+# Returns {row index: CALCULATED_FIELDS} for the rows it priced, the others are left to the QuantLib path
+def price_vanilla_rows(rows):
+    clock = StageClock('VANILLA', 'vectorized')
+    indices, columns = parse_vanilla_rows(rows)
+    clock.lap('parse')
+    if not indices:
+        return {}
+    calculated = fields_by_row(indices, price_vanilla_columns(columns))
+    clock.lap('npv_greeks')
+    return calculated
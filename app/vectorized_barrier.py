@@ -0,0 +1,166 @@
+import numpy as np
+
+from metrics import StageClock
+from vectorized import norm_cdf, scale_fields, parse_rows, fields_by_row, SINGLE_BARRIER_TYPES, DOUBLE_BARRIER_TYPES
+from greeks import SPOT_BUMP, VOLATILITY_BUMP
+
+# Number of terms on each side of the Ikeda-Kunitomo series, as in QuantLib's AnalyticDoubleBarrierEngine
+DOUBLE_BARRIER_SERIES = 5
+
+# Barrier types in the order of BARRIER_COEFFICIENTS
+DOWN_IN, UP_IN, DOWN_OUT, UP_OUT = 0, 1, 2, 3
+
+# Reiner-Rubinstein single barrier prices (no rebate) as a*A + b*B + c*C + d*D
+# Indexed by [barrier type][is call][strike >= barrier], same case split as QuantLib's AnalyticBarrierEngine
+BARRIER_COEFFICIENTS = np.array([
+    # DOWN_IN
+    [[[1, 0, 0, 0], [0, 1, -1, 1]],     # put: K < H, K >= H
+     [[1, -1, 0, 1], [0, 0, 1, 0]]],    # call
+    # UP_IN
+    [[[0, 0, 1, 0], [1, -1, 0, 1]],
+     [[0, 1, -1, 1], [1, 0, 0, 0]]],
+    # DOWN_OUT
+    [[[0, 0, 0, 0], [1, -1, 1, -1]],
+     [[0, 1, 0, -1], [1, 0, -1, 0]]],
+    # UP_OUT
+    [[[1, 0, -1, 0], [0, 1, 0, -1]],
+     [[1, -1, 1, -1], [0, 0, 0, 0]]],
+], dtype=float)
+
+
+# Single barrier (knock-in / knock-out, no rebate) European prices, one array element per option
+# As in QuantLib's AnalyticBarrierEngine the std deviation uses the Actual/Actual (ISDA) time t_vol,
+# the discounting the Actual/360 time t_rate
+def single_barrier_npv(barrier_type, is_call, spot, strike, barrier, domestic_rate, foreign_rate, volatility, t_rate, t_vol):
+    std_dev = volatility * np.sqrt(t_vol)
+    domestic_discount = np.exp(-domestic_rate * t_rate)
+    foreign_discount = np.exp(-foreign_rate * t_rate)
+    mu = (domestic_rate - foreign_rate) / (volatility * volatility) - 0.5
+    mu_sigma = (1 + mu) * std_dev
+
+    phi = np.where(is_call, 1.0, -1.0)
+    eta = np.where((barrier_type == DOWN_IN) | (barrier_type == DOWN_OUT), 1.0, -1.0)
+
+    x1 = np.log(spot / strike) / std_dev + mu_sigma
+    x2 = np.log(spot / barrier) / std_dev + mu_sigma
+    A = phi * (spot * foreign_discount * norm_cdf(phi * x1) - strike * domestic_discount * norm_cdf(phi * (x1 - std_dev)))
+    B = phi * (spot * foreign_discount * norm_cdf(phi * x2) - strike * domestic_discount * norm_cdf(phi * (x2 - std_dev)))
+
+    hs = barrier / spot
+    pow_hs0 = hs ** (2 * mu)
+    pow_hs1 = pow_hs0 * hs * hs
+    y1 = np.log(barrier * barrier / (spot * strike)) / std_dev + mu_sigma
+    y2 = np.log(barrier / spot) / std_dev + mu_sigma
+    C = phi * (spot * foreign_discount * pow_hs1 * norm_cdf(eta * y1) - strike * domestic_discount * pow_hs0 * norm_cdf(eta * (y1 - std_dev)))
+    D = phi * (spot * foreign_discount * pow_hs1 * norm_cdf(eta * y2) - strike * domestic_discount * pow_hs0 * norm_cdf(eta * (y2 - std_dev)))
+
+    coefficients = BARRIER_COEFFICIENTS[barrier_type, is_call.astype(int), (strike >= barrier).astype(int)]
+    return coefficients[:, 0] * A + coefficients[:, 1] * B + coefficients[:, 2] * C + coefficients[:, 3] * D
+
+
+# Double barrier (knock-in / knock-out, no rebate) European prices with the Ikeda-Kunitomo series
+# Every time is the Actual/360 time t, as in QuantLib's AnalyticDoubleBarrierEngine
+def double_barrier_npv(is_knock_in, is_call, spot, strike, upper, lower, domestic_rate, foreign_rate, volatility, t):
+    std_dev = volatility * np.sqrt(t)
+    domestic_discount = np.exp(-domestic_rate * t)
+    foreign_discount = np.exp(-foreign_rate * t)
+    cost_of_carry = domestic_rate - foreign_rate
+    variance_rate = volatility * volatility
+    mu1 = 2 * cost_of_carry / variance_rate + 1
+    b_sigma = (cost_of_carry + variance_rate / 2.0) * t / std_dev
+
+    call_acc1 = np.zeros_like(spot)
+    call_acc2 = np.zeros_like(spot)
+    put_acc1 = np.zeros_like(spot)
+    put_acc2 = np.zeros_like(spot)
+    for n in range(-DOUBLE_BARRIER_SERIES, DOUBLE_BARRIER_SERIES + 1):
+        l2n = lower ** (2 * n)
+        u2n = upper ** (2 * n)
+        l2n2 = lower ** (2 * n + 2)
+        ratio_up = upper ** n / lower ** n
+        ratio_down = lower ** (n + 1) / (upper ** n * spot)
+
+        d1 = np.log(spot * u2n / (strike * l2n)) / std_dev + b_sigma
+        d2 = np.log(spot * u2n / (upper * l2n)) / std_dev + b_sigma
+        d3 = np.log(l2n2 / (strike * spot * u2n)) / std_dev + b_sigma
+        d4 = np.log(l2n2 / (upper * spot * u2n)) / std_dev + b_sigma
+        call_acc1 += ratio_up ** mu1 * (norm_cdf(d1) - norm_cdf(d2)) - ratio_down ** mu1 * (norm_cdf(d3) - norm_cdf(d4))
+        call_acc2 += ratio_up ** (mu1 - 2) * (norm_cdf(d1 - std_dev) - norm_cdf(d2 - std_dev)) - ratio_down ** (mu1 - 2) * (norm_cdf(d3 - std_dev) - norm_cdf(d4 - std_dev))
+
+        y1 = np.log(spot * u2n / lower ** (2 * n + 1)) / std_dev + b_sigma
+        y2 = np.log(spot * u2n / (strike * l2n)) / std_dev + b_sigma
+        y3 = np.log(l2n2 / (lower * spot * u2n)) / std_dev + b_sigma
+        y4 = np.log(l2n2 / (strike * spot * u2n)) / std_dev + b_sigma
+        put_acc1 += ratio_up ** (mu1 - 2) * (norm_cdf(y1 - std_dev) - norm_cdf(y2 - std_dev)) - ratio_down ** (mu1 - 2) * (norm_cdf(y3 - std_dev) - norm_cdf(y4 - std_dev))
+        put_acc2 += ratio_up ** mu1 * (norm_cdf(y1) - norm_cdf(y2)) - ratio_down ** mu1 * (norm_cdf(y3) - norm_cdf(y4))
+
+    call_knock_out = np.maximum(0.0, spot * foreign_discount * call_acc1 - strike * domestic_discount * call_acc2)
+    put_knock_out = np.maximum(0.0, strike * domestic_discount * put_acc1 - spot * foreign_discount * put_acc2)
+    knock_out = np.where(is_call, call_knock_out, put_knock_out)
+
+    # Knock-in = vanilla - knock-out, the vanilla priced with the same std deviation & discounting
+    forward = spot * foreign_discount / domestic_discount
+    k1 = np.log(forward / strike) / std_dev + 0.5 * std_dev
+    phi = np.where(is_call, 1.0, -1.0)
+    vanilla = np.maximum(0.0, domestic_discount * phi * (forward * norm_cdf(phi * k1) - strike * norm_cdf(phi * (k1 - std_dev))))
+    knock_in = np.maximum(0.0, vanilla - knock_out)
+
+    return np.where(is_knock_in, knock_in, knock_out)
+
+
+# NPV of the barrier columns produced by vectorized.parse_rows for the given spot & volatility columns
+def barrier_npv(columns, spot, volatility):
+    exotic_type = columns['EXOTIC_TYPE']
+    is_call = columns['IS_CALL']
+    npv = np.zeros_like(spot)
+
+    single = np.isin(exotic_type, SINGLE_BARRIER_TYPES)
+    if single.any():
+        knock_in = exotic_type[single] == 'KI_BARRIER'
+        up = is_call[single]
+        barrier_type = np.where(knock_in, np.where(up, UP_IN, DOWN_IN), np.where(up, UP_OUT, DOWN_OUT))
+        barrier = np.where(up, columns['UPPER_BARRIER'][single], columns['LOWER_BARRIER'][single])
+        npv[single] = single_barrier_npv(barrier_type, is_call[single], spot[single], columns['STRIKE'][single], barrier,
+                                         columns['DOMESTIC_RATE'][single], columns['FOREIGN_RATE'][single], volatility[single],
+                                         columns['T_RATE'][single], columns['T_VOL'][single])
+
+    double = np.isin(exotic_type, DOUBLE_BARRIER_TYPES)
+    if double.any():
+        npv[double] = double_barrier_npv(exotic_type[double] == 'KI_DB_BARRIER', is_call[double], spot[double], columns['STRIKE'][double],
+                                         columns['UPPER_BARRIER'][double], columns['LOWER_BARRIER'][double],
+                                         columns['DOMESTIC_RATE'][double], columns['FOREIGN_RATE'][double], volatility[double], columns['T_RATE'][double])
+    return npv
+
+
+# Price a whole batch of barrier columns: NPV plus DELTA, GAMMA & VEGA by central differences over the batch and THETA
+# on the rolled times, the same bumps as greeks.option_greeks
+# Returns the scaled CALCULATED_FIELDS columns
+def price_barrier_columns(columns):
+    spot = columns['SPOT']
+    volatility = columns['VOLATILITY']
+    spot_bump = spot * SPOT_BUMP
+
+    npv = barrier_npv(columns, spot, volatility)
+    npv_spot_up = barrier_npv(columns, spot + spot_bump, volatility)
+    npv_spot_down = barrier_npv(columns, spot - spot_bump, volatility)
+    npv_vol_up = barrier_npv(columns, spot, volatility + VOLATILITY_BUMP)
+    npv_vol_down = barrier_npv(columns, spot, volatility - VOLATILITY_BUMP)
+    npv_rolled = barrier_npv(dict(columns, T_RATE=columns['T_RATE_ROLLED'], T_VOL=columns['T_VOL_ROLLED']), spot, volatility)
+
+    delta = (npv_spot_up - npv_spot_down) / (2 * spot_bump)
+    gamma = (npv_spot_up - 2 * npv + npv_spot_down) / (spot_bump * spot_bump)
+    vega = (npv_vol_up - npv_vol_down) / (2 * VOLATILITY_BUMP)
+    return scale_fields(npv, delta, gamma, vega, npv_rolled - npv, spot, columns['NOTIONAL'])
+
+
+# Price the single & double barrier European rows of a batch (KIKO and KOKI are left to QuantLib)
+# Returns {row index: CALCULATED_FIELDS} for the rows it priced
+def price_barrier_rows(rows):
+    clock = StageClock('BARRIER', 'vectorized')
+    indices, columns = parse_rows(rows, SINGLE_BARRIER_TYPES + DOUBLE_BARRIER_TYPES)
+    clock.lap('parse')
+    if not indices:
+        return {}
+    calculated = fields_by_row(indices, price_barrier_columns(columns))
+    clock.lap('npv_greeks')
+    return calculated
@@ -0,0 +1,86 @@
+import logging
+import os
+import time
+
+import dates
+import marketdata
+import metrics
+from pricer import ENGINES, AMERICAN_ENGINES, price_batch
+from montecarlo import BLOCK_PATHS
+
+log = logging.getLogger('pricer.warmup')
+
+# Warm-up of a server process before it serves (see /ready)
+# The first row of each kind pays for what QuantLib & NumPy build lazily: holiday tables, engines, the first calls of
+# the NumPy kernels... and the surfaces are built by the first row of each day. At startup, every server process
+# (and every pricing process in 'process' mode) prices one representative row of each EXOTIC_TYPE and American engine
+# with each engine, so the first requests after a deploy or a worker restart are priced warm. The warm-up is not
+# counted in /metrics.
+
+# 'off' to serve right away, the first rows of each kind are then priced cold
+WARMUP = os.environ.get('PRICER_WARMUP', 'on').lower() != 'off'
+
+_status = {'ready': False}
+
+
+def _row(**fields):
+    row = dict(CURRENCY_PAIR='EURUSD', MATURITY='3M', STRIKE='1.1', NOTIONAL='1000000', EXOTIC_TYPE='VANILLA', EXERCISE='E',
+               TYPE='CALL', UPPER_BARRIER='', LOWER_BARRIER='', WINDOW_START_DATE='', WINDOW_END_DATE='', SPOT='1.1',
+               VOLATILITY='0.1')
+    row.update(fields)
+    return row
+
+
+# Representative rows: {label: row}, one per EXOTIC_TYPE the engines price and American engine
+def warmup_rows():
+    rows = {'VANILLA': _row()}
+    for american_engine in AMERICAN_ENGINES:
+        rows[f'VANILLA_A_{american_engine}'] = _row(EXERCISE='A', AMERICAN_ENGINE=american_engine)
+    for exotic_type in ['KO_BARRIER', 'KI_BARRIER']:
+        rows[exotic_type] = _row(EXOTIC_TYPE=exotic_type, UPPER_BARRIER='1.2')
+    # KIKO & KOKI are left out: QuantLib's analytic double barrier engine rejects them, they would only warm up an error
+    for exotic_type in ['KO_DB_BARRIER', 'KI_DB_BARRIER']:
+        rows[exotic_type] = _row(EXOTIC_TYPE=exotic_type, UPPER_BARRIER='1.2', LOWER_BARRIER='1.0')
+    # One block of paths is enough to run every step of a simulation
+    for exotic_type in ['ASIAN', 'GEO_ASIAN']:
+        rows[exotic_type] = _row(EXOTIC_TYPE=exotic_type, PATHS=str(BLOCK_PATHS))
+    for exotic_type in ['KO_WINDOW_BARRIER', 'KI_WINDOW_BARRIER']:
+        rows[exotic_type] = _row(EXOTIC_TYPE=exotic_type, UPPER_BARRIER='1.2', PATHS=str(BLOCK_PATHS))
+    return rows
+
+
+# Price the representative rows with each engine and build today's surfaces
+# Returns the timings: {"seconds": ..., "surfaces": ..., "rows": {engine: {label: ms}}, "errors": [...]}
+def warm_up():
+    started = time.perf_counter()
+    surfaces = marketdata.build_surfaces(dates.evaluation_date())
+    timings = {}
+    errors = []
+    for engine in ENGINES:
+        timings[engine] = {}
+        for label, row in warmup_rows().items():
+            row_started = time.perf_counter()
+            (_, value), = price_batch([row], 0, engine)
+            timings[engine][label] = round((time.perf_counter() - row_started) * 1000, 3)
+            if isinstance(value, list):
+                errors.append(f"{label} ({engine}): {value[0]}")
+    # The warm-up rows are not served requests
+    metrics.drain()
+    if errors:
+        log.info("Warm-up rows with an error", extra={'fields': {'errors': errors}})
+    return {'seconds': round(time.perf_counter() - started, 3), 'surfaces': surfaces, 'rows': timings, 'errors': errors}
+
+
+def mark_ready(report):
+    _status.update(ready=True, startup=report)
+    log.info("Ready", extra={'fields': {key: value for key, value in report.items() if key.endswith('seconds')}})
+
+
+# Warm-up failed: the process serves anyway, cold, and /ready reports it as not ready
+def mark_failed(report, error):
+    _status.update(ready=False, startup=report, error=error)
+    log.error("Warm-up failed", extra={'fields': {'error': error}})
+
+
+def status():
+    return _status
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pricer import price_option, price_batch, build_option
+from montecarlo import MONTE_CARLO_TYPES, simulation_inputs, simulate_blocks, combine
+from scenarios import price_scenarios
+from implied_vol import implied_volatilities
+from marketdata import snapshot, apply_snapshot
+import metrics
+from logs import configure_logging
+from warmup import WARMUP, warm_up
+
+
+# Execution mode of the pricing endpoints
+# 'inline'  : price inside the web server process (QuantLib state shared by all requests of the process)
+# 'process' : dispatch pricing to a pool of worker processes, each owning its own QuantLib state,
+#             so CPU-bound pricing never blocks the event loop
+EXECUTION_MODE = os.environ.get('PRICER_EXECUTION_MODE', 'inline').lower()
+# Number of pricing processes in 'process' mode
+POOL_WORKERS = int(os.environ.get('PRICER_POOL_WORKERS', os.cpu_count() or 1))
+# Maximum number of bulk rows sent to a worker in one task
+CHUNK_SIZE = int(os.environ.get('PRICER_CHUNK_SIZE', 256))
+
+_pool = None
+log = logging.getLogger('pricer.workers')
+
+
+def start_pool():
+    global _pool
+    if EXECUTION_MODE == 'process' and _pool is None:
+        # Every worker process logs through its own queue & background thread, and is warmed up before its first task
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, initializer=_initialize_worker)
+        log.info("Started pricing pool", extra={'fields': {'workers': POOL_WORKERS}})
+    elif EXECUTION_MODE not in ['inline', 'process']:
+        raise ValueError(f"Invalid PRICER_EXECUTION_MODE: {EXECUTION_MODE}. Ex: inline, process.")
+
+
+def _initialize_worker():
+    configure_logging()
+    if WARMUP:
+        warm_up()
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+# Start every pricing process ahead of the first request, the pool only starts them as tasks come in otherwise
+# Returns the seconds taken, None without a pool
+async def warm_up_pool():
+    if _pool is None:
+        return None
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # As many tasks at once as processes: each submitted task that finds no idle process starts one
+    pids = await asyncio.gather(*[loop.run_in_executor(_pool, _worker_pid) for _ in range(POOL_WORKERS)])
+    log.info("Pricing pool warmed up", extra={'fields': {'workers': len(set(pids))}})
+    return round(time.perf_counter() - started, 3)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+
+# Split rows into contiguous chunks so that every worker gets a share of the batch
+def chunk_rows(rows, num_workers, chunk_size):
+    size = min(chunk_size, max(1, math.ceil(len(rows) / max(1, num_workers))))
+    return [(start, rows[start:start + size]) for start in range(0, len(rows), size)]
+
+
+# Worker process side: sync the market data with the web server process before pricing
+# and send the stage timings back along with the results
+def _price_option_synced(market_data, params):
+    apply_snapshot(market_data)
+    return price_option(params), metrics.drain()
+
+
+def _price_batch_synced(market_data, rows, start, engine, positions):
+    apply_snapshot(market_data)
+    return price_batch(rows, start, engine, positions), metrics.drain()
+
+
+def _implied_volatilities_synced(market_data, rows, start, engine):
+    apply_snapshot(market_data)
+    return implied_volatilities(rows, start, engine), metrics.drain()
+
+
+# The simulation inputs carry the rates & volatility already, no market data to sync
+def _simulate_blocks_synced(inputs, blocks):
+    return simulate_blocks(inputs, blocks), metrics.drain()
+
+
+def _price_scenarios_synced(market_data, rows, spot_bumps, volatility_bumps, start, theta):
+    apply_snapshot(market_data)
+    return price_scenarios(rows, spot_bumps, volatility_bumps, start, theta), metrics.drain()
+
+
+# Price a single row, in a worker process if the pool is running
+async def run_single(params):
+    if _pool is None:
+        return price_option(params)
+    if str(params.get('EXOTIC_TYPE', '')).upper() in MONTE_CARLO_TYPES:
+        return await run_monte_carlo(params)
+    loop = asyncio.get_running_loop()
+    calculated_values, samples = await loop.run_in_executor(_pool, _price_option_synced, snapshot(), params)
+    metrics.merge(samples)
+    return calculated_values
+
+
+# Price a batch of rows with the given engine, fanned out over the worker processes if the pool is running
+# positions: optional row numbers of the rows in the request, for the log lines (see price_batch)
+# Returns a list of (index, result) pairs in the original row order
+async def run_batch(rows, engine='vectorized', positions=None):
+    if _pool is None:
+        return price_batch(rows, 0, engine, positions)
+    positions = list(range(len(rows))) if positions is None else positions
+    # Path simulation rows spread their blocks over the pool instead, see run_monte_carlo
+    simulated = [i for i, params in enumerate(rows) if str(params.get('EXOTIC_TYPE', '')).upper() in MONTE_CARLO_TYPES]
+    if simulated:
+        return await _run_batch_simulated(rows, simulated, engine, positions)
+    loop = asyncio.get_running_loop()
+    market_data = snapshot()
+    tasks = [loop.run_in_executor(_pool, _price_batch_synced, market_data, chunk, start, engine, positions[start:start + len(chunk)])
+             for start, chunk in chunk_rows(rows, POOL_WORKERS, CHUNK_SIZE)]
+    option_values = []
+    for chunk_values, samples in await asyncio.gather(*tasks):
+        metrics.merge(samples)
+        option_values.extend(chunk_values)
+    return option_values
+
+
+async def _run_batch_simulated(rows, simulated, engine, positions):
+    simulated_rows = set(simulated)
+    others = [i for i in range(len(rows)) if i not in simulated_rows]
+    calculated = {}
+    if others:
+        for k, value in await run_batch([rows[i] for i in others], engine, [positions[i] for i in others]):
+            calculated[others[k]] = value
+    for i in simulated:
+        try:
+            calculated[i] = await run_monte_carlo(rows[i])
+        except Exception as e:
+            # An unexpected error in one row must not abort the rest of the batch
+            log.warning("Unexpected error pricing row %s: %s", positions[i], e, exc_info=log.isEnabledFor(logging.DEBUG))
+            calculated[i] = [f"RuntimeError in pricing: {e}"]
+    return [(i, calculated[i]) for i in range(len(rows))]
+
+
+# Price a path simulation row (montecarlo.py) with its blocks of paths spread over the worker processes
+# The row is validated in the web server process, the blocks are seeded by their number so the result does not
+# depend on the number of workers
+async def run_monte_carlo(params):
+    clock = metrics.StageClock(params['EXOTIC_TYPE'], 'quantlib')
+    OPTION_PARAM = build_option(params, clock)
+    if isinstance(OPTION_PARAM, list):
+        return OPTION_PARAM
+    try:
+        inputs = simulation_inputs(OPTION_PARAM)
+    except RuntimeError:
+        return ["RuntimeError in calculating option price & greeks."]
+    loop = asyncio.get_running_loop()
+    tasks = [loop.run_in_executor(_pool, _simulate_blocks_synced, inputs, blocks) for _, blocks in chunk_rows(list(range(inputs['BLOCKS'])), POOL_WORKERS, inputs['BLOCKS'])]
+    results = []
+    for block_results, samples in await asyncio.gather(*tasks):
+        metrics.merge(samples)
+        results.extend(block_results)
+    return combine(inputs, results)
+
+
+# Price the spot x volatility grids of a list of rows, spread over the worker processes if the pool is running
+# Returns a list of (index, grid) pairs in the original row order
+async def run_scenarios(rows, spot_bumps, volatility_bumps, theta=False):
+    if _pool is None:
+        return price_scenarios(rows, spot_bumps, volatility_bumps, 0, theta)
+    loop = asyncio.get_running_loop()
+    market_data = snapshot()
+    # A grid is a lot of work already, every option gets its own task
+    tasks = [loop.run_in_executor(_pool, _price_scenarios_synced, market_data, chunk, spot_bumps, volatility_bumps, start, theta) for start, chunk in chunk_rows(rows, len(rows), 1)]
+    option_values = []
+    for chunk_values, samples in await asyncio.gather(*tasks):
+        metrics.merge(samples)
+        option_values.extend(chunk_values)
+    return option_values
+
+
+# Solve the implied volatilities of a batch of rows, fanned out over the worker processes if the pool is running
+# Returns a list of (index, result) pairs in the original row order
+async def run_implied_volatilities(rows, engine='vectorized'):
+    if _pool is None:
+        return implied_volatilities(rows, 0, engine)
+    loop = asyncio.get_running_loop()
+    market_data = snapshot()
+    tasks = [loop.run_in_executor(_pool, _implied_volatilities_synced, market_data, chunk, start, engine) for start, chunk in chunk_rows(rows, POOL_WORKERS, CHUNK_SIZE)]
+    option_values = []
+    for chunk_values, samples in await asyncio.gather(*tasks):
+        metrics.merge(samples)
+        option_values.extend(chunk_values)
+    return option_values
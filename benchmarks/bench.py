@@ -0,0 +1,297 @@
+# Benchmark & load replay of the pricing endpoints
+# Usage (from the repo root):
+#   python benchmarks/bench.py [--target inprocess|uvicorn|http://host:port] [--scenarios single bulk columns]
+#                              [--requests 200] [--bulk-requests 10] [--bulk-size 1000] [--engine vectorized] [--concurrency 4]
+#   python benchmarks/bench.py --replay recorded.jsonl    replay a file of recorded requests
+#   python benchmarks/bench.py --record recorded.jsonl    write the synthetic requests as a replay file instead of running them
+#   python benchmarks/bench.py --compare <commit>         compare with the last run stored for another commit
+# Replay files hold one request per line: {"path": "/bulkwebpricer", "body": {...}}, a bare /webpricer payload
+# or a bare {"payloads": [...]} /bulkwebpricer body.
+# Every run is appended to benchmarks/results/<commit>.json.
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(BENCHMARKS_DIR, '..', 'app')
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+sys.path.insert(0, APP_DIR)
+
+from synthetic import random_mixed_row
+
+OPTION_FIELDS = ['CURRENCY_PAIR', 'MATURITY', 'STRIKE', 'NOTIONAL', 'EXOTIC_TYPE', 'EXERCISE', 'TYPE', 'UPPER_BARRIER',
+                 'LOWER_BARRIER', 'WINDOW_START_DATE', 'WINDOW_END_DATE', 'SPOT', 'VOLATILITY']
+NUMERIC_FIELDS = ['STRIKE', 'NOTIONAL', 'UPPER_BARRIER', 'LOWER_BARRIER', 'SPOT', 'VOLATILITY']
+SCENARIOS = ['single', 'bulk', 'columns']
+
+
+# Synthetic requests of a scenario as (path, body, number of rows) tuples
+def synthetic_requests(scenario, rng, args):
+    if scenario == 'single':
+        return [('/webpricer', random_mixed_row(rng), 1) for _ in range(args.requests)]
+    requests = []
+    for _ in range(args.bulk_requests):
+        rows = [random_mixed_row(rng) for _ in range(args.bulk_size)]
+        if scenario == 'bulk':
+            requests.append(('/bulkwebpricer', {'payloads': rows, 'engine': args.engine}, len(rows)))
+        else:
+            columns = {field: [float(row[field]) if row[field] else None for row in rows] if field in NUMERIC_FIELDS
+                       else [row[field] for row in rows] for field in OPTION_FIELDS}
+            requests.append(('/bulkwebpricer/columns', {'columns': columns, 'engine': args.engine}, len(rows)))
+    return requests
+
+
+def read_replay(filename):
+    requests = []
+    with open(filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if 'path' in item and 'body' in item:
+                path, body = item['path'], item['body']
+            elif 'payloads' in item:
+                path, body = '/bulkwebpricer', item
+            else:
+                path, body = '/webpricer', item
+            rows = len(body.get('payloads', [])) or len(next(iter(body.get('columns', {}).values()), [])) or 1
+            requests.append((path, body, rows))
+    return requests
+
+
+def write_replay(filename, requests):
+    with open(filename, 'w') as f:
+        for path, body, _ in requests:
+            f.write(json.dumps({'path': path, 'body': body}) + "\n")
+
+
+# In-process client: the FastAPI app driven through Starlette's TestClient
+class InProcessTarget:
+
+    def __init__(self):
+        from fastapi.testclient import TestClient
+        import main
+        self.client = TestClient(main.app)
+        self.client.__enter__()
+
+    def post(self, path, body):
+        return self.client.post(path, json=body).status_code
+
+    def peak_rss_kb(self):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    def close(self):
+        self.client.__exit__(None, None, None)
+
+
+# HTTP client of a running server, or of a uvicorn server started for the run
+class HttpTarget:
+
+    def __init__(self, url=None, port=8799):
+        import requests
+        self.session = requests.Session()
+        self.server = None
+        if url is None:
+            url = f"http://127.0.0.1:{port}"
+            self.server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--no-access-log'],
+                                           cwd=APP_DIR, env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._wait(url)
+        self.url = url
+
+    def _wait(self, url):
+        for _ in range(100):
+            try:
+                if self.session.get(url + '/health').status_code == 200:
+                    return
+            except Exception:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError("uvicorn did not start")
+
+    def post(self, path, body):
+        return self.session.post(self.url + path, json=body).status_code
+
+    # High water mark of the resident set of the server process and its pricing workers (Linux only)
+    def peak_rss_kb(self):
+        if self.server is None:
+            return None
+        total = 0
+        pids = [self.server.pid]
+        while pids:
+            pid = pids.pop()
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    total += next(int(line.split()[1]) for line in f if line.startswith('VmHWM'))
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    with open(f"/proc/{pid}/task/{task}/children") as f:
+                        pids.extend(int(child) for child in f.read().split())
+            except (OSError, StopIteration):
+                continue
+        return total
+
+    def close(self):
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def run(target, requests, concurrency):
+    latencies = []
+    failures = 0
+
+    def send(request):
+        path, body, _ = request
+        start = time.perf_counter()
+        status = target.post(path, body)
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(send, requests))
+    else:
+        outcomes = [send(request) for request in requests]
+    elapsed = time.perf_counter() - start
+
+    for latency, status in outcomes:
+        latencies.append(latency)
+        failures += status != 200
+    rows = sum(request[2] for request in requests)
+    return {
+        'requests': len(requests),
+        'rows': rows,
+        'failures': failures,
+        'seconds': elapsed,
+        'requests_per_second': len(requests) / elapsed,
+        'rows_per_second': rows / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BENCHMARKS_DIR, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+def load_runs(commit):
+    filename = os.path.join(RESULTS_DIR, f"{commit}.json")
+    if not os.path.exists(filename):
+        return []
+    with open(filename) as f:
+        return json.load(f)
+
+
+def store_run(result):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    runs = load_runs(result['commit'])
+    runs.append(result)
+    with open(os.path.join(RESULTS_DIR, f"{result['commit']}.json"), 'w') as f:
+        json.dump(runs, f, indent=2)
+
+
+def print_result(result):
+    print(f"commit {result['commit']}{' (dirty)' if result['dirty'] else ''}, target {result['target']}, "
+          f"peak RSS {result['peak_rss_kb']} kB")
+    for name, metrics in result['scenarios'].items():
+        print(f"  {name:8} {metrics['requests']:6} req {metrics['rows']:8} rows  {metrics['requests_per_second']:9.1f} req/s "
+              f"{metrics['rows_per_second']:10.1f} rows/s  p50 {metrics['p50_ms']:8.2f} ms  p95 {metrics['p95_ms']:8.2f} ms  "
+              f"p99 {metrics['p99_ms']:8.2f} ms  failures {metrics['failures']}")
+
+
+# Relative change of every metric of the scenarios both runs have (latencies: lower is better, throughputs: higher)
+def print_comparison(base, result):
+    print(f"compared with {base['commit']} ({base['time']}, target {base['target']}):")
+    for name, metrics in result['scenarios'].items():
+        if name not in base['scenarios']:
+            continue
+        changes = []
+        for metric in ['rows_per_second', 'p50_ms', 'p95_ms', 'p99_ms']:
+            before = base['scenarios'][name][metric]
+            changes.append(f"{metric} {(metrics[metric] - before) / before * 100:+.1f}%")
+        print(f"  {name:8} " + "  ".join(changes))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target', default='inprocess', help="inprocess, uvicorn or the URL of a running server")
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=200, help="requests of the single scenario")
+    parser.add_argument('--bulk-requests', type=int, default=10, help="requests of the bulk & columns scenarios")
+    parser.add_argument('--bulk-size', type=int, default=1000, help="rows per bulk request")
+    parser.add_argument('--engine', default='vectorized')
+    parser.add_argument('--concurrency', type=int, default=1, help="concurrent requests (HTTP targets only)")
+    parser.add_argument('--replay', help="replay the requests of a file instead of the synthetic scenarios")
+    parser.add_argument('--record', help="write the synthetic requests to a replay file and exit")
+    parser.add_argument('--compare', help="commit to compare with")
+    parser.add_argument('--cache', action='store_true', help="keep the result cache on (off by default so that every row is priced)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        workloads = {os.path.basename(args.replay): read_replay(args.replay)}
+    else:
+        workloads = {scenario: synthetic_requests(scenario, rng, args) for scenario in args.scenarios}
+    if args.record:
+        write_replay(args.record, [request for requests in workloads.values() for request in requests])
+        sys.exit(0)
+
+    os.environ.setdefault('PRICER_LOG_LEVEL', 'WARNING')
+    if not args.cache:
+        os.environ['PRICER_CACHE_SIZE'] = '0'
+    if args.target == 'inprocess':
+        target = InProcessTarget()
+        concurrency = 1
+    else:
+        target = HttpTarget(None if args.target == 'uvicorn' else args.target.rstrip('/'))
+        concurrency = args.concurrency
+
+    try:
+        scenarios = {name: run(target, requests, concurrency) for name, requests in workloads.items()}
+        peak_rss_kb = target.peak_rss_kb()
+    finally:
+        target.close()
+
+    commit, dirty = git_commit()
+    result = {
+        'commit': commit,
+        'dirty': dirty,
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'target': args.target,
+        'execution_mode': os.environ.get('PRICER_EXECUTION_MODE', 'inline'),
+        'engine': args.engine,
+        'concurrency': concurrency,
+        'cache': args.cache,
+        'peak_rss_kb': peak_rss_kb,
+        'scenarios': scenarios
+    }
+    base_runs = load_runs(args.compare) if args.compare else []
+    store_run(result)
+    print_result(result)
+    if args.compare:
+        if base_runs:
+            print_comparison(base_runs[-1], result)
+        else:
+            print(f"no stored results for {args.compare}")
@@ -0,0 +1,82 @@
+# Bytes and encode time per row of the bulk result encodings (app/encoding.py), uncompressed and compressed
+# Usage (from the repo root): python benchmarks/encoding_cost.py [--rows 10000] [--repeat 5] [--seed 42]
+# A synthetic book is priced once with the vectorized engine, then its (index, result) pairs are encoded repeat times:
+# 'fastapi json' is FastAPI's default JSONResponse (jsonable_encoder & json.dumps, the encoding before content
+# negotiation), the others are the negotiated encodings. Compressed rows add gzip, and brotli when it is installed.
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('PRICER_LOG_LEVEL', 'WARNING')
+
+from fastapi.encoders import jsonable_encoder
+
+import encoding
+from pricer import price_batch
+
+from synthetic import random_mixed_row
+
+
+def fastapi_json(option_values):
+    return json.dumps(jsonable_encoder(option_values), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def priced_results(rows):
+    option_values = []
+    for index, value in price_batch(rows, 0, 'vectorized'):
+        option_values.append((index, {"RuntimeError": value[0]} if isinstance(value, list) else value))
+    return option_values
+
+
+# {name: encode function} of the encodings available here
+def encoders():
+    functions = {
+        'fastapi json': fastapi_json,
+        'json': lambda option_values: encoding.dumps(option_values),
+        'compact json': lambda option_values: encoding.dumps(encoding.compact(option_values)),
+    }
+    if encoding.msgpack is not None:
+        functions['msgpack'] = lambda option_values: encoding.msgpack.packb(encoding.compact(option_values), default=float)
+    return functions
+
+
+def compressors():
+    functions = {'gzip': lambda data: zlib.compress(data, encoding.GZIP_LEVEL)}
+    if encoding.brotli is not None:
+        functions['br'] = lambda data: encoding.brotli.compress(data, quality=encoding.BROTLI_QUALITY)
+    return functions
+
+
+def timed(function, value, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function(value)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def print_line(name, rows, size, seconds):
+    print(f"  {name:24} {size / rows:8.1f} bytes/row  {seconds / rows * 1e6:7.2f} us/row")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    option_values = priced_results([random_mixed_row(rng) for _ in range(args.rows)])
+    print(f"{args.rows} rows (orjson: {'yes' if encoding.orjson is not None else 'no'}, "
+          f"msgpack: {'yes' if encoding.msgpack is not None else 'no'}, brotli: {'yes' if encoding.brotli is not None else 'no'})")
+    for name, encode in encoders().items():
+        data, encode_seconds = timed(encode, option_values, args.repeat)
+        print_line(name, args.rows, len(data), encode_seconds)
+        for coding, compress in compressors().items():
+            compressed, compress_seconds = timed(compress, data, args.repeat)
+            print_line(f"{name} + {coding}", args.rows, len(compressed), encode_seconds + compress_seconds)
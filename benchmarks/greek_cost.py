@@ -0,0 +1,108 @@
+# Cost of the bump-and-reprice greeks (app/greeks.py) as a multiple of one NPV, per EXOTIC_TYPE
+# Usage (from the repo root): python benchmarks/greek_cost.py [--rows 256] [--repeat 5] [--seed 42]
+# QuantLib path: a batch of rows is built once, then the NPV of every row is recalculated and the greeks of the batch
+# computed repeat times, for rows with their own quotes ('distinct') and rows sharing one pair, SPOT & VOLATILITY
+# ('shared', e.g. a strike ladder). Barrier greeks take 5 evaluations per row on top of the NPV.
+# Vectorized barrier engine: the NPV of the batch against its NPV & greeks.
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+os.environ.setdefault('PRICER_LOG_LEVEL', 'WARNING')
+
+import QuantLib as ql
+
+from pricer import build_option
+from greeks import batch_greeks
+from metrics import StageClock
+from vectorized import parse_rows
+from vectorized_barrier import barrier_npv, price_barrier_columns
+
+from synthetic import random_row, BARRIER_TYPES, CURRENCY_PAIRS
+
+# (EXOTIC_TYPE, EXERCISE) of the QuantLib path cases
+CASES = [('VANILLA', 'E'), ('VANILLA', 'A')] + [(exotic_type, 'E') for exotic_type in BARRIER_TYPES]
+# Maturities that do not expire within the THETA roll
+MATURITIES = ['1w', '1m', '3M', '6m', '1y', '2Y']
+
+
+def built_options(rows):
+    engines = {}
+    options = []
+    for row in rows:
+        OPTION_PARAM = build_option(row, StageClock(row['EXOTIC_TYPE'], 'quantlib'), engines)
+        if isinstance(OPTION_PARAM, list):
+            continue
+        OPTION_PARAM['OPTION'].setPricingEngine(OPTION_PARAM['ENGINE'])
+        options.append(OPTION_PARAM)
+    return options
+
+
+# Seconds per row of one NPV and of the greeks of the built options
+def time_quantlib(options, repeat):
+    ql.Settings.instance().evaluationDate = options[0]['EVALUATION_DATE']
+    npv_seconds = greek_seconds = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        npvs = []
+        for OPTION_PARAM in options:
+            OPTION_PARAM['OPTION'].recalculate()
+            npvs.append(OPTION_PARAM['OPTION'].NPV())
+        priced = time.perf_counter()
+        batch_greeks(options, npvs)
+        npv_seconds += priced - start
+        greek_seconds += time.perf_counter() - priced
+    count = len(options) * repeat
+    return npv_seconds / count, greek_seconds / count
+
+
+# Rows of a case, 'shared' rows differ by STRIKE & NOTIONAL only
+def case_rows(rng, exotic_type, exercise, quotes, count):
+    rows = [random_row(rng, exotic_types=[exotic_type], exercises=[exercise], currency_pairs=CURRENCY_PAIRS, maturities=MATURITIES)
+            for _ in range(count)]
+    if quotes == 'shared':
+        rows = [dict(row, CURRENCY_PAIR=rows[0]['CURRENCY_PAIR'], SPOT=rows[0]['SPOT'], VOLATILITY=rows[0]['VOLATILITY'],
+                     UPPER_BARRIER=rows[0]['UPPER_BARRIER'], LOWER_BARRIER=rows[0]['LOWER_BARRIER']) for row in rows]
+    return rows
+
+
+def time_vectorized(rows, repeat):
+    indices, columns = parse_rows(rows, BARRIER_TYPES)
+    npv_seconds = total_seconds = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        barrier_npv(columns, columns['SPOT'], columns['VOLATILITY'])
+        priced = time.perf_counter()
+        price_barrier_columns(columns)
+        npv_seconds += priced - start
+        total_seconds += time.perf_counter() - priced
+    return len(indices), npv_seconds / repeat, total_seconds / repeat
+
+
+def print_line(name, rows, npv_seconds, greek_seconds):
+    print(f"  {name:24} {rows:6} rows  NPV {npv_seconds * 1e6:9.1f} us  greeks {greek_seconds * 1e6:9.1f} us  "
+          f"greeks / NPV {greek_seconds / npv_seconds:5.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=256, help="rows per case (one QuantLib batch)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print("quantlib (per row):")
+    for exotic_type, exercise in CASES:
+        for quotes in ['distinct', 'shared']:
+            options = built_options(case_rows(rng, exotic_type, exercise, quotes, args.rows))
+            if options:
+                print_line(f"{exotic_type} {exercise} {quotes}", len(options), *time_quantlib(options, args.repeat))
+
+    rows = [random_row(rng, exotic_types=BARRIER_TYPES, exercises=['E'], maturities=MATURITIES) for _ in range(args.rows * 20)]
+    priced, npv_seconds, total_seconds = time_vectorized(rows, args.repeat)
+    print("vectorized (per batch, NPV & greeks against NPV only):")
+    print_line("BARRIER", priced, npv_seconds, total_seconds)
@@ -0,0 +1,150 @@
+# Cross-check of the vectorized NumPy engines (vanilla & barrier) against the QuantLib reference path,
+# and of the path simulation engine against the analytic price of discrete geometric Asian options
+# Usage (from the repo root): python benchmarks/parity.py [--rows 2000] [--timing-rows 100000] [--tolerance 1e-6] [--greek-tolerance 1e-3]
+#                             [--asian-rows 20] [--standard-errors 4]
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+
+from pricer import price_option, build_option
+from metrics import StageClock
+from montecarlo import simulation_inputs
+from vectorized import garman_kohlhagen, parse_rows, parse_vanilla_rows, price_vanilla_columns, price_vanilla_rows
+from vectorized_barrier import price_barrier_columns, price_barrier_rows
+
+from synthetic import random_row, BARRIER_TYPES
+
+FIELDS = ['OPTION_NPV', 'PREMIUM', 'DELTA', 'GAMMA', 'VEGA', 'THETA']
+GREEKS = ['DELTA', 'GAMMA', 'VEGA', 'THETA']
+# Values below these magnitudes are compared in absolute terms (one unit of currency for the notional-scaled fields)
+ABSOLUTE_FLOOR = {'OPTION_NPV': 1e-6, 'PREMIUM': 1.0, 'DELTA': 1.0, 'GAMMA': 1e-4, 'VEGA': 1.0, 'THETA': 1.0}
+MATURITIES = ['1d', '1w', '2W', '1m', '3M', '6m', '9M', '1y', '2Y', '15Dec2027', '30Jun2028']
+
+
+def random_vanilla_row(rng):
+    return random_row(rng, exotic_types=['VANILLA'], exercises=['E'], maturities=MATURITIES)
+
+
+def random_barrier_row(rng):
+    return random_row(rng, exotic_types=BARRIER_TYPES, exercises=['E'], maturities=MATURITIES)
+
+
+def random_asian_row(rng):
+    return random_row(rng, exotic_types=['GEO_ASIAN'], exercises=['E'], maturities=MATURITIES)
+
+
+# Largest relative difference per field between the reference and the candidate results
+# Rows the candidate left to the QuantLib path are skipped, both sides must agree on a missing (None) THETA
+def compare(reference, candidate, fields):
+    worst = {field: 0.0 for field in fields}
+    for i, expected in reference.items():
+        if i not in candidate:
+            continue
+        for field in fields:
+            if expected[field] is None or candidate[i][field] is None:
+                if expected[field] is not candidate[i][field]:
+                    worst[field] = float('inf')
+                continue
+            scale = max(abs(expected[field]), ABSOLUTE_FLOOR[field])
+            worst[field] = max(worst[field], abs(candidate[i][field] - expected[field]) / scale)
+    return worst
+
+
+def within(worst, tolerance, greek_tolerance):
+    return all(value <= (greek_tolerance if field in GREEKS else tolerance) for field, value in worst.items())
+
+
+def check_vanilla(rows, tolerance):
+    reference = {i: price_option(row) for i, row in enumerate(rows)}
+    candidate = price_vanilla_rows(rows)
+    worst = compare(reference, candidate, FIELDS)
+    print(f"VANILLA: {len(candidate)}/{len(rows)} rows priced, max relative difference {worst}")
+    return within(worst, tolerance, tolerance)
+
+
+# Finite-difference greeks amplify round-off of the NPV, so they get their own tolerance
+def check_barrier(rows, tolerance, greek_tolerance):
+    candidate = price_barrier_rows(rows)
+    reference = {i: price_option(row) for i, row in enumerate(rows) if i in candidate}
+    worst = compare(reference, candidate, FIELDS)
+    print(f"BARRIER: {len(candidate)}/{len(rows)} rows priced, max relative difference {worst}")
+    return within(worst, tolerance, greek_tolerance)
+
+
+# Closed-form OPTION_NPV of a GEO_ASIAN row on the dates, rates & volatility of its simulation: the log of the
+# geometric average is normal (QuantLib's analytic engine measures the variance in the rate curves' day count instead)
+def geometric_asian_npv(row):
+    OPTION_PARAM = build_option(row, StageClock('GEO_ASIAN', 'quantlib'))
+    if isinstance(OPTION_PARAM, list):
+        return None
+    inputs = simulation_inputs(OPTION_PARAM)
+    times = inputs['T_VOL'][inputs['FIXINGS']]
+    volatility = inputs['VOLATILITY']
+    log_forward = math.log(inputs['SPOT']) + np.mean(inputs['DRIFT'][inputs['FIXINGS']] - 0.5 * volatility * volatility * times)
+    variance = volatility * volatility * np.minimum.outer(times, times).sum() / len(times) ** 2
+    forward = math.exp(log_forward + 0.5 * variance)
+    black = garman_kohlhagen(forward, inputs['STRIKE'], 0.0, 0.0, math.sqrt(variance), 1.0, 1.0, inputs['IS_CALL'])
+    return inputs['DISCOUNT'] * float(black['NPV'])
+
+
+# Simulated prices are estimates: each must be within standard_errors of its STD_ERROR (plus the OPTION_NPV floor,
+# paths that all expire worthless have no error) from the closed-form price
+def check_geometric_asian(rows, standard_errors):
+    worst = 0.0
+    priced = 0
+    for row in rows:
+        candidate = price_option(row)
+        expected = geometric_asian_npv(row)
+        if isinstance(candidate, list) or expected is None:
+            continue
+        priced += 1
+        difference = max(abs(candidate['OPTION_NPV'] - expected) - ABSOLUTE_FLOOR['OPTION_NPV'], 0.0)
+        if difference > 0:
+            worst = max(worst, difference / candidate['STD_ERROR'] if candidate['STD_ERROR'] > 0 else float('inf'))
+    print(f"GEO_ASIAN: {priced}/{len(rows)} rows simulated, max difference {worst:.2f} standard errors")
+    return worst <= standard_errors
+
+
+def time_vanilla(rows):
+    start = time.perf_counter()
+    indices, columns = parse_vanilla_rows(rows)
+    parsed = time.perf_counter()
+    price_vanilla_columns(columns)
+    priced = time.perf_counter()
+    print(f"VANILLA: {len(indices)} rows parsed in {parsed - start:.3f}s, priced in {priced - parsed:.3f}s")
+
+
+def time_barrier(rows):
+    start = time.perf_counter()
+    indices, columns = parse_rows(rows, BARRIER_TYPES)
+    parsed = time.perf_counter()
+    price_barrier_columns(columns)
+    priced = time.perf_counter()
+    print(f"BARRIER: {len(indices)} rows parsed in {parsed - start:.3f}s, priced with greeks in {priced - parsed:.3f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--timing-rows', type=int, default=100000)
+    parser.add_argument('--tolerance', type=float, default=1e-6)
+    parser.add_argument('--greek-tolerance', type=float, default=1e-3)
+    parser.add_argument('--asian-rows', type=int, default=20)
+    parser.add_argument('--standard-errors', type=float, default=4.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ok = check_vanilla([random_vanilla_row(rng) for _ in range(args.rows)], args.tolerance)
+    ok = check_barrier([random_barrier_row(rng) for _ in range(args.rows)], args.tolerance, args.greek_tolerance) and ok
+    ok = check_geometric_asian([random_asian_row(rng) for _ in range(args.asian_rows)], args.standard_errors) and ok
+    time_vanilla([random_vanilla_row(rng) for _ in range(args.timing_rows)])
+    time_barrier([random_barrier_row(rng) for _ in range(args.timing_rows)])
+    sys.exit(0 if ok else 1)
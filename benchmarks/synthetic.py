@@ -0,0 +1,44 @@
+# Random pricing rows (the 13 string fields of a /webpricer payload) shared by the benchmark scripts
+import datetime
+
+EXOTIC_TYPES = ['VANILLA', 'KO_BARRIER', 'KI_BARRIER', 'KO_DB_BARRIER', 'KI_DB_BARRIER', 'KIKO', 'KOKI']
+BARRIER_TYPES = ['KO_BARRIER', 'KI_BARRIER', 'KO_DB_BARRIER', 'KI_DB_BARRIER']
+EXERCISES = ['E', 'A']
+# Pairs with rates for both currencies, and pairs the pricer rejects or cannot price
+CURRENCY_PAIRS = ['EURUSD', 'USDEUR', 'GBPUSD', 'USDGBP', 'EURGBP', 'GBPEUR']
+UNSUPPORTED_CURRENCY_PAIRS = ['AUDUSD', 'USDJPY', 'XXXYYY']
+# Tenors in every format the pricer accepts: days, weeks, months, years and dates
+TENORS = ['1d', '1w', '2W', '1m', '3M', '6m', '9M', '1y', '2Y']
+
+
+def maturity_dates(today=None):
+    today = today or datetime.date.today()
+    return [(today + datetime.timedelta(days=days)).strftime('%d%b%Y') for days in [45, 200, 400, 800]]
+
+
+def random_row(rng, exotic_types=None, exercises=None, currency_pairs=None, maturities=None):
+    spot = rng.uniform(0.6, 1.6)
+    exotic_type = rng.choice(exotic_types or EXOTIC_TYPES)
+    barriers = exotic_type != 'VANILLA'
+    return {
+        'CURRENCY_PAIR': rng.choice(currency_pairs or CURRENCY_PAIRS),
+        'MATURITY': rng.choice(maturities or TENORS + maturity_dates()),
+        'STRIKE': str(round(spot * rng.uniform(0.8, 1.2), 4)),
+        'NOTIONAL': str(rng.choice([100000, 1000000, 2500000])),
+        'EXOTIC_TYPE': exotic_type,
+        'EXERCISE': rng.choice(exercises or EXERCISES),
+        'TYPE': rng.choice(['CALL', 'PUT']),
+        'UPPER_BARRIER': str(round(spot * rng.uniform(1.02, 1.3), 4)) if barriers else '',
+        'LOWER_BARRIER': str(round(spot * rng.uniform(0.7, 0.98), 4)) if barriers else '',
+        'WINDOW_START_DATE': '',
+        'WINDOW_END_DATE': '',
+        'SPOT': str(round(spot, 4)),
+        'VOLATILITY': str(round(rng.uniform(0.03, 0.4), 4))
+    }
+
+
+# A mix of every EXOTIC_TYPE, exercise, tenor format and currency pair, with a share of rows the pricer rejects
+def random_mixed_row(rng, error_share=0.05):
+    if rng.random() < error_share:
+        return random_row(rng, currency_pairs=UNSUPPORTED_CURRENCY_PAIRS)
+    return random_row(rng)
@@ -146,6 +146,26 @@ function sendRequest() {
 }
 
 
+// [index, {field: value}] pairs of a compact response ({FIELDS: [...], ROWS: [[index, value, ...], ...]}),
+// error rows are [index, {RuntimeError: ...}] already
+function expandCompactRows(data) {
+  var pairs = [];
+  for (var i = 0; i < data.ROWS.length; i++) {
+    var line = data.ROWS[i];
+    if (line.length === 2 && line[1] !== null && typeof line[1] === "object") {
+      pairs.push(line);
+      continue;
+    }
+    var result = {};
+    for (var k = 0; k < data.FIELDS.length; k++) {
+      result[data.FIELDS[k]] = line[k + 1];
+    }
+    pairs.push([line[0], result]);
+  }
+  return pairs;
+}
+
+
 //  Break down sendRequest into a single row, then create a for loop which packages all json objects and then sends to server
 function sendBulkRequest() {
   var url = ipAddress + "/bulkwebpricer";  // The server's URL
@@ -208,12 +228,14 @@ function sendBulkRequest() {
   var options = {
     method: "post",
     contentType: "application/json",
+    // Compact rows: the field names once, then one array of values per row (gzip is handled by UrlFetchApp)
+    headers: { Accept: "application/vnd.webpricer.compact+json" },
     payload: JSON.stringify({ payloads: payloads }) // Pass payloads array directly as JSON payload
   };
 
   // Send the HTTP request to the server
   var response = UrlFetchApp.fetch(url, options);
-  var responseData = JSON.parse(response.getContentText());
+  var responseData = expandCompactRows(JSON.parse(response.getContentText()));
   console.log(responseData);
 
   var i = 0;
@@ -248,3 +270,216 @@ function sendBulkRequest() {
   }
 
 }
+
+
+// Same as sendBulkRequest, but reads the sheet in one go and sends one array per field (columnar format)
+// Numeric fields are sent as numbers and the results come back as one array per field
+function sendColumnarBulkRequest() {
+  var url = ipAddress + "/bulkwebpricer/columns";  // The server's URL
+
+  var sheet = SpreadsheetApp.getActiveSpreadsheet().getActiveSheet();
+
+  var firstRow = 5;
+  var fields = ["CURRENCY_PAIR", "MATURITY", "STRIKE", "NOTIONAL", "EXOTIC_TYPE", "EXERCISE", "TYPE",
+                "UPPER_BARRIER", "LOWER_BARRIER", "WINDOW_START_DATE", "WINDOW_END_DATE", "SPOT", "VOLATILITY"];
+  var numericFields = ["STRIKE", "NOTIONAL", "UPPER_BARRIER", "LOWER_BARRIER", "SPOT", "VOLATILITY"];
+
+  // Rows B5:N until the B column is empty
+  var values = sheet.getRange(firstRow, 2, Math.max(sheet.getLastRow() - firstRow + 1, 1), fields.length).getValues();
+  var numRows = 0;
+  while (numRows < values.length && values[numRows][0]) {
+    numRows++;
+  }
+  if (numRows === 0) {
+    return;
+  }
+
+  // One array per field
+  var columns = {};
+  for (var j = 0; j < fields.length; j++) {
+    var column = [];
+    for (var i = 0; i < numRows; i++) {
+      var value = values[i][j];
+      if (numericFields.indexOf(fields[j]) >= 0) {
+        column.push(value === "" ? null : value);
+      } else {
+        column.push(String(value));
+      }
+    }
+    columns[fields[j]] = column;
+  }
+
+  var options = {
+    method: "post",
+    contentType: "application/json",
+    payload: JSON.stringify({ engine: "vectorized", columns: columns })
+  };
+
+  // Send the HTTP request to the server
+  var response = UrlFetchApp.fetch(url, options);
+  var responseData = JSON.parse(response.getContentText());
+
+  // Errors go to column A, results to columns O, P, R, S, T
+  var errors = [];
+  var prices = [];
+  var greeks = [];
+  for (var i = 0; i < numRows; i++) {
+    if (responseData.RuntimeError[i] !== null) {
+      errors.push([responseData.RuntimeError[i]]);
+      prices.push(["", ""]);
+      greeks.push(["", "", ""]);
+    } else {
+      errors.push([""]);
+      prices.push([responseData.OPTION_NPV[i], responseData.PREMIUM[i]]);
+      greeks.push([responseData.DELTA[i], responseData.GAMMA[i], responseData.VEGA[i]]);
+    }
+  }
+  sheet.getRange(firstRow, 1, numRows, 1).setValues(errors);
+  sheet.getRange(firstRow, 15, numRows, 2).setValues(prices);
+  sheet.getRange(firstRow, 18, numRows, 3).setValues(greeks);
+}
+
+// Prices the sheet through /portfolio and writes the PREMIUM & greeks summed per currency pair, then per
+// currency pair, exotic type & maturity bucket, to the "Portfolio" sheet instead of one result per row
+function sendPortfolioRequest() {
+  var url = ipAddress + "/portfolio";  // The server's URL
+
+  var spreadsheet = SpreadsheetApp.getActiveSpreadsheet();
+  var sheet = spreadsheet.getActiveSheet();
+
+  var firstRow = 5;
+  var fields = ["CURRENCY_PAIR", "MATURITY", "STRIKE", "NOTIONAL", "EXOTIC_TYPE", "EXERCISE", "TYPE",
+                "UPPER_BARRIER", "LOWER_BARRIER", "WINDOW_START_DATE", "WINDOW_END_DATE", "SPOT", "VOLATILITY"];
+
+  // Rows B5:N until the B column is empty
+  var values = sheet.getRange(firstRow, 2, Math.max(sheet.getLastRow() - firstRow + 1, 1), fields.length).getValues();
+  var payloads = [];
+  for (var i = 0; i < values.length && values[i][0]; i++) {
+    var payload = {};
+    for (var j = 0; j < fields.length; j++) {
+      payload[fields[j]] = String(values[i][j]);
+    }
+    payloads.push(payload);
+  }
+  if (payloads.length === 0) {
+    return;
+  }
+
+  var options = {
+    method: "post",
+    contentType: "application/json",
+    payload: JSON.stringify({ engine: "vectorized", payloads: payloads })
+  };
+
+  // Send the HTTP request to the server
+  var response = UrlFetchApp.fetch(url, options);
+  var responseData = JSON.parse(response.getContentText());
+
+  var output = spreadsheet.getSheetByName("Portfolio") || spreadsheet.insertSheet("Portfolio");
+  output.clearContents();
+  var greeks = ["PREMIUM", "DELTA", "GAMMA", "VEGA", "THETA"];
+  var table = [["CURRENCY_PAIR", "EXOTIC_TYPE", "MATURITY_BUCKET", "ROWS"].concat(greeks)];
+  var groups = responseData.PAIRS.concat(responseData.GROUPS);
+  for (var k = 0; k < groups.length; k++) {
+    // Per pair totals have no exotic type & maturity bucket
+    var line = [groups[k].CURRENCY_PAIR, groups[k].EXOTIC_TYPE || "ALL", groups[k].MATURITY_BUCKET || "ALL", groups[k].ROWS];
+    for (var g = 0; g < greeks.length; g++) {
+      line.push(groups[k][greeks[g]]);
+    }
+    table.push(line);
+  }
+  table.push(["ROWS", responseData.ROWS, "ERRORS", responseData.ERRORS, "", "", "", "", ""]);
+  output.getRange(1, 1, table.length, table[0].length).setValues(table);
+}
+
+// Same as sendColumnarBulkRequest, but only sends the rows edited since the last sync and only writes the results
+// that changed, through /bulkwebpricer/sync. Each row gets a stable key in column Y and the hash of its inputs
+// as of the last sync in column Z
+function sendSyncRequest() {
+  var url = ipAddress + "/bulkwebpricer/sync";  // The server's URL
+
+  var spreadsheet = SpreadsheetApp.getActiveSpreadsheet();
+  var sheet = spreadsheet.getActiveSheet();
+
+  var firstRow = 5;
+  var keyColumn = 25;
+  var fields = ["CURRENCY_PAIR", "MATURITY", "STRIKE", "NOTIONAL", "EXOTIC_TYPE", "EXERCISE", "TYPE",
+                "UPPER_BARRIER", "LOWER_BARRIER", "WINDOW_START_DATE", "WINDOW_END_DATE", "SPOT", "VOLATILITY"];
+
+  // Rows B5:N until the B column is empty, with their keys & hashes
+  var lastRow = Math.max(sheet.getLastRow() - firstRow + 1, 1);
+  var values = sheet.getRange(firstRow, 2, lastRow, fields.length).getValues();
+  var numRows = 0;
+  while (numRows < values.length && values[numRows][0]) {
+    numRows++;
+  }
+  if (numRows === 0) {
+    return;
+  }
+  var keys = sheet.getRange(firstRow, keyColumn, numRows, 2).getValues();
+
+  var rows = [];
+  var payloads = {};
+  var rowOfKey = {};
+  for (var i = 0; i < numRows; i++) {
+    var payload = {};
+    for (var j = 0; j < fields.length; j++) {
+      payload[fields[j]] = String(values[i][j]);
+    }
+    var hash = Utilities.base64Encode(Utilities.computeDigest(Utilities.DigestAlgorithm.MD5, JSON.stringify(payload)));
+    if (!keys[i][0]) {
+      keys[i][0] = Utilities.getUuid();
+    }
+    var key = String(keys[i][0]);
+    rowOfKey[key] = firstRow + i;
+    payloads[key] = payload;
+    // Unchanged rows are sent without their inputs
+    rows.push(keys[i][1] === hash ? { KEY: key, HASH: hash } : { KEY: key, HASH: hash, payload: payload });
+    keys[i][1] = hash;
+  }
+
+  var session = spreadsheet.getId() + ":" + sheet.getSheetId();
+  var responseData = postSync(url, session, rows);
+  // Rows the server needs the inputs of (new market data), sent again with them
+  if (responseData.MISSING.length > 0) {
+    var isMissing = {};
+    for (var k = 0; k < responseData.MISSING.length; k++) {
+      isMissing[responseData.MISSING[k]] = true;
+    }
+    // The other rows are sent without their inputs, they are up to date
+    var resent = [];
+    for (var i = 0; i < numRows; i++) {
+      var key = String(keys[i][0]);
+      resent.push(isMissing[key] ? { KEY: key, HASH: keys[i][1], payload: payloads[key] } : { KEY: key, HASH: keys[i][1] });
+    }
+    var changed = responseData.CHANGED;
+    responseData = postSync(url, session, resent);
+    responseData.CHANGED = changed.concat(responseData.CHANGED);
+  }
+
+  // Errors go to column A, results to columns O, P, R, S, T, of the rows that changed only
+  for (var k = 0; k < responseData.CHANGED.length; k++) {
+    var row = rowOfKey[responseData.CHANGED[k][0]];
+    var result = responseData.CHANGED[k][1];
+    if (result.hasOwnProperty("RuntimeError")) {
+      sheet.getRange(row, 1).setValue(result.RuntimeError);
+      sheet.getRange(row, 15, 1, 2).setValues([["", ""]]);
+      sheet.getRange(row, 18, 1, 3).setValues([["", "", ""]]);
+    } else {
+      sheet.getRange(row, 1).setValue("");
+      sheet.getRange(row, 15, 1, 2).setValues([[result.OPTION_NPV, result.PREMIUM]]);
+      sheet.getRange(row, 18, 1, 3).setValues([[result.DELTA, result.GAMMA, result.VEGA]]);
+    }
+  }
+  sheet.getRange(firstRow, keyColumn, numRows, 2).setValues(keys);
+}
+
+function postSync(url, session, rows) {
+  var options = {
+    method: "post",
+    contentType: "application/json",
+    payload: JSON.stringify({ session: session, engine: "vectorized", rows: rows })
+  };
+  var response = UrlFetchApp.fetch(url, options);
+  return JSON.parse(response.getContentText());
+}